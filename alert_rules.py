@@ -0,0 +1,455 @@
+import configparser
+import heapq
+import math
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+
+from time_wheel import parse_window, format_window, WHEEL_SPAN
+
+# Alert rules beyond the high traffic alert, declared in a rules file:
+#
+#   [api-rate]
+#   rule = section_rate
+#   section = /api
+#   window = 1m
+#   above = 50
+#
+#   [errors]
+#   rule = error_ratio
+#   section = *
+#   window = 2m
+#   above = 0.05
+#   below = 0.02
+#   min_hits = 100
+#
+#   [host-budget]
+#   rule = host_bytes
+#   host = *
+#   window = 10m
+#   above = 100000000
+#
+#   [burst]
+#   rule = traffic
+#   metric = hits
+#   window = 30s
+#   above = 500
+#
+# section_rate is the hits per second of a section, error_ratio the ratio of
+# 5xx responses of a section, or of all the traffic without section, and
+# host_bytes the bytes sent to a host. traffic is the hits or bytes per second,
+# or the ratio of 5xx responses, of all the traffic over a sliding window of the
+# time wheel, up to a day, evaluated each time the sliding windows are refreshed
+# rather than when frames close. A rule goes on for a key above its "above"
+# threshold, and off at or below its "below" threshold, 90% of "above" by
+# default, so that a value hovering around the threshold does not flap. "*"
+# applies the rule to every section or host. Windows of the other rules are
+# rounded up to whole frames, one frame by default.
+#
+# Rules are compiled once into windowed counters of the frame counters, one
+# per metric and window, shared by the rules over the same window. When a frame
+# closes, a counter adds the frame and removes the frame leaving the window,
+# and returns the keys whose sums changed: only these keys are evaluated, by the
+# rules of these keys and the "*" rules. Counters only keep the keys of their
+# rules when no "*" rule uses them, otherwise the MAX_WINDOW_KEYS // frames
+# largest counts of each frame, so that a scan from millions of hosts does not
+# grow them: a key is left out of a frame only when it counts less than all the
+# kept ones. "*" rules over the same values sort them once, and each scans the
+# keys above its threshold and the keys it is on for.
+
+RULE_ANY = '*'
+# key of the error ratio over all sections
+ALL_SECTIONS = ''
+# "below" threshold when not given, relative to "above"
+DEFAULT_HYSTERESIS = 0.9
+# keys summed by a counter of "*" rules, over all the frames of its window
+MAX_WINDOW_KEYS = 100000
+
+# metric -> counts of a closed FrameStats
+METRICS = {
+    'section_hits': lambda frame: frame.section_hits,
+    'section_errors': lambda frame: frame.section_errors,
+    'host_bytes': lambda frame: frame.host_bytes,
+    'hits': lambda frame: {ALL_SECTIONS: frame.hit_count},
+    'errors': lambda frame: {ALL_SECTIONS: frame.error_count},
+}
+
+
+class WindowedCounter(object):
+    '''
+    Sums per key of a metric over the last frames, keys are all the keys
+    counted when None, up to max_keys.
+    '''
+
+    def __init__(self, metric, frames, keys=None, max_keys=MAX_WINDOW_KEYS):
+        self.metric = metric
+        self.sums = dict()
+        self._keys = keys
+        # largest counts kept of each frame counting all keys
+        self._frame_keys = max(1, max_keys // frames)
+        # counts of each frame in the window
+        self._frames = deque(maxlen=frames)
+
+    def update(self, counts):
+        # count a frame, return the keys whose sums changed
+        keys = self._keys
+        if keys is not None:
+            if len(counts) < len(keys):
+                counts = {key: count for key, count in counts.items() if key in keys}
+            else:
+                counts = {key: counts[key] for key in keys if key in counts}
+        elif len(counts) > self._frame_keys:
+            counts = dict(heapq.nlargest(self._frame_keys, counts.items(), key=lambda x: x[1]))
+        sums = self.sums
+        changed = set(counts)
+        if len(self._frames) == self._frames.maxlen:
+            expired = self._frames[0]
+            for key, count in expired.items():
+                total = sums[key] - count
+                if total:
+                    sums[key] = total
+                else:
+                    del sums[key]
+            changed.update(expired)
+        get = sums.get
+        for key, count in counts.items():
+            sums[key] = get(key, 0) + count
+        self._frames.append(counts)
+        return changed
+
+
+class Rule(ABC):
+    # option naming the key of the rule, and metrics it is evaluated on
+    key_option = None
+    metrics = ()
+    # evaluated on the sliding windows of the time wheel, not on frames
+    sliding = False
+
+    def __init__(self, name, key, window, above, below):
+        self.name = name
+        self.key = key
+        self.window = window
+        self.above = above
+        self.below = below
+        # keys the rule is on for
+        self.firing = set()
+
+    @property
+    def value_key(self):
+        # rules with the same value key and counters have the same values
+        return type(self)
+
+    @abstractmethod
+    def values(self, keys, sums):
+        # values of the keys, sums are the sums of the metrics by key
+        pass
+
+    @abstractmethod
+    def describe(self, key, value):
+        # what the value of the key is, in alert messages
+        pass
+
+    def check(self, keys, values, at, alerts):
+        # append (alert_on, alert_msg) to alerts for the keys going on or
+        # off, at is the time of the frame as shown in messages
+        firing = self.firing
+        above = self.above
+        below = self.below
+        for key, value in zip(keys, values):
+            if key in firing:
+                if value <= below:
+                    firing.discard(key)
+                    alerts.append((False, 'Rule {} Off - {}, returned to normal at {}'.format(
+                        self.name, self.describe(key, value), at)))
+            elif value > above:
+                firing.add(key)
+                alerts.append((True, 'Rule {} generated an alert - {}, triggered at {}'.format(
+                    self.name, self.describe(key, value), at)))
+
+    def check_sorted(self, ranked, values, keys, sums, at, alerts):
+        # check of a "*" rule, ranked are the (value, key) of values by
+        # decreasing value, values the value by key for the changed keys
+        firing = self.firing
+        above = self.above
+        for value, key in ranked:
+            if value <= above:
+                break
+            if key not in firing:
+                self.check((key, ), (value, ), at, alerts)
+        if firing:
+            for key in firing.intersection(keys):
+                value = values.get(key)
+                if value is None:
+                    value = self.values((key, ), sums)[0]
+                if value <= self.below:
+                    self.check((key, ), (value, ), at, alerts)
+
+
+class SectionRateRule(Rule):
+    key_option = 'section'
+    metrics = ('section_hits', )
+
+    def values(self, keys, sums):
+        hits = sums[0]
+        window = self.window
+        return [hits.get(key, 0) / window for key in keys]
+
+    def describe(self, key, value):
+        return f'section {key} at {value:.2f} hits/s over {format_window(self.window)}'
+
+
+class ErrorRatioRule(Rule):
+    key_option = 'section'
+    metrics = ('section_errors', 'section_hits')
+
+    def __init__(self, name, key, window, above, below, min_hits=1):
+        super().__init__(name, key, window, above, below)
+        if key == ALL_SECTIONS:
+            self.metrics = ('errors', 'hits')
+        # too few hits give no ratio
+        self.min_hits = min_hits
+
+    @property
+    def value_key(self):
+        return type(self), self.min_hits
+
+    def values(self, keys, sums):
+        errors, hits = sums
+        min_hits = self.min_hits
+        values = []
+        for key in keys:
+            key_hits = hits.get(key, 0)
+            values.append(errors.get(key, 0) / key_hits if key_hits >= min_hits else 0)
+        return values
+
+    def describe(self, key, value):
+        return '{} 5xx ratio {:.1%} over {}'.format(
+            f'section {key}' if key else 'all sections', value, format_window(self.window))
+
+
+class HostBytesRule(Rule):
+    key_option = 'host'
+    metrics = ('host_bytes', )
+
+    def values(self, keys, sums):
+        host_bytes = sums[0]
+        return [host_bytes.get(key, 0) for key in keys]
+
+    def describe(self, key, value):
+        return f'host {key} got {value:.0f} bytes over {format_window(self.window)}'
+
+
+# metric of a traffic rule -> index in the rates of a sliding window
+TRAFFIC_METRICS = {'hits': 0, 'bytes': 1, 'error_ratio': 2}
+
+
+class TrafficRule(Rule):
+    sliding = True
+
+    def __init__(self, name, key, window, above, below, metric='hits'):
+        super().__init__(name, key, window, above, below)
+        self.metric = metric
+
+    def values(self, keys, rates):
+        # rates are the (hits per second, bytes per second, ratio of 5xx) of
+        # the window
+        return [rates[TRAFFIC_METRICS[self.metric]] for _ in keys]
+
+    def describe(self, key, value):
+        if self.metric == 'error_ratio':
+            return f'traffic 5xx ratio {value:.1%} over {format_window(self.window)}'
+        unit = 'hits/s' if self.metric == 'hits' else 'bytes/s'
+        return f'traffic at {value:.2f} {unit} over {format_window(self.window)}'
+
+
+RULE_TYPES = {
+    'section_rate': SectionRateRule,
+    'error_ratio': ErrorRatioRule,
+    'host_bytes': HostBytesRule,
+    'traffic': TrafficRule,
+}
+
+
+class RuleGroup(object):
+    # rules over the same counters, by value key
+    def __init__(self, counters):
+        self.counters = counters
+        # value key -> key -> [rules]
+        self.rules = dict()
+        # value key -> [lowest "below" threshold, "*" rules]
+        self.any_rules = dict()
+
+
+class RuleEngine(object):
+    '''
+    Evaluates rules on each closed frame, see evaluate. definitions are the
+    (name, options) of the rules, as read from the rules file.
+    '''
+
+    def __init__(self, rules, frame_interval, definitions=None):
+        self.definitions = definitions
+        self._rules = rules
+        # rules evaluated on the sliding windows, see evaluate_windows
+        self._sliding_rules = [rule for rule in rules if rule.sliding]
+        rules = [rule for rule in rules if not rule.sliding]
+        # (metric, frames) -> keys of the rules, None for all keys
+        counter_keys = dict()
+        for rule in rules:
+            frames = self._frames(rule, frame_interval)
+            for metric in rule.metrics:
+                keys = counter_keys.setdefault((metric, frames), set())
+                if rule.key == RULE_ANY:
+                    counter_keys[(metric, frames)] = None
+                elif keys is not None:
+                    keys.add(rule.key)
+        self._counters = {(metric, frames): WindowedCounter(metric, frames, keys)
+                          for (metric, frames), keys in counter_keys.items()}
+        # (metrics, frames) -> RuleGroup
+        self._groups = dict()
+        for rule in rules:
+            frames = self._frames(rule, frame_interval)
+            group = self._groups.get((rule.metrics, frames))
+            if group is None:
+                group = RuleGroup([self._counters[(metric, frames)]
+                                   for metric in rule.metrics])
+                self._groups[(rule.metrics, frames)] = group
+            if rule.key == RULE_ANY:
+                any_rules = group.any_rules.setdefault(rule.value_key, [rule.below, []])
+                any_rules[0] = min(any_rules[0], rule.below)
+                any_rules[1].append(rule)
+            else:
+                group.rules.setdefault(rule.value_key, dict()).setdefault(rule.key, []).append(rule)
+
+    @staticmethod
+    def _frames(rule, frame_interval):
+        return max(1, round(rule.window / frame_interval))
+
+    def __len__(self):
+        return len(self._rules)
+
+    @property
+    def windows(self):
+        # windows in seconds of the rules evaluated on the sliding windows
+        return sorted({rule.window for rule in self._sliding_rules})
+
+    @property
+    def firing(self):
+        # number of (rule, key) on
+        return sum(len(rule.firing) for rule in self._rules)
+
+    def evaluate(self, frame, now):
+        # count a closed frame, return the [(alert_on, alert_msg)] of the
+        # rules going on or off
+        changed = dict()
+        for (metric, frames), counter in self._counters.items():
+            changed[counter] = counter.update(METRICS[metric](frame))
+        alerts = []
+        at = time.strftime('%H:%M:%S', time.localtime(now))
+        for group in self._groups.values():
+            counters = group.counters
+            keys = changed[counters[0]]
+            if len(counters) > 1:
+                keys = keys.union(*(changed[counter] for counter in counters[1:]))
+            if not keys:
+                continue
+            sums = [counter.sums for counter in counters]
+            for rules in group.rules.values():
+                # values computed at once for the keys of the rules, rules
+                # only checked when going on or off
+                rule_keys = list(rules.keys() & keys)
+                if not rule_keys:
+                    continue
+                key_values = rules[rule_keys[0]][0].values(rule_keys, sums)
+                for key, value in zip(rule_keys, key_values):
+                    for rule in rules[key]:
+                        if value <= rule.below if key in rule.firing else value > rule.above:
+                            rule.check((key, ), (value, ), at, alerts)
+            if group.any_rules:
+                changed_keys = list(keys)
+            for below, any_rules in group.any_rules.values():
+                # "*" rules of the same kind share their values, ranked once
+                # above the lowest "below" threshold of these rules
+                values = {key: value for key, value in
+                          zip(changed_keys, any_rules[0].values(changed_keys, sums)) if value > below}
+                ranked = sorted(zip(values.values(), values), reverse=True)
+                for rule in any_rules:
+                    rule.check_sorted(ranked, values, keys, sums, at, alerts)
+        return alerts
+
+    def evaluate_windows(self, windows, now):
+        # the [(alert_on, alert_msg)] of the rules over sliding windows going
+        # on or off, windows are the SlidingWindows counting the records
+        alerts = []
+        if not self._sliding_rules:
+            return alerts
+        at = time.strftime('%H:%M:%S', time.localtime(now))
+        # window -> rates
+        rates = dict()
+        for rule in self._sliding_rules:
+            window_rates = rates.get(rule.window)
+            if window_rates is None:
+                window_rates = windows.rates(rule.window, now)
+                rates[rule.window] = window_rates
+            rule.check((rule.key, ), rule.values((rule.key, ), window_rates), at, alerts)
+        return alerts
+
+
+def _parse_rule(name, options, frame_interval):
+    options = dict(options)
+    rule_type = RULE_TYPES.get(options.pop('rule', None))
+    if rule_type is None:
+        raise ValueError(f'rule {name}: rule must be one of {", ".join(RULE_TYPES)}')
+    key = ALL_SECTIONS
+    if rule_type.key_option is not None:
+        key = options.pop(rule_type.key_option, None)
+    if key is None:
+        if rule_type is not ErrorRatioRule:
+            raise ValueError(f'rule {name}: missing {rule_type.key_option}')
+        key = ALL_SECTIONS
+    window = parse_window(options.pop('window', str(frame_interval)))
+    if rule_type.sliding:
+        if window > WHEEL_SPAN:
+            raise ValueError(f'rule {name}: window can not exceed {format_window(WHEEL_SPAN)}')
+    else:
+        # in whole frames
+        window = max(1, math.ceil(window / frame_interval - 1e-9)) * frame_interval
+    if 'above' not in options:
+        raise ValueError(f'rule {name}: missing above')
+    above = float(options.pop('above'))
+    below = float(options.pop('below', above * DEFAULT_HYSTERESIS))
+    if below > above:
+        raise ValueError(f'rule {name}: below is over above')
+    kwargs = dict()
+    if rule_type is ErrorRatioRule and 'min_hits' in options:
+        kwargs['min_hits'] = int(options.pop('min_hits'))
+    if rule_type is TrafficRule and 'metric' in options:
+        kwargs['metric'] = options.pop('metric')
+        if kwargs['metric'] not in TRAFFIC_METRICS:
+            raise ValueError(f'rule {name}: metric must be one of {", ".join(TRAFFIC_METRICS)}')
+    if options:
+        raise ValueError(f'rule {name}: unknown options {", ".join(options)}')
+    return rule_type(name, key, window, above, below, **kwargs)
+
+
+def parse_rules(text, frame_interval):
+    # RuleEngine of the rules of a rules file, ValueError when invalid
+    config = configparser.ConfigParser(interpolation=None)
+    try:
+        config.read_string(text)
+    except configparser.Error as err:
+        raise ValueError(str(err)) from err
+    definitions = [(name, dict(config[name])) for name in config.sections()]
+    rules = []
+    for name, options in definitions:
+        try:
+            rules.append(_parse_rule(name, options, frame_interval))
+        except ValueError as err:
+            if str(err).startswith(f'rule {name}:'):
+                raise
+            raise ValueError(f'rule {name}: {err}') from err
+    return RuleEngine(rules, frame_interval, definitions)
+
+
+def load_rules(filename, frame_interval):
+    with open(filename) as rules_file:
+        return parse_rules(rules_file.read(), frame_interval)
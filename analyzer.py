@@ -0,0 +1,572 @@
+import heapq
+import math
+import time
+from operator import itemgetter
+
+from baseline import frame_metrics
+from file_watcher import WATERMARK_DELAY
+from sketches import DDSketch, HyperLogLog, hash64, make_counter
+
+# number of sections and hosts in the rankings of a frame and of the lifetime,
+# only these are published whatever the number of sections and hosts
+TOP_SECTIONS = 50
+TOP_HOSTS = 50
+# log files ranked by their rate during a frame
+TOP_SOURCES = 50
+# response size quantiles are kept for at most MAX_SIZE_SECTIONS sections during
+# a frame and published for the TOP_SIZE_SECTIONS most hit ones, the other
+# sections are counted together
+MAX_SIZE_SECTIONS = 100
+TOP_SIZE_SECTIONS = 10
+OTHER_SECTIONS = '(other)'
+ALL_SECTIONS = '(all)'
+SIZE_QUANTILES = (0.5, 0.95, 0.99)
+
+
+def fold_size_sketches(size_sketches, keep, hits):
+    # keep the sketches of the keep sections with most hits, merge the others
+    # into the sketch of OTHER_SECTIONS
+    if len(size_sketches) <= keep:
+        return size_sketches
+    sections = sorted((section for section in size_sketches if section != OTHER_SECTIONS),
+                      key=hits, reverse=True)
+    folded = {section: size_sketches[section] for section in sections[:keep]}
+    other = size_sketches.get(OTHER_SECTIONS)
+    other = other.copy() if other else DDSketch()
+    for section in sections[keep:]:
+        other.merge(size_sketches[section])
+    folded[OTHER_SECTIONS] = other
+    return folded
+
+
+def size_quantile_rows(size_sketches):
+    # [(section, hits, p50, p95, p99)] by decreasing hits, all sections first
+    all_sizes = DDSketch()
+    rows = []
+    for section, sketch in size_sketches.items():
+        all_sizes.merge(sketch)
+        rows.append((section, sketch.count) +
+                    tuple(int(x) for x in sketch.quantiles(SIZE_QUANTILES)))
+    rows.sort(key=lambda row: row[1], reverse=True)
+    return [(ALL_SECTIONS, all_sizes.count) +
+            tuple(int(x) for x in all_sizes.quantiles(SIZE_QUANTILES))] + rows
+
+
+class FrameStats(object):
+    '''
+    Counters of log records received during one frame.
+    Frames counted by different Analyzer shards are merged into one.
+    '''
+
+    def __init__(self):
+        self.hit_count = 0
+        self.section_hits = dict()
+        self.host_bytes = dict()
+        # distinct request paths, hosts are the keys of host_bytes
+        self.paths = HyperLogLog()
+        # response sizes per section
+        self.section_sizes = dict()
+        # with event time windowing, records received while this frame was the
+        # oldest open one but dated from an already closed frame
+        self.late_count = 0
+        # hits per log file, when the source of the records is known
+        self.source_hits = dict()
+        # 5xx responses, per section
+        self.error_count = 0
+        self.section_errors = dict()
+        # records received, each standing for weight hits when sampled, and
+        # variance of hit_count, sum of weight * (weight - 1) over the records
+        self.record_count = 0
+        self.sampling_variance = 0
+
+    def add_batch(self, batch, source=None, weight=1):
+        if weight != 1:
+            self._add_weighted_batch(batch, source, weight)
+            return
+        section_hits = self.section_hits
+        host_bytes = self.host_bytes
+        section_errors = self.section_errors
+        path_hashes = set()
+        add_path_hash = path_hashes.add
+        batch_sizes = dict()
+        errors = 0
+        for section, remotehost, size, status, timestamp, path_hash in batch:
+            section_hits[section] = section_hits.get(section, 0) + 1
+            host_bytes[remotehost] = host_bytes.get(remotehost, 0) + size
+            if status >= 500:
+                section_errors[section] = section_errors.get(section, 0) + 1
+                errors = errors + 1
+            add_path_hash(path_hash)
+            sizes = batch_sizes.get(section)
+            if sizes is None:
+                batch_sizes[section] = [size]
+            else:
+                sizes.append(size)
+        self.paths.add_hashes(path_hashes)
+        for section, sizes in batch_sizes.items():
+            self._size_sketch(section).add_values(sizes)
+        self.hit_count = self.hit_count + len(batch)
+        self.record_count = self.record_count + len(batch)
+        self.error_count = self.error_count + errors
+        if source is not None:
+            self.source_hits[source] = self.source_hits.get(source, 0) + len(batch)
+
+    def _add_weighted_batch(self, batch, source, weight):
+        # each record of a sampled batch stands for weight records
+        section_hits = self.section_hits
+        host_bytes = self.host_bytes
+        section_errors = self.section_errors
+        batch_sizes = dict()
+        errors = 0
+        for section, remotehost, size, status, timestamp, path_hash in batch:
+            section_hits[section] = section_hits.get(section, 0) + weight
+            host_bytes[remotehost] = host_bytes.get(remotehost, 0) + size * weight
+            if status >= 500:
+                section_errors[section] = section_errors.get(section, 0) + weight
+                errors = errors + weight
+            batch_sizes.setdefault(section, []).append(size)
+        self.paths.add_hashes({record[5] for record in batch})
+        for section, sizes in batch_sizes.items():
+            self._size_sketch(section).add_values(sizes, weight)
+        self.hit_count = self.hit_count + len(batch) * weight
+        self.record_count = self.record_count + len(batch)
+        self.sampling_variance = self.sampling_variance + len(batch) * weight * (weight - 1)
+        self.error_count = self.error_count + errors
+        if source is not None:
+            self.source_hits[source] = self.source_hits.get(source, 0) + len(batch) * weight
+
+    @property
+    def sampling_rate(self):
+        # hits per record received, 1 when not sampled
+        return self.hit_count / self.record_count if self.record_count else 1
+
+    @property
+    def sampling_error(self):
+        # relative standard error of hit_count
+        return math.sqrt(self.sampling_variance) / self.hit_count if self.hit_count else 0
+
+    def _size_sketch(self, section):
+        sketch = self.section_sizes.get(section)
+        if sketch is None:
+            if len(self.section_sizes) >= MAX_SIZE_SECTIONS:
+                section = OTHER_SECTIONS
+                sketch = self.section_sizes.get(section)
+            if sketch is None:
+                sketch = DDSketch()
+                self.section_sizes[section] = sketch
+        return sketch
+
+    def merge(self, other):
+        self.hit_count = self.hit_count + other.hit_count
+        section_hits = self.section_hits
+        for section, hits in other.section_hits.items():
+            section_hits[section] = section_hits.get(section, 0) + hits
+        host_bytes = self.host_bytes
+        for remotehost, size in other.host_bytes.items():
+            host_bytes[remotehost] = host_bytes.get(remotehost, 0) + size
+        self.paths.merge(other.paths)
+        for section, sketch in other.section_sizes.items():
+            self._size_sketch(section).merge(sketch)
+        self.late_count = self.late_count + other.late_count
+        source_hits = self.source_hits
+        for source, hits in other.source_hits.items():
+            source_hits[source] = source_hits.get(source, 0) + hits
+        self.error_count = self.error_count + other.error_count
+        section_errors = self.section_errors
+        for section, errors in other.section_errors.items():
+            section_errors[section] = section_errors.get(section, 0) + errors
+        self.record_count = self.record_count + other.record_count
+        self.sampling_variance = self.sampling_variance + other.sampling_variance
+
+
+class EventTimeFrames(object):
+    '''
+    Frames of records by their timestamp instead of their arrival time.
+    Each source sends watermarks promising its next records are not older, a
+    frame is closed once the watermarks of all sources have passed its end.
+    Frames are aligned on start time, records dated before the oldest open
+    frame are late, they are only counted. Watermarks are capped at the time
+    now plus WATERMARK_DELAY, and records dated after it are counted as late
+    too, so that a record dated in the future does not close the frames up
+    to its date.
+    '''
+
+    def __init__(self, frame_interval, start_time, sources, frame_index=0, frame=None,
+                 count_late=False):
+        self._frame_interval = frame_interval
+        self._start_time = start_time
+        # late records are counted in the oldest open frame too, as by
+        # processing time
+        self._count_late = count_late
+        # source -> watermark, None until the source sends one
+        self._watermarks = {source: None for source in sources}
+        # frame index -> FrameStats, frames may be opened ahead by a source
+        self._frames = dict()
+        # oldest open frame
+        self.frame_index = frame_index
+        if frame is not None:
+            self._frames[frame_index] = frame
+
+    def _frame(self, frame_index):
+        frame = self._frames.get(frame_index)
+        if frame is None:
+            frame = FrameStats()
+            self._frames[frame_index] = frame
+        return frame
+
+    @property
+    def sources(self):
+        return list(self._watermarks)
+
+    def add_source(self, source):
+        # frames are not closed until the new source sends a watermark
+        self._watermarks.setdefault(source, None)
+
+    def remove_source(self, source):
+        self._watermarks.pop(source, None)
+
+    def add_batch(self, batch, source=None, weight=1):
+        start_time = self._start_time
+        frame_interval = self._frame_interval
+        timestamps = list(map(itemgetter(4), batch))
+        first_index = int((min(timestamps) - start_time) // frame_interval)
+        last_index = int((max(timestamps) - start_time) // frame_interval)
+        # last frame a record can be in, by the clock
+        future_index = int((time.time() + WATERMARK_DELAY - start_time) // frame_interval)
+        if first_index == last_index and self.frame_index <= first_index <= future_index:
+            self._frame(first_index).add_batch(batch, source, weight)
+            return
+        frame_batches = dict()
+        late = []
+        for record in batch:
+            frame_index = int((record[4] - start_time) // frame_interval)
+            if frame_index < self.frame_index or frame_index > future_index:
+                late.append(record)
+            else:
+                frame_batch = frame_batches.get(frame_index)
+                if frame_batch is None:
+                    frame_batches[frame_index] = [record]
+                else:
+                    frame_batch.append(record)
+        for frame_index, frame_batch in frame_batches.items():
+            self._frame(frame_index).add_batch(frame_batch, source, weight)
+        if late:
+            frame = self._frame(self.frame_index)
+            frame.late_count = frame.late_count + len(late) * weight
+            if self._count_late:
+                frame.add_batch(late, source, weight)
+
+    def set_watermark(self, source, watermark):
+        watermark = min(watermark, time.time() + WATERMARK_DELAY)
+        current = self._watermarks.get(source)
+        if current is None or watermark > current:
+            self._watermarks[source] = watermark
+
+    def closed_frames(self, watermark=None, until=None):
+        # (frame index, frame) of the frames passed by all watermarks, in order,
+        # or by the given watermark, and ending by until when given
+        if watermark is None:
+            if not self._watermarks or None in self._watermarks.values():
+                return
+            watermark = min(self._watermarks.values())
+        if until is not None:
+            watermark = min(watermark, until)
+        while self._start_time + (self.frame_index + 1) * self._frame_interval <= watermark:
+            frame = self._frames.pop(self.frame_index, None)
+            yield self.frame_index, frame if frame is not None else FrameStats()
+            self.frame_index = self.frame_index + 1
+
+    def pop_open_frames(self):
+        # the open frames merged into one
+        frame = self._frames.pop(self.frame_index, None) or FrameStats()
+        for frame_index in sorted(self._frames):
+            frame.merge(self._frames.pop(frame_index))
+        return frame
+
+
+class FrameCounter(object):
+    '''
+    Counts log records into frames aligned on start time and closes them, by
+    processing time: once the clock has passed the end of the frame, or by
+    event time: once the watermarks of all sources have passed it.
+    close_frame(frame_index, frame, now) is called for each closed frame, and
+    checkpoint(positions, frames, final) after closing frames and, with final
+    True, when stopping, with the positions of the sources following the
+    records counted.
+    Sources may come and go, like the log files matching a glob.
+    Records are also counted by the SlidingWindows, when received.
+    Resumed by processing time, records are counted by event time until the
+    watermarks of all sources reach the frame open by the clock, so that the
+    lines written while the monitor was stopped fall in the frames of their
+    dates rather than all in the first frame. Records dated before the frame
+    open when stopped are counted in the oldest open frame.
+    '''
+
+    def __init__(self, frame_interval, start_time, sources, event_time,
+                 close_frame, checkpoint=None, state=None, windows=None):
+        self._frame_interval = frame_interval
+        self._start_time = start_time
+        self._event_time = event_time
+        self._close_frame = close_frame
+        self._checkpoint = checkpoint
+        self._windows = windows
+        # source -> (inode, offset)
+        self.positions = dict()
+        frames = None
+        if state is not None:
+            # (positions, frames) of a checkpoint
+            self.positions, frames = state
+        # event time frames of the catch up after resuming by processing time
+        self._catch_up = None
+        if event_time:
+            self._frames = frames or EventTimeFrames(frame_interval, start_time, sources)
+        elif isinstance(frames, EventTimeFrames):
+            # stopped while catching up
+            self._catch_up = frames
+            self._frame_index, self._frame = frames.frame_index, FrameStats()
+        elif frames is not None:
+            self._frame_index, self._frame = frames
+            self._catch_up = EventTimeFrames(frame_interval, start_time, sources,
+                                             self._frame_index, self._frame, count_late=True)
+        else:
+            self._frame_index, self._frame = 0, FrameStats()
+
+    @property
+    def frames(self):
+        # open frames, as saved by checkpoints
+        if self._event_time:
+            return self._frames
+        if self._catch_up is not None:
+            return self._catch_up
+        return self._frame_index, self._frame
+
+    @property
+    def catching_up(self):
+        return self._catch_up is not None
+
+    @property
+    def sources(self):
+        if self._event_time:
+            return self._frames.sources
+        return list(self.positions)
+
+    def add_source(self, source):
+        if self._event_time:
+            self._frames.add_source(source)
+        elif self._catch_up is not None:
+            self._catch_up.add_source(source)
+
+    def remove_source(self, source):
+        if self._event_time:
+            self._frames.remove_source(source)
+        elif self._catch_up is not None:
+            self._catch_up.remove_source(source)
+        self.positions.pop(source, None)
+
+    def add_batch(self, batch, source=None, weight=1):
+        if self._event_time:
+            self._frames.add_batch(batch, source, weight)
+        elif self._catch_up is not None:
+            self._catch_up.add_batch(batch, source, weight)
+            # the backlog is not the traffic of the last seconds
+            return
+        else:
+            self._frame.add_batch(batch, source, weight)
+        if self._windows is not None:
+            self._windows.add_batch(batch, time.time(), weight)
+
+    def set_position(self, source, watermark, inode, offset):
+        if self._event_time:
+            self._frames.set_watermark(source, watermark)
+        elif self._catch_up is not None:
+            self._catch_up.set_watermark(source, watermark)
+        self.positions[source] = (inode, offset)
+
+    def _close_catch_up_frames(self, now):
+        # close the frames passed by the watermarks, return True when some
+        # were, and switch to processing time once they reach the clock. The
+        # frame open by the clock is never closed here, whatever the dates of
+        # the backlog
+        catch_up = self._catch_up
+        clock_index = int((now - self._start_time) // self._frame_interval)
+        watermark = None if catch_up.sources else now
+        closed = False
+        for frame_index, frame in catch_up.closed_frames(
+                watermark, self._start_time + clock_index * self._frame_interval):
+            self._close_frame(frame_index, frame, self._start_time +
+                              (frame_index + 1) * self._frame_interval)
+            closed = True
+        if catch_up.frame_index >= clock_index:
+            self._frame_index = catch_up.frame_index
+            self._frame = catch_up.pop_open_frames()
+            self._catch_up = None
+            closed = True
+        return closed
+
+    def tick(self, now):
+        if self._windows is not None:
+            self._windows.tick(now)
+        # close the frames which are over
+        closed = False
+        if self._event_time:
+            # without any source, like a glob matching no file yet, nothing
+            # can come late and frames are closed by the clock
+            watermark = None if self._frames.sources else now
+            for frame_index, frame in self._frames.closed_frames(watermark):
+                self._close_frame(frame_index, frame, self._start_time +
+                                  (frame_index + 1) * self._frame_interval)
+                closed = True
+        elif self._catch_up is not None:
+            closed = self._close_catch_up_frames(now)
+        else:
+            while now > self._start_time + (self._frame_index + 1) * self._frame_interval:
+                self._close_frame(self._frame_index, self._frame, now)
+                self._frame_index = self._frame_index + 1
+                self._frame = FrameStats()
+                closed = True
+        if closed and self._checkpoint:
+            self._checkpoint(self.positions, self.frames)
+
+    def stop(self):
+        if self._checkpoint:
+            self._checkpoint(self.positions, self.frames, True)
+
+
+class Analyzer(object):
+    '''
+    Statistics over closed frames: LPS over a frame, a scene and the lifetime,
+    heat maps, distinct hosts and paths, response size quantiles and the
+    high traffic alert, or the alert of a BaselineAlert when given.
+    Times are in seconds since epoch.
+    '''
+
+    def __init__(self, frame_interval, scene_interval, start_time, heavy_hitters=0,
+                 baseline=None):
+        self._frame_interval = frame_interval
+        self._scene_interval = scene_interval
+        self._frames_per_scene = int(scene_interval / frame_interval)
+        self._start_time = start_time
+        self._alert_start_time = start_time + scene_interval
+        self.total_hit_count = 0
+        # circular buffer for hit counter in alert window
+        self.frames_in_scene_hit_counts = [0 for _ in range(self._frames_per_scene)]
+        self.frame_index_in_scene = 0
+        # distinct hosts and paths of each frame in the scene, merged for the
+        # scene, and since the beginning
+        self.frames_in_scene_hosts = [HyperLogLog() for _ in range(self._frames_per_scene)]
+        self.frames_in_scene_paths = [HyperLogLog() for _ in range(self._frames_per_scene)]
+        self.hosts = HyperLogLog()
+        self.paths = HyperLogLog()
+        # response size sketches of the most hit sections of each frame in the scene
+        self.frames_in_scene_sizes = [dict() for _ in range(self._frames_per_scene)]
+        # lifetime bytes per host and hits per section, exact or for the
+        # top heavy_hitters keys only
+        self.host_heat_map = make_counter(heavy_hitters)
+        self.section_hits = make_counter(heavy_hitters)
+        self.alert_on = False
+        self.baseline = baseline
+        self.late_count = 0
+        # frames closed, published as the version of the frame statistics
+        self.frame_count = 0
+
+    def frame_end_time(self, frame_index):
+        # frames are aligned on start time, frame 0 ends one interval after start
+        return self._start_time + (frame_index + 1) * self._frame_interval
+
+    def frame_index(self, timestamp):
+        return int((timestamp - self._start_time) // self._frame_interval)
+
+    def close_frame(self, frame, now, alert_threshold):
+        # return the statistics of the frame, and (alert_on, alert_msg) when alert changes
+        statistics = dict()
+        self.frame_count = self.frame_count + 1
+        statistics['frame_version'] = self.frame_count
+        statistics['lps_frame'] = 1.0 * frame.hit_count / self._frame_interval
+        # hits per record counted when records are sampled, and the relative
+        # standard error of lps_frame
+        statistics['sampling_rate'] = frame.sampling_rate
+        statistics['sampling_error'] = frame.sampling_error
+        self.total_hit_count = self.total_hit_count + frame.hit_count
+        statistics['total_hit_count'] = self.total_hit_count
+        self.late_count = self.late_count + frame.late_count
+        statistics['late_log_count'] = self.late_count
+
+        total_lps = self.total_hit_count / max(now - self._start_time, 1)
+        statistics['lps_lifetime'] = total_lps
+
+        self.frames_in_scene_hit_counts[self.frame_index_in_scene] = frame.hit_count
+        frame_hosts = HyperLogLog()
+        frame_hosts.add_hashes(map(hash64, frame.host_bytes))
+        self.frames_in_scene_hosts[self.frame_index_in_scene] = frame_hosts
+        self.frames_in_scene_paths[self.frame_index_in_scene] = frame.paths
+        frame_sizes = fold_size_sketches(
+            frame.section_sizes, TOP_SIZE_SECTIONS,
+            lambda section: frame.section_hits.get(section, 0))
+        self.frames_in_scene_sizes[self.frame_index_in_scene] = frame_sizes
+        self.frame_index_in_scene = (
+            self.frame_index_in_scene + 1) % self._frames_per_scene
+        if now > self._alert_start_time:
+            scene_lps = sum(self.frames_in_scene_hit_counts) * \
+                1.0 / self._scene_interval
+        else:
+            scene_lps = total_lps
+        statistics['lps_scene'] = scene_lps
+
+        self.hosts.merge(frame_hosts)
+        self.paths.merge(frame.paths)
+        scene_hosts = HyperLogLog()
+        scene_paths = HyperLogLog()
+        for hosts, paths in zip(self.frames_in_scene_hosts, self.frames_in_scene_paths):
+            scene_hosts.merge(hosts)
+            scene_paths.merge(paths)
+        statistics['unique_hosts_frame'] = len(frame.host_bytes)
+        statistics['unique_hosts_scene'] = scene_hosts.count()
+        statistics['unique_hosts_lifetime'] = self.hosts.count()
+        statistics['unique_paths_frame'] = frame.paths.count()
+        statistics['unique_paths_scene'] = scene_paths.count()
+        statistics['unique_paths_lifetime'] = self.paths.count()
+
+        scene_sizes = dict()
+        for sizes in self.frames_in_scene_sizes:
+            for section, sketch in sizes.items():
+                scene_sketch = scene_sizes.get(section)
+                if scene_sketch is None:
+                    scene_sizes[section] = sketch.copy()
+                else:
+                    scene_sketch.merge(sketch)
+        scene_sizes = fold_size_sketches(
+            scene_sizes, TOP_SIZE_SECTIONS,
+            lambda section: scene_sizes[section].count)
+        statistics['size_quantiles_frame'] = size_quantile_rows(frame_sizes)
+        statistics['size_quantiles_scene'] = size_quantile_rows(scene_sizes)
+
+        alert = None
+        if self.baseline is not None:
+            alert = self.baseline.update(frame_metrics(frame, self._frame_interval), now)
+            self.alert_on = self.baseline.alert_on
+            # [(metric, value, expected value, deviation)]
+            statistics['baseline'] = self.baseline.rows
+        elif scene_lps > total_lps + alert_threshold:
+            self.alert_on = True
+            alert_msg = 'High traffic generated an alert - hits = {:.2f}, triggered at {}'.format(
+                scene_lps, time.strftime('%H:%M:%S', time.localtime(now)))
+            alert = (self.alert_on, alert_msg)
+        elif self.alert_on:
+            self.alert_on = False
+            alert_msg = 'Alert Off - Traffic returned to normal at {}'.format(
+                time.strftime('%H:%M:%S', time.localtime(now)))
+            alert = (self.alert_on, alert_msg)
+
+        self.host_heat_map.update(frame.host_bytes)
+        self.section_hits.update(frame.section_hits)
+        # [(section, hits)] sorted, the UI does not go through all sections
+        statistics['top_sections_frame'] = heapq.nlargest(
+            TOP_SECTIONS, frame.section_hits.items(), key=itemgetter(1))
+        # [(host, bytes, error)] and [(section, hits, error)]
+        statistics['top_hosts'] = self.host_heat_map.top(TOP_HOSTS)
+        statistics['top_sections_lifetime'] = self.section_hits.top(TOP_SECTIONS)
+        # [(source, lps)] of the log files driving the traffic
+        statistics['top_sources_frame'] = [
+            (source, hits / self._frame_interval) for source, hits in heapq.nlargest(
+                TOP_SOURCES, frame.source_hits.items(), key=itemgetter(1))]
+        return statistics, alert
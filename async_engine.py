@@ -0,0 +1,351 @@
+import asyncio
+import os
+import time
+from fnmatch import fnmatchcase
+
+from file_watcher import FileWatcher, DEFAULT_READLINE_SLEEP, WATERMARK_DELAY, WATERMARK_INTERVAL
+from inotify import INotify, INOTIFY_AVAILABLE, IN_Q_OVERFLOW, IN_DELETE_SELF, IN_MOVE_SELF, \
+    IN_CREATE, IN_MOVED_TO, IN_DELETE, IN_MOVED_FROM, IN_ISDIR
+from parser import LogParser, DEFAULT_LOG_FORMAT
+
+# All log files watched by one process, instead of one File Watcher process
+# per file: each file is followed by an asyncio task, woken up through a single
+# inotify descriptor watching the directories of the files and registered in
+# the event loop, or polling every DEFAULT_READLINE_SLEEP without inotify.
+# Records are counted into frames in the same process, without log queue.
+# A task catching up on a backlog yields after each chunk, so that the other
+# files and the frame clock keep being served.
+#
+# A source is a log file, or a glob on file names or a directory standing for
+# all the files they match, now and later. Files appearing in a watched
+# directory are matched when inotify reports them and read from their
+# beginning, deleted files are read to the end and dropped. Without inotify the
+# directories are scanned every DISCOVERY_INTERVAL.
+# A file renamed while being read, like a log rotated into a name which is
+# matched too, goes on from where it was: its inode is still held open by its
+# watcher when the new name is discovered. Without inotify, the watcher may
+# follow the rotation before the scan, the offset it left the file at is kept
+# until the next scan.
+#
+# Sources of the FrameCounter are file paths, glob and directory sources
+# name their files by joining the directory and the file name.
+
+# frames are closed by the clock with this precision
+ENGINE_TICK_INTERVAL = 0.1
+# directories are scanned for new and deleted files without inotify
+DISCOVERY_INTERVAL = 1
+
+WILDCARDS = '*?['
+
+
+def is_pattern(source):
+    # glob and directory sources stand for many files
+    return any(c in source for c in WILDCARDS) or os.path.isdir(source)
+
+
+def split_pattern(source):
+    # (directory, pattern of file names) of a glob or directory source
+    if os.path.isdir(source):
+        return source, '*'
+    directory, pattern = os.path.split(source)
+    if any(c in directory for c in WILDCARDS):
+        raise ValueError(f'{source}: only file names can hold wildcards')
+    return directory or os.curdir, pattern
+
+
+class WatchedDirectory(object):
+    def __init__(self, path):
+        self.path = path
+        # patterns of the files discovered in this directory
+        self.patterns = []
+        # file name -> WatchedFile
+        self.files = dict()
+
+    def matches(self, name):
+        return any(fnmatchcase(name, pattern) for pattern in self.patterns)
+
+
+class WatchedFile(object):
+    def __init__(self, source, name, directory, watcher, discovered):
+        self.source = source
+        self.name = name
+        self.directory = directory
+        self.watcher = watcher
+        # discovered files are dropped once deleted and read to the end
+        self.discovered = discovered
+        self.removed = False
+        # latest timestamp read, and whether waiting for lines
+        self.watermark = 0
+        self.waiting = False
+        # created in the event loop
+        self.wakeup = None
+        self.task = None
+
+
+class AsyncEngine(object):
+    def __init__(self, sources, log_format=DEFAULT_LOG_FORMAT, use_inotify=True,
+                 positions=None, health=None):
+        self._log_format = log_format
+        # counts the lines and the time spent reading them, see health.Health
+        self._health = health
+        # source -> (inode, offset) to resume from
+        self._positions = positions or dict()
+        self._parser = LogParser(log_format=log_format, binary=True)
+        self._use_inotify = use_inotify and INOTIFY_AVAILABLE
+        self._inotify = None
+        # absolute path -> WatchedDirectory, and watch descriptor -> WatchedDirectory
+        self._directories = dict()
+        self._watched_directories = dict()
+        # source -> WatchedFile
+        self._files = dict()
+        # inode -> WatchedFile deleted or renamed, being read to the end
+        self._removed_inodes = dict()
+        # inode -> (WatchedDirectory, offset) of files left by a rotation, without inotify
+        self._rotated_offsets = dict()
+        self._counter = None
+        for source in sources:
+            if is_pattern(source):
+                directory, pattern = split_pattern(source)
+                if not os.path.isdir(directory):
+                    raise FileNotFoundError(f'No such directory: {directory}')
+                self._directory(directory).patterns.append(pattern)
+            elif source not in self._files:
+                # watchers are only used to read, they never wait by themselves
+                watcher = FileWatcher(source, log_format=log_format, use_inotify=False,
+                                      position=self._positions.get(source))
+                directory, name = os.path.split(source)
+                directory = self._directory(directory or os.curdir)
+                watched = WatchedFile(source, name, directory, watcher, False)
+                directory.files[name] = watched
+                self._files[source] = watched
+
+    def _directory(self, path):
+        key = os.path.abspath(path)
+        directory = self._directories.get(key)
+        if directory is None:
+            directory = WatchedDirectory(path)
+            self._directories[key] = directory
+        return directory
+
+    def run(self, running, counter):
+        # watch until running is 0, records are counted by the FrameCounter
+        asyncio.run(self._run(running, counter))
+
+    async def _run(self, running, counter):
+        loop = asyncio.get_running_loop()
+        self._counter = counter
+        if self._use_inotify:
+            self._start_inotify(loop)
+        # files already there are read from their end, or their checkpoint
+        for directory in self._directories.values():
+            self._scan(directory, True)
+        for source in counter.sources:
+            if source not in self._files:
+                # gone while the monitor was stopped
+                counter.remove_source(source)
+        for watched in list(self._files.values()):
+            self._start(watched)
+        next_heartbeat_time = 0
+        next_scan_time = time.monotonic() + DISCOVERY_INTERVAL
+        try:
+            while running.value == 1:
+                await asyncio.sleep(ENGINE_TICK_INTERVAL)
+                now = time.time()
+                if time.monotonic() > next_heartbeat_time:
+                    self._heartbeat(now)
+                    next_heartbeat_time = time.monotonic() + WATERMARK_INTERVAL
+                if not self._use_inotify and time.monotonic() > next_scan_time:
+                    for directory in self._directories.values():
+                        self._scan(directory, False)
+                    next_scan_time = time.monotonic() + DISCOVERY_INTERVAL
+                counter.tick(now)
+        finally:
+            tasks = [watched.task for watched in self._files.values()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self._inotify is not None:
+                loop.remove_reader(self._inotify.fileno())
+                self._inotify.close()
+        counter.stop()
+
+    def _start_inotify(self, loop):
+        try:
+            self._inotify = INotify()
+            # watching the directory follows the files across rotations and
+            # sees new files, a directory has a single watch descriptor
+            for directory in self._directories.values():
+                wd = self._inotify.add_watch(directory.path)
+                self._watched_directories[wd] = directory
+        except OSError as err:
+            print(f'polling log files: {err}')
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+            self._watched_directories.clear()
+            self._use_inotify = False
+            return
+        loop.add_reader(self._inotify.fileno(), self._read_inotify)
+
+    def _read_inotify(self):
+        for wd, mask, name in self._inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                # events were lost
+                for directory in self._directories.values():
+                    self._scan(directory, False)
+                for watched in self._files.values():
+                    watched.wakeup.set()
+                continue
+            directory = self._watched_directories.get(wd)
+            if directory is None:
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                for watched in directory.files.values():
+                    watched.wakeup.set()
+                continue
+            watched = directory.files.get(name)
+            if watched is None:
+                if mask & (IN_CREATE | IN_MOVED_TO) and not mask & IN_ISDIR and \
+                        directory.matches(name):
+                    self._discover(directory, name, False)
+                continue
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._restore(watched)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self._remove(watched)
+            watched.wakeup.set()
+
+    def _scan(self, directory, starting):
+        # match the files of a directory, without inotify or when events were lost
+        if not directory.patterns:
+            return
+        # file name -> inode
+        names = dict()
+        with os.scandir(directory.path) as entries:
+            for entry in entries:
+                if directory.matches(entry.name) and entry.is_file():
+                    names[entry.name] = entry.inode()
+        inodes = set(names.values())
+        for name, watched in directory.files.items():
+            inode = watched.watcher.position()[0]
+            if name not in names or \
+                    (watched.discovered and names[name] != inode and inode in inodes):
+                # deleted, or renamed into another matching name maybe
+                # replaced by a new file since
+                self._remove(watched)
+            else:
+                self._restore(watched)
+        # renamed files first, they go on from where they were
+        for name in sorted(names, key=lambda name: names[name] not in self._removed_inodes):
+            if name not in directory.files:
+                self._discover(directory, name, starting)
+        for inode, (rotated_directory, _) in list(self._rotated_offsets.items()):
+            if rotated_directory is directory:
+                del self._rotated_offsets[inode]
+
+    def _discover(self, directory, name, starting):
+        source = os.path.join(directory.path, name)
+        try:
+            inode = os.stat(source).st_ino
+        except FileNotFoundError:
+            return
+        renamed = self._removed_inodes.pop(inode, None)
+        if renamed is not None:
+            # renamed while being read, go on from there
+            position = renamed.watcher.position()
+            renamed.task.cancel()
+            self._drop(renamed)
+        elif inode in self._rotated_offsets:
+            position = (inode, self._rotated_offsets.pop(inode)[1])
+        elif source in self._positions:
+            position = self._positions[source]
+        elif starting:
+            # from the end, like the files of the other sources
+            position = None
+        else:
+            position = (inode, 0)
+        try:
+            watcher = FileWatcher(source, log_format=self._log_format, use_inotify=False,
+                                  position=position)
+        except FileNotFoundError:
+            # deleted meanwhile
+            return
+        except OSError as err:
+            # like too many open files
+            print(f'not watching {source}: {err}')
+            return
+        watched = WatchedFile(source, name, directory, watcher, True)
+        directory.files[name] = watched
+        self._files[source] = watched
+        if not starting:
+            self._start(watched)
+
+    def _remove(self, watched):
+        # deleted or renamed away, read to the end then dropped
+        if watched.discovered and not watched.removed:
+            watched.removed = True
+            self._removed_inodes[watched.watcher.position()[0]] = watched
+
+    def _restore(self, watched):
+        # created again under the same name, followed like a rotation
+        if watched.removed:
+            watched.removed = False
+            self._removed_inodes.pop(watched.watcher.position()[0], None)
+
+    def _drop(self, watched):
+        self._removed_inodes.pop(watched.watcher.position()[0], None)
+        del watched.directory.files[watched.name]
+        del self._files[watched.source]
+        self._counter.remove_source(watched.source)
+
+    def _start(self, watched):
+        watched.wakeup = asyncio.Event()
+        self._counter.add_source(watched.source)
+        watched.task = asyncio.create_task(self._watch(watched))
+
+    async def _watch(self, watched):
+        counter = self._counter
+        watcher = watched.watcher
+        wakeup = watched.wakeup
+        health = self._health
+        while True:
+            # a change during the read wakes the task up again
+            wakeup.clear()
+            start = time.perf_counter()
+            lines = watcher.poll_lines()
+            if watcher.rotated_from is not None:
+                inode, offset = watcher.rotated_from
+                watcher.rotated_from = None
+                if not self._use_inotify:
+                    self._rotated_offsets[inode] = (watched.directory, offset)
+            if not lines:
+                if watched.removed:
+                    self._drop(watched)
+                    return
+                watched.waiting = True
+                if self._use_inotify:
+                    await wakeup.wait()
+                else:
+                    await asyncio.sleep(DEFAULT_READLINE_SLEEP)
+                watched.waiting = False
+                continue
+            records = self._parser.parse_records(lines)
+            if records:
+                counter.add_batch(records, watched.source)
+                # log lines are written in time order, not ahead of the clock
+                watched.watermark = max(watched.watermark,
+                                        min(records[-1][4], time.time() + WATERMARK_DELAY))
+            counter.set_position(watched.source, watched.watermark, *watcher.position())
+            if health is not None:
+                health.count_lines(watched.source, len(lines), len(records))
+                health.count_busy(time.perf_counter() - start)
+            await asyncio.sleep(0)
+
+    def _heartbeat(self, now):
+        # a file waiting for lines will not get lines older than the time
+        # allowed for writing a line
+        for watched in self._files.values():
+            if watched.waiting:
+                watched.watermark = max(watched.watermark, now - WATERMARK_DELAY)
+                self._counter.set_position(watched.source, watched.watermark,
+                                           *watched.watcher.position())
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+import getopt
+import json
+import math
+import sys
+import time
+
+# Alerts on the deviation of the traffic from its expected value, rather than
+# from the lifetime average which never decays: after days of uptime a daily
+# cycle would either hide spikes or raise alerts every morning.
+#
+# Each metric of the closed frames (LPS, bytes per second and 5xx per second)
+# is forecast by a model updated in O(1) per frame:
+#   ewma          an exponentially weighted moving average,
+#   holt-winters  a level, a damped trend and a daily season of 5 minutes slots,
+#                 additive, in error correction form.
+# Both keep an exponentially weighted variance of their forecast errors, the
+# deviation of a frame is its error in standard deviations. Standard
+# deviations have a floor, a share of the forecast and one event per frame, so
+# that a flat traffic does not alert on noise. A model learns from errors
+# clipped to the alert deviation, a spike does not become the baseline while a
+# lasting change of the traffic is followed in a few half lives.
+#
+# Smoothing is set by half lives in seconds, whatever the frame interval.
+# Models do not alert during their warm up, and their state is a few hundred
+# floats, saved with Analyzer in checkpoints.
+
+MODEL_EWMA = 'ewma'
+MODEL_HOLT_WINTERS = 'holt-winters'
+
+# deviation in standard deviations raising the alert when it lasts for
+# BASELINE_PERSISTENCE frames in a row, it goes off below BASELINE_CLEAR of it
+BASELINE_SIGMAS = 3
+BASELINE_PERSISTENCE = 3
+BASELINE_CLEAR = 0.6
+BASELINE_WARMUP = 600
+# half lives in seconds
+LEVEL_HALF_LIFE = 600
+TREND_HALF_LIFE = 3600
+VARIANCE_HALF_LIFE = 3600
+# seasonal slots are updated by the frames of one slot each day, their half
+# life is in days
+SEASON = 86400
+SEASON_SLOT = 300
+SEASON_HALF_LIFE = 3
+# trend damping per frame
+TREND_DAMPING = 0.98
+# floor of standard deviations relative to the forecast
+MIN_DEVIATION = 0.05
+
+# metric -> least meaningful change in one frame, in counted units
+BASELINE_METRICS = {
+    'lps': 1,
+    'bytes': 10000,
+    'errors': 1,
+}
+# metrics of recorded frames, without 5xx
+RECORDED_METRICS = ('lps', 'bytes')
+
+
+def smoothing(interval, half_life):
+    # weight of an update every interval for the given half life
+    return 1 - 0.5 ** (interval / half_life)
+
+
+def frame_metrics(frame, frame_interval):
+    # metrics of a closed FrameStats
+    return {
+        'lps': frame.hit_count / frame_interval,
+        'bytes': sum(frame.host_bytes.values()) / frame_interval,
+        'errors': frame.error_count / frame_interval,
+    }
+
+
+class EWMA(object):
+    def __init__(self, frame_interval, quantum=1, sigmas=BASELINE_SIGMAS):
+        self._alpha = smoothing(frame_interval, LEVEL_HALF_LIFE)
+        self._variance_alpha = smoothing(frame_interval, VARIANCE_HALF_LIFE)
+        self._warmup = BASELINE_WARMUP / frame_interval
+        # least standard deviation, the metric is per second
+        self._min_deviation = quantum / frame_interval
+        self._sigmas = sigmas
+        self.level = None
+        self.variance = 0.0
+        # total weight of the variance updates, the variance starting from 0
+        # is divided by it
+        self.variance_weight = 0.0
+        self.count = 0
+
+    @property
+    def warm(self):
+        return self.count >= self._warmup
+
+    def forecast(self, now):
+        return self.level
+
+    def deviation(self, expected):
+        variance = self.variance / self.variance_weight if self.variance_weight else 0
+        return max(math.sqrt(variance), MIN_DEVIATION * abs(expected), self._min_deviation)
+
+    def update(self, value, now):
+        # return (expected value, deviation of value in standard deviations),
+        # then learn from value
+        self.count = self.count + 1
+        if self.level is None:
+            self._start(value)
+            return value, 0.0
+        expected = self.forecast(now)
+        error = value - expected
+        deviation = self.deviation(expected)
+        limit = self._sigmas * deviation
+        self._learn(max(-limit, min(limit, error)), now)
+        return expected, error / deviation
+
+    def _start(self, value):
+        self.level = value
+
+    def _learn(self, error, now):
+        self.level = self.level + self._alpha * error
+        self._learn_variance(error)
+
+    def _learn_variance(self, error):
+        self.variance = self.variance + self._variance_alpha * (error * error - self.variance)
+        self.variance_weight = self.variance_weight + self._variance_alpha * (1 - self.variance_weight)
+
+
+class HoltWinters(EWMA):
+    def __init__(self, frame_interval, quantum=1, sigmas=BASELINE_SIGMAS):
+        super().__init__(frame_interval, quantum, sigmas)
+        self._trend_alpha = smoothing(frame_interval, TREND_HALF_LIFE)
+        self._season_alpha = smoothing(frame_interval, SEASON_HALF_LIFE * SEASON_SLOT)
+        self.trend = 0.0
+        self.season = [0.0 for _ in range(SEASON // SEASON_SLOT)]
+
+    def _slot(self, now):
+        return int(now % SEASON // SEASON_SLOT)
+
+    def forecast(self, now):
+        return self.level + TREND_DAMPING * self.trend + self.season[self._slot(now)]
+
+    def _learn(self, error, now):
+        trend = TREND_DAMPING * self.trend
+        self.level = self.level + trend + self._alpha * error
+        self.trend = trend + self._alpha * self._trend_alpha * error
+        slot = self._slot(now)
+        self.season[slot] = self.season[slot] + self._season_alpha * error
+        self._learn_variance(error)
+
+
+MODELS = {
+    MODEL_EWMA: EWMA,
+    MODEL_HOLT_WINTERS: HoltWinters,
+}
+
+
+class BaselineAlert(object):
+    '''
+    Alert on the metrics of closed frames deviating from their baselines.
+    update() returns (alert_on, alert_msg) when the alert changes, like the
+    high traffic alert of Analyzer. rows are the [(metric, value, expected
+    value, deviation)] of the last frame.
+    '''
+
+    def __init__(self, frame_interval, model=MODEL_HOLT_WINTERS, sigmas=BASELINE_SIGMAS,
+                 metrics=tuple(BASELINE_METRICS)):
+        self._models = {metric: MODELS[model](frame_interval, BASELINE_METRICS[metric], sigmas)
+                        for metric in metrics}
+        self._sigmas = sigmas
+        # metric -> frames deviating in a row
+        self._deviating = {metric: 0 for metric in metrics}
+        # metrics deviating for long enough
+        self.anomalies = set()
+        self.rows = []
+
+    @property
+    def alert_on(self):
+        return bool(self.anomalies)
+
+    def update(self, values, now):
+        alert_on = self.alert_on
+        anomalies = self.anomalies
+        deviating = self._deviating
+        rows = []
+        for metric, model in self._models.items():
+            value = values[metric]
+            expected, deviation = model.update(value, now)
+            rows.append((metric, value, expected, deviation))
+            if metric in anomalies:
+                if abs(deviation) < self._sigmas * BASELINE_CLEAR:
+                    anomalies.discard(metric)
+            elif abs(deviation) > self._sigmas and model.warm:
+                deviating[metric] = deviating[metric] + 1
+                if deviating[metric] >= BASELINE_PERSISTENCE:
+                    anomalies.add(metric)
+                    deviating[metric] = 0
+            else:
+                deviating[metric] = 0
+        self.rows = rows
+        if self.alert_on and not alert_on:
+            return True, 'Anomaly generated an alert - {}, triggered at {}'.format(
+                ', '.join(f'{metric} = {value:.2f} expected {expected:.2f} ({deviation:+.1f} sd)'
+                          for metric, value, expected, deviation in rows if metric in anomalies),
+                time.strftime('%H:%M:%S', time.localtime(now)))
+        if alert_on and not self.alert_on:
+            return False, 'Anomaly Off - Traffic returned to its baseline at {}'.format(
+                time.strftime('%H:%M:%S', time.localtime(now)))
+        return None
+
+
+def replay_records(records, model=MODEL_HOLT_WINTERS, sigmas=BASELINE_SIGMAS):
+    # run recorded frames through a BaselineAlert, yield
+    # (frame end time, alert_on, alert_msg) when the alert changes
+    baseline = None
+    for record in records:
+        if baseline is None:
+            baseline = BaselineAlert(record['interval'], model, sigmas, RECORDED_METRICS)
+        now = record['start_time'] + record['interval']
+        alert = baseline.update({'lps': record['lps'],
+                                 'bytes': record['bytes'] / record['interval']}, now)
+        if alert:
+            yield (now, ) + alert
+
+
+def usage():
+    print('''
+    Run frames recorded by monitor.py --record through baseline alerts, alerts
+    are written as JSON lines
+    baseline.py -d stats_dir [--from "2019-11-05 00:00"] [--to "2019-11-06 00:00"]
+                [--model holt-winters] [--sigmas 3]
+    -d --directory   directory of the records
+    --from           start of the time range, local time or seconds since epoch.
+                     Default is one day ago.
+    --to             end of the time range. Default is now.
+    --model          {}. Default is {}.
+    --sigmas         deviation raising the alert, in standard deviations. Default is {}.
+    '''.format(', '.join(MODELS), MODEL_HOLT_WINTERS, BASELINE_SIGMAS))
+
+
+if __name__ == "__main__":
+    from recorder import read_records, parse_time
+    directory = None
+    end_time = time.time()
+    start_time = end_time - SEASON
+    model = MODEL_HOLT_WINTERS
+    sigmas = BASELINE_SIGMAS
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hd:', [
+                                   'help', 'directory=', 'from=', 'to=', 'model=', 'sigmas='])
+    except getopt.GetoptError as err:
+        print(err)
+        usage()
+        sys.exit(2)
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif o in ("-d", "--directory"):
+            directory = a
+        elif o == "--from":
+            start_time = parse_time(a)
+        elif o == "--to":
+            end_time = parse_time(a)
+        elif o == "--model":
+            if a not in MODELS:
+                print(f'unknown model {a}')
+                usage()
+                sys.exit(2)
+            model = a
+        elif o == "--sigmas":
+            sigmas = float(a)
+        else:
+            assert False, "unhandled option"
+    if directory is None:
+        usage()
+        sys.exit(2)
+    start = time.perf_counter()
+    records = list(read_records(directory, start_time, end_time))
+    for now, alert_on, alert_msg in replay_records(records, model, sigmas):
+        print(json.dumps({'type': 'alert', 'time': now, 'alert_on': alert_on,
+                          'message': alert_msg}))
+    print(f'replayed {len(records)} frames in {time.perf_counter() - start:.1f}s',
+          file=sys.stderr)
@@ -0,0 +1,686 @@
+#!/usr/bin/env python
+import getopt
+import json
+import os
+import sys
+import tempfile
+import time
+import subprocess
+from collections import deque
+from multiprocessing import Process, Queue
+
+from file_watcher import LogItem, LogBatcher, FileWatcher, DEFAULT_BATCH_SIZE, make_log_batcher
+from parser import LogParser, LOG_FORMATS, timestamp_from_date
+from ring_buffer import SharedRingBuffer
+from replay import Replay
+
+DEFAULT_LINES = 200000
+DEFAULT_PRODUCERS = 2
+
+
+def make_log_item(i):
+    return LogItem('87.141.6.{}'.format(i % 256),
+                   '-',
+                   'simon',
+                   '[05/Nov/2019:01:44:46 +0100]',
+                   '"GET /item/{}/12854860 HTTP/1.1"'.format(i % 100),
+                   200,
+                   8000,
+                   '/item{}'.format(i % 100))
+
+
+# log queue transport: one LogItem per put, the way FileWatcher used to work
+def produce_items(log_q, lines):
+    items = [make_log_item(i) for i in range(1000)]
+    for i in range(lines):
+        log_q.put(items[i % 1000])
+
+
+def consume_items(log_q, lines):
+    heat_map = dict()
+    for _ in range(lines):
+        log_item = log_q.get()
+        heat_map[log_item.section] = heat_map.get(log_item.section, 0) + 1
+
+
+# log queue transport: batches of compact records
+def produce_batches(log_q, lines, batch_size):
+    records = [make_log_item(i).to_record() for i in range(1000)]
+    batcher = LogBatcher(log_q, batch_size)
+    for i in range(lines):
+        batcher.add(records[i % 1000])
+    batcher.flush()
+
+
+def consume_batches(log_q, lines):
+    heat_map = dict()
+    received = 0
+    while received < lines:
+        batch = log_q.get()
+        received = received + len(batch)
+        for section, remotehost, size, status, timestamp, path_hash in batch:
+            heat_map[section] = heat_map.get(section, 0) + 1
+
+
+def run_transport(producer, consumer, producer_args, producers, lines,
+                  log_q_class=Queue):
+    log_q = log_q_class()
+    procs = [Process(target=producer, args=(log_q, ) + producer_args)
+             for _ in range(producers)]
+    start = time.perf_counter()
+    for proc in procs:
+        proc.start()
+    consumer(log_q, lines * producers)
+    elapsed = time.perf_counter() - start
+    for proc in procs:
+        proc.join()
+    if isinstance(log_q, SharedRingBuffer):
+        log_q.close()
+        log_q.unlink()
+    return lines * producers / elapsed
+
+
+def bench_transport(lines, producers, batch_size=DEFAULT_BATCH_SIZE):
+    results = dict()
+    results['per_item'] = run_transport(
+        produce_items, consume_items, (lines, ), producers, lines)
+    results['batched'] = run_transport(
+        produce_batches, consume_batches, (lines, batch_size), producers, lines)
+    results['shared_ring'] = run_transport(
+        produce_batches, consume_batches, (lines, batch_size), producers, lines,
+        SharedRingBuffer)
+    for name, lps in results.items():
+        print(f'transport {name:12s} {lps:12.0f} lines/s')
+    return results
+
+
+SAMPLE_LINES = {
+    'common': '9.169.{}.247 - simon [12/Dec/2015:18:25:11 +0100] "GET /item{}/archi-interior-design-joomla-template/14576483 HTTP/1.1" 200 4263',
+    'combined': '9.169.{}.247 - simon [12/Dec/2015:18:25:11 +0100] "GET /item{}/archi-interior-design-joomla-template/14576483 HTTP/1.1" 200 4263 "http://www.example.com/start.html" "Mozilla/5.0 (Windows NT 6.0; rv:34.0) Gecko/20100101 Firefox/34.0"',
+    'json': '{{"remote_addr": "9.169.{}.247", "remote_user": "simon", "time_local": "12/Dec/2015:18:25:11 +0100", "request": "GET /item{}/archi-interior-design-joomla-template/14576483 HTTP/1.1", "status": 200, "body_bytes_sent": 4263, "http_user_agent": "Mozilla/5.0"}}',
+}
+
+
+def legacy_parse(parser, line):
+    # the way FileWatcher parsed lines before log formats
+    remotehost, rfc931, authuser, date, request, status, size = parser.parse_line(
+        line)
+    if not request:
+        return None
+    section = parser.section_from_request(request)
+    try:
+        size = int(size)
+    except ValueError:
+        size = 0
+    try:
+        status = int(status)
+    except ValueError:
+        status = 0
+    return (section, remotehost, size, status, timestamp_from_date(date))
+
+
+def lines_per_second(parse, lines):
+    start = time.perf_counter()
+    for line in lines:
+        parse(line)
+    return len(lines) / (time.perf_counter() - start)
+
+
+def bench_parser(lines, producers=None):
+    results = dict()
+    for log_format in LOG_FORMATS:
+        binary_lines = [SAMPLE_LINES[log_format].format(i % 256, i % 100).encode('utf-8')
+                        for i in range(lines)]
+        if log_format != 'json':
+            legacy_parser = LogParser()
+            results[f'{log_format}_legacy'] = lines_per_second(
+                lambda line: legacy_parse(legacy_parser, line.decode('utf-8')), binary_lines)
+        # lines are read from file as bytes, text mode pays for decoding them
+        parse_text = LogParser(log_format=log_format).parse_record
+        results[f'{log_format}_text'] = lines_per_second(
+            lambda line: parse_text(line.decode('utf-8')), binary_lines)
+        results[f'{log_format}_bytes'] = lines_per_second(
+            LogParser(log_format=log_format, binary=True).parse_record, binary_lines)
+    for name, lps in results.items():
+        print(f'parser {name:17s} {lps:12.0f} lines/s')
+    return results
+
+
+class NullQueue(object):
+    def put(self, batch, block=True, timeout=None):
+        pass
+
+
+def bench_reader(lines, producers=None):
+    # read and parse a backlog of lines, the way FileWatcher.watch does
+    # before and after switching to chunked binary reads
+    results = dict()
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'access.log')
+        open(filename, 'w').close()
+        fw = FileWatcher(filename, use_inotify=False)
+        with open(filename, 'a') as log_file:
+            for i in range(lines):
+                log_file.write(SAMPLE_LINES['combined'].format(
+                    i % 256, i % 100) + '\n')
+
+        parser = LogParser()
+        batcher = LogBatcher(NullQueue())
+        start = time.perf_counter()
+        with open(filename, 'r') as log_file:
+            for line in iter(log_file.readline, ''):
+                record = parser.parse_record(line)
+                if record is not None:
+                    batcher.add(record)
+        results['readline'] = lines / (time.perf_counter() - start)
+
+        parser = LogParser(binary=True)
+        batcher = LogBatcher(NullQueue())
+        start = time.perf_counter()
+        chunk_lines = fw.read_lines()
+        while chunk_lines:
+            batcher.extend(parser.parse_records(chunk_lines))
+            chunk_lines = fw.read_lines()
+        results['chunked'] = lines / (time.perf_counter() - start)
+    for name, lps in results.items():
+        print(f'reader {name:12s} {lps:12.0f} lines/s')
+    return results
+
+
+REPLAY_LINES_PER_SECOND = 1000  # log time advances by one second every 1000 lines
+
+
+def bench_replay(lines, producers=None):
+    # offline analysis of a log file with the default frame and scene windows
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'access.log')
+        start_time = 1449940000
+        with open(filename, 'w') as log_file:
+            for second in range(0, lines, REPLAY_LINES_PER_SECOND):
+                date = time.strftime('%d/%b/%Y:%H:%M:%S +0000',
+                                     time.gmtime(start_time + second // REPLAY_LINES_PER_SECOND))
+                log_file.write(''.join(
+                    SAMPLE_LINES['combined'].format(i % 256, i % 100).replace(
+                        '12/Dec/2015:18:25:11 +0100', date) + '\n'
+                    for i in range(second, min(lines, second + REPLAY_LINES_PER_SECOND))))
+        size = os.path.getsize(filename)
+        with open(os.devnull, 'w') as output:
+            replay = Replay(filename, output, 10, 10, 120)
+            start = time.perf_counter()
+            replay.run()
+            elapsed = time.perf_counter() - start
+    print(f'replay {lines / elapsed:12.0f} lines/s {size / elapsed / 2 ** 20:8.1f} MiB/s '
+          f'{elapsed * 2 ** 30 / size:6.1f} s/GiB, {replay.frame_count} frames')
+    return lines / elapsed
+
+
+SHARD_COUNTS = (1, 2, 4, 8)
+SHARD_BENCH_FRAME_INTERVAL = 0.2
+
+
+def produce_records(log_q, lines):
+    # log_q is a list of queues when Analyzer is sharded
+    records = [make_log_item(i).to_record() for i in range(1000)]
+    batcher = make_log_batcher(log_q)
+    for i in range(0, lines, 1000):
+        batcher.extend(records[:min(1000, lines - i)])
+    batcher.flush()
+
+
+def bench_shards(lines, producers):
+    # records from producers through sharded Analyzer to the merged statistics
+    from monitor import Monitor
+    results = dict()
+    for shards in SHARD_COUNTS:
+        monitor = Monitor([], 10, SHARD_BENCH_FRAME_INTERVAL,
+                          SHARD_BENCH_FRAME_INTERVAL * 4, shards=shards, ui=False)
+        monitor.initialize()
+        monitor.start()
+        procs = [Process(target=produce_records, args=(monitor._log_q, lines))
+                 for _ in range(producers)]
+        start = time.perf_counter()
+        for proc in procs:
+            proc.start()
+        while monitor._aggregated_statistics['total_hit_count'] < lines * producers:
+            time.sleep(SHARD_BENCH_FRAME_INTERVAL / 4)
+        elapsed = time.perf_counter() - start
+        for proc in procs:
+            proc.join()
+        monitor.stop()
+        monitor.wait_for_finish()
+        results[f'{shards}_shards'] = lines * producers / elapsed
+    for name, lps in results.items():
+        print(f'analyzer {name:10s} {lps:12.0f} lines/s')
+    return results
+
+
+ENGINE_FILE_COUNTS = (10, 100, 1000)
+ENGINE_BENCH_FRAME_INTERVAL = 0.5
+ENGINE_IDLE_SECONDS = 2
+
+
+def process_pss(pid):
+    # proportional set size in kB, shared pages split between processes
+    with open(f'/proc/{pid}/smaps_rollup') as rollup:
+        for line in rollup:
+            if line.startswith('Pss:'):
+                return int(line.split()[1])
+    return 0
+
+
+def process_cpu(pid):
+    # CPU seconds, in nanoseconds rather than clock ticks which round the
+    # usage of many mostly idle processes down to nothing
+    with open(f'/proc/{pid}/schedstat') as schedstat:
+        return int(schedstat.read().split()[0]) / 1e9
+
+
+def bench_engines(lines, producers=None):
+    # memory and CPU of a monitor watching many log files, with a
+    # File Watcher process per file or with the asyncio engine
+    from monitor import Monitor, ENGINE_PROCESSES, ENGINE_ASYNCIO
+    results = dict()
+    for files in ENGINE_FILE_COUNTS:
+        file_lines = max(1, lines // files)
+        for engine in (ENGINE_PROCESSES, ENGINE_ASYNCIO):
+            with tempfile.TemporaryDirectory() as directory:
+                filenames = [os.path.join(directory, f'access{i}.log')
+                             for i in range(files)]
+                for filename in filenames:
+                    open(filename, 'w').close()
+                monitor = Monitor(filenames, 10, ENGINE_BENCH_FRAME_INTERVAL,
+                                  ENGINE_BENCH_FRAME_INTERVAL * 4, ui=False,
+                                  engine=engine)
+                monitor.initialize()
+                monitor.start()
+                pids = [proc.pid for proc in monitor._processes]
+                # let the watchers reach the end of the files
+                time.sleep(ENGINE_IDLE_SECONDS)
+                pss = sum(process_pss(pid) for pid in pids)
+                cpu = sum(process_cpu(pid) for pid in pids)
+                time.sleep(ENGINE_IDLE_SECONDS)
+                idle_cpu = sum(process_cpu(pid) for pid in pids) - cpu
+
+                cpu = sum(process_cpu(pid) for pid in pids)
+                start = time.perf_counter()
+                for i, filename in enumerate(filenames):
+                    with open(filename, 'a') as log_file:
+                        log_file.write(''.join(
+                            SAMPLE_LINES['common'].format(i % 256, j % 100) + '\n'
+                            for j in range(file_lines)))
+                while monitor._aggregated_statistics.get('total_hit_count', 0) < \
+                        file_lines * files:
+                    time.sleep(ENGINE_BENCH_FRAME_INTERVAL / 4)
+                elapsed = time.perf_counter() - start
+                load_cpu = sum(process_cpu(pid) for pid in pids) - cpu
+                monitor.stop()
+                monitor.wait_for_finish()
+            results[f'{engine}_{files}'] = dict(
+                processes=len(pids), pss_mb=pss / 1024,
+                idle_cpu=idle_cpu / ENGINE_IDLE_SECONDS,
+                lines_per_second=file_lines * files / elapsed,
+                cpu_per_line_us=load_cpu / (file_lines * files) * 1e6)
+    for name, result in results.items():
+        print(f'engine {name:15s} {result["processes"]:5d} processes '
+              f'{result["pss_mb"]:8.1f} MB '
+              f'{result["idle_cpu"] * 100:6.1f}% idle CPU '
+              f'{result["lines_per_second"]:10.0f} lines/s '
+              f'{result["cpu_per_line_us"]:6.1f} us CPU/line')
+    return results
+
+
+RULE_BENCH_FRAMES = 200
+RULE_BENCH_FRAME_LINES = 10000
+RULE_BENCH_SECTIONS = 1000
+RULE_BENCH_HOSTS = 5000
+
+
+def make_rules(rules, any_rules):
+    # rules over sections and hosts of the frames of bench_rules, any_rules
+    # of them applying to all keys
+    definitions = []
+    for i in range(rules):
+        kind = i % 10
+        key = '*' if i < any_rules else None
+        if kind < 6:
+            definitions.append(f'[rate{i}]\nrule = section_rate\nsection = {key or f"/item{i}"}\n'
+                               f'window = {1 + i % 3}m\nabove = {1 + i % 50}\n')
+        elif kind < 8:
+            definitions.append(f'[errors{i}]\nrule = error_ratio\nsection = {key or f"/item{i}"}\n'
+                               f'window = 2m\nabove = 0.1\nmin_hits = 10\n')
+        else:
+            definitions.append(f'[budget{i}]\nrule = host_bytes\nhost = {key or f"10.0.{i % 256}.{i // 256}"}\n'
+                               f'window = 5m\nabove = {100000 * (1 + i % 20)}\n')
+    return '\n'.join(definitions)
+
+
+def bench_rules(lines=None, producers=None):
+    # evaluation time of alert rules on each closed frame, on frames with
+    # skewed section and host popularity, a tenth of the traffic bursting
+    from alert_rules import parse_rules
+    from analyzer import FrameStats
+    import random
+    rng = random.Random(1)
+    frames = []
+    for frame_index in range(RULE_BENCH_FRAMES):
+        burst = rng.randrange(RULE_BENCH_SECTIONS)
+        records = []
+        for _ in range(RULE_BENCH_FRAME_LINES):
+            section = int(rng.paretovariate(1.2)) % RULE_BENCH_SECTIONS
+            if rng.random() < 0.1:
+                section = burst
+            host = int(rng.paretovariate(1.1)) % RULE_BENCH_HOSTS
+            records.append((f'/item{section}', f'10.0.{host % 256}.{host // 256}',
+                            rng.randrange(100, 10000), 503 if rng.random() < 0.05 else 200,
+                            0, 0))
+        frame = FrameStats()
+        frame.add_batch(records)
+        frames.append(frame)
+    results = dict()
+    for any_rules in (0, 10):
+        engine = parse_rules(make_rules(1000, any_rules), 10)
+        durations = []
+        alerts = 0
+        for frame_index, frame in enumerate(frames):
+            start = time.perf_counter()
+            alerts = alerts + len(engine.evaluate(frame, frame_index * 10))
+            durations.append(time.perf_counter() - start)
+        durations.sort()
+        results[f'{len(engine)}_rules_{any_rules}_any'] = dict(
+            mean_ms=sum(durations) / len(durations) * 1000,
+            p99_ms=durations[int(len(durations) * 0.99)] * 1000, alerts=alerts)
+    for name, result in results.items():
+        print(f'rules {name:20s} {result["mean_ms"]:8.3f} ms/frame mean '
+              f'{result["p99_ms"]:8.3f} ms/frame p99 {result["alerts"]:6d} alerts')
+    return results
+
+
+PIPELINE_FRAME_INTERVAL = 0.1
+PIPELINE_LATENCY_SECONDS = 5
+# latency is measured at this share of the sustained throughput, up to
+# PIPELINE_LATENCY_LPS
+PIPELINE_LATENCY_SHARE = 0.5
+PIPELINE_LATENCY_LPS = 100000
+PIPELINE_POLL_INTERVAL = 0.001
+PIPELINE_TIMEOUT = 60
+
+
+def counted_lines(monitor):
+    return monitor._aggregated_statistics.get('total_hit_count', 0)
+
+
+def wait_counted(monitor, lines):
+    deadline = time.perf_counter() + PIPELINE_TIMEOUT
+    while counted_lines(monitor) < lines and time.perf_counter() < deadline:
+        time.sleep(PIPELINE_POLL_INTERVAL)
+
+
+def measure_latency(monitor, generator, lps, seconds):
+    # write lines at lps, return the delays in seconds from the writes to
+    # the publication of statistics counting them, one per write
+    snapshot = monitor._aggregated_statistics
+    first_line = counted_lines(monitor)
+    # (write time, lines written when done)
+    pending = deque()
+    delays = []
+    written = 0
+    version = None
+    start = time.time()
+    while time.time() < start + seconds + PIPELINE_TIMEOUT:
+        now = time.time()
+        if now < start + seconds:
+            due = int((now - start) * lps) - written
+            if due > 0:
+                generator.write_lines(due, now)
+                written = written + due
+                pending.append((now, written))
+        elif not pending:
+            break
+        if snapshot.version != version:
+            version = snapshot.version
+            counted = counted_lines(monitor) - first_line
+            while pending and pending[0][1] <= counted:
+                delays.append(time.time() - pending.popleft()[0])
+        time.sleep(PIPELINE_POLL_INTERVAL)
+    return delays
+
+
+def bench_pipeline(lines, producers=None):
+    # lines appended by BulkLogGenerator to a log file, through File Watcher
+    # and aggregate to the published statistics: sustained throughput on a
+    # backlog, then latency at a steady rate below it, a frame being
+    # published every PIPELINE_FRAME_INTERVAL
+    from monitor import Monitor, ENGINE_PROCESSES, ENGINE_ASYNCIO
+    from traffic_generator import BulkLogGenerator
+    results = dict()
+    for engine in (ENGINE_PROCESSES, ENGINE_ASYNCIO):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'access.log')
+            open(filename, 'w').close()
+            monitor = Monitor([filename], 10, PIPELINE_FRAME_INTERVAL,
+                              PIPELINE_FRAME_INTERVAL * 4, ui=False, engine=engine)
+            monitor.initialize()
+            monitor.start()
+            generator = BulkLogGenerator(filename)
+            start = time.perf_counter()
+            generator.write_lines(lines)
+            write_elapsed = time.perf_counter() - start
+            wait_counted(monitor, lines)
+            elapsed = time.perf_counter() - start
+            counted = counted_lines(monitor)
+            lps = min(PIPELINE_LATENCY_LPS, int(counted / elapsed * PIPELINE_LATENCY_SHARE))
+            delays = sorted(measure_latency(monitor, generator, lps, PIPELINE_LATENCY_SECONDS))
+            generator.close()
+            monitor.stop()
+            monitor.wait_for_finish()
+        results[engine] = dict(
+            generator_lines_per_second=lines / write_elapsed,
+            lines_per_second=counted / elapsed, lost_lines=lines - counted,
+            latency_lines_per_second=lps, frame_interval=PIPELINE_FRAME_INTERVAL,
+            p50_ms=round(delays[len(delays) // 2] * 1000, 1) if delays else None,
+            p99_ms=round(delays[int(len(delays) * 0.99)] * 1000, 1) if delays else None)
+    for name, result in results.items():
+        print(f'pipeline {name:10s} {result["lines_per_second"]:10.0f} lines/s '
+              f'(written at {result["generator_lines_per_second"]:.0f}), latency at '
+              f'{result["latency_lines_per_second"]} lines/s '
+              f'p50 {result["p50_ms"]} ms p99 {result["p99_ms"]} ms')
+    return results
+
+
+OVERLOAD_BASE_LPS = 5000
+OVERLOAD_BURST = 50
+OVERLOAD_BASE_SECONDS = 5
+OVERLOAD_BURST_SECONDS = 10
+OVERLOAD_SAMPLE_INTERVAL = 0.25
+
+
+def bench_overload(lines=None, producers=None):
+    # a burst of OVERLOAD_BURST times the base rate through a monitor with
+    # each overload policy: memory of the monitor processes, lines written
+    # but neither counted nor dropped yet, and how long counting takes to
+    # catch up with the end of the burst
+    from file_watcher import OVERLOAD_POLICIES
+    from monitor import Monitor
+    from traffic_generator import BulkLogGenerator
+    results = dict()
+    for policy in OVERLOAD_POLICIES:
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'access.log')
+            open(filename, 'w').close()
+            monitor = Monitor([filename], 10, PIPELINE_FRAME_INTERVAL,
+                              PIPELINE_FRAME_INTERVAL * 4, ui=False, overload=policy)
+            monitor.initialize()
+            monitor.start()
+            pids = [proc.pid for proc in monitor._processes]
+            stats = monitor._aggregated_statistics
+            samples = []
+
+            def handled():
+                return counted_lines(monitor) + stats.get('dropped_log_count', 0)
+
+            def sample(now, written):
+                if not samples or now > samples[-1][0] + OVERLOAD_SAMPLE_INTERVAL:
+                    samples.append((now, sum(process_pss(pid) for pid in pids),
+                                    written - handled(),
+                                    stats.get('sampling_rate', 1)))
+
+            generator = BulkLogGenerator(filename, OVERLOAD_BASE_LPS)
+            generator.run(OVERLOAD_BASE_SECONDS, on_write=sample)
+            generator._lps = OVERLOAD_BASE_LPS * OVERLOAD_BURST
+            generator.run(OVERLOAD_BURST_SECONDS, on_write=sample)
+            burst_end = time.time()
+            burst_lines = generator.line_count
+            generator._lps = OVERLOAD_BASE_LPS
+            catch_up = None
+            deadline = burst_end + PIPELINE_TIMEOUT
+            while time.time() < deadline:
+                generator.run(PIPELINE_POLL_INTERVAL * 10, on_write=sample)
+                if handled() >= burst_lines:
+                    catch_up = time.time() - burst_end
+                    break
+            written = generator.line_count
+            while handled() < written and time.time() < deadline:
+                time.sleep(PIPELINE_POLL_INTERVAL)
+            counted = counted_lines(monitor)
+            dropped = stats.get('dropped_log_count', 0)
+            generator.close()
+            monitor.stop()
+            monitor.wait_for_finish()
+        results[policy] = dict(
+            written_lines=written, counted_lines=counted, dropped_lines=dropped,
+            burst_lines_per_second=OVERLOAD_BASE_LPS * OVERLOAD_BURST,
+            max_pss_mb=round(max(row[1] for row in samples) / 1024, 1),
+            max_behind_lines=max(row[2] for row in samples),
+            max_sampling_rate=round(max(row[3] for row in samples), 1),
+            catch_up_seconds=round(catch_up, 2) if catch_up is not None else None)
+    for name, result in results.items():
+        print(f'overload {name:6s} {result["written_lines"]} lines written, '
+              f'{result["counted_lines"]} counted, {result["dropped_lines"]} dropped, '
+              f'max {result["max_pss_mb"]} MB, {result["max_behind_lines"]} lines behind, '
+              f'sampling 1 in {result["max_sampling_rate"]}, caught up with the burst '
+              f'after {result["catch_up_seconds"]} s')
+    return results
+
+
+CHECKPOINT_KEY_COUNTS = (1000, 10000, 100000, 1000000)
+CHECKPOINT_REPEATS = 5
+
+
+def bench_checkpoint(lines=None, producers=None):
+    # cost of a checkpoint of an Analyzer with exact lifetime counters of
+    # 1k to 1M distinct hosts: written in place, as when stopping, and the
+    # stall of the counting process forking a child to write it, as each frame
+    from analyzer import Analyzer, FrameStats
+    from checkpoint import save_checkpoint, CheckpointWriter
+    results = dict()
+    for keys in CHECKPOINT_KEY_COUNTS:
+        analyzer = Analyzer(10, 120, time.time())
+        frame = FrameStats()
+        frame.add_batch([(f'/section{i % (keys // 10)}', f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}',
+                          100, 200, 0.0, i) for i in range(keys)])
+        analyzer.close_frame(frame, time.time(), 10)
+        state = {'analyzer': analyzer, 'positions': {0: (1, 0)}}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'monitor.ckpt')
+            start = time.perf_counter()
+            for _ in range(CHECKPOINT_REPEATS):
+                save_checkpoint(path, state)
+            in_place = (time.perf_counter() - start) / CHECKPOINT_REPEATS
+            size = os.path.getsize(path)
+            writer = CheckpointWriter(path)
+            stall = 0
+            for _ in range(CHECKPOINT_REPEATS):
+                start = time.perf_counter()
+                writer.save(state)
+                stall = stall + time.perf_counter() - start
+                writer.close()
+        results[keys] = dict(size_mb=round(size / 1e6, 1), in_place_ms=round(in_place * 1000, 1),
+                             fork_stall_ms=round(stall / CHECKPOINT_REPEATS * 1000, 2))
+    for keys, result in results.items():
+        print(f'checkpoint {keys:8d} keys {result["size_mb"]:6.1f} MB, '
+              f'{result["in_place_ms"]:8.1f} ms in place, '
+              f'{result["fork_stall_ms"]:6.2f} ms stall when forked')
+    return results
+
+
+BENCHMARKS = {
+    'transport': bench_transport,
+    'parser': bench_parser,
+    'reader': bench_reader,
+    'shards': bench_shards,
+    'replay': bench_replay,
+    'engines': bench_engines,
+    'rules': bench_rules,
+    'pipeline': bench_pipeline,
+    'overload': bench_overload,
+    'checkpoint': bench_checkpoint,
+}
+
+
+def usage():
+    print('''
+Run micro benchmarks of monitor components
+benchmark.py [-n 200000] [-p 2] [-o results.json] [benchmark ...]
+    -n --lines      number of log lines sent by each producer
+    -p --producers  number of producer processes
+    -o --output     write the results as JSON to this file, - for stdout
+available benchmarks: {}
+'''.format(', '.join(BENCHMARKS)))
+
+
+def git_commit():
+    # commit of the benchmarked tree, None outside of a git work tree
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hn:p:o:', [
+                                   'help', 'lines=', 'producers=', 'output='])
+    except getopt.GetoptError as err:
+        print(err)
+        usage()
+        sys.exit(2)
+    lines = DEFAULT_LINES
+    producers = DEFAULT_PRODUCERS
+    output = None
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif o in ("-n", "--lines"):
+            lines = int(a)
+        elif o in ("-p", "--producers"):
+            producers = int(a)
+        elif o in ("-o", "--output"):
+            output = a
+        else:
+            assert False, "unhandled option"
+    names = args if args else list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f'unknown benchmark {name}')
+            usage()
+            sys.exit(2)
+    results = dict()
+    for name in names:
+        results[name] = BENCHMARKS[name](lines, producers)
+    if output:
+        report = json.dumps({'commit': git_commit(), 'time': time.time(),
+                             'python': sys.version.split()[0], 'cpus': os.cpu_count(),
+                             'lines': lines, 'producers': producers,
+                             'results': results}, indent=2)
+        if output == '-':
+            print(report)
+        else:
+            with open(output, 'w') as output_file:
+                output_file.write(report + '\n')
+
+
+if __name__ == "__main__":
+    main()
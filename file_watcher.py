@@ -1,7 +1,12 @@
 import os
+import queue
 import time
+import mmap
+from collections import deque
 
-from parser import LogParser
+from parser import LogParser, timestamp_from_date, path_from_request, path_hash, \
+    DEFAULT_LOG_FORMAT
+from inotify import INotify, INOTIFY_AVAILABLE, IN_Q_OVERFLOW, IN_DELETE_SELF, IN_MOVE_SELF
 
 
 class LogItem(object):
@@ -19,6 +24,11 @@ class LogItem(object):
         self.size = size
         self.section = section
 
+    def to_record(self):
+        return (self.section, self.remotehost, int(self.size), int(self.status),
+                timestamp_from_date(self.date),
+                path_hash(path_from_request(self.request)))
+
     def __str__(self):
         return '{} {} {} {} {} {} {} {}'.format(
             self.remotehost,
@@ -32,39 +42,470 @@ class LogItem(object):
         )
 
 
+# compact form of a LogItem sent to Analyzer:
+#   (section, remotehost, size, status, timestamp, path hash)
+# timestamp is the date of the log line in seconds since epoch, path hash is
+# the hash64 of the request path
+# records are sent in batches, a batch is flushed to the log queue when it is
+# full or when its oldest record is older than the age limit
+DEFAULT_BATCH_SIZE = 512
+DEFAULT_BATCH_AGE = 0.05
+
+# Log queues are bounded, when Analyzer can not keep up File Watchers
+#   block  wait for room in the log queue, the log files keep the backlog,
+#   drop   drop and count the batches not fitting in the log queue,
+#   sample parse 1 in N lines, N doubling while the log queue is more than
+#          SAMPLING_HIGH_FILL full, or the unread end of the log file more than
+#          SAMPLING_HIGH_FILL of SAMPLING_BACKLOG, and halving while both are
+#          under SAMPLING_LOW_FILL, then block when the log queue is full anyway.
+#          The backlog counts as much as the log queue: with few CPUs, File
+#          Watchers parsing lines fall behind before Analyzer does.
+#          Batches of sampled records carry N as their weight, Analyzer counts
+#          each record N times.
+OVERLOAD_BLOCK = 'block'
+OVERLOAD_DROP = 'drop'
+OVERLOAD_SAMPLE = 'sample'
+OVERLOAD_POLICIES = (OVERLOAD_BLOCK, OVERLOAD_DROP, OVERLOAD_SAMPLE)
+# batches in a log queue
+DEFAULT_QUEUE_BATCHES = 256
+SAMPLING_HIGH_FILL = 0.5
+SAMPLING_LOW_FILL = 0.1
+# bytes of log file left to read making a full log queue
+SAMPLING_BACKLOG = 4 * 1024 * 1024
+MAX_SAMPLING_RATE = 1024
+# the rate increases fast to absorb a burst and decreases slowly
+SAMPLING_INCREASE_INTERVAL = 0.1
+SAMPLING_DECREASE_INTERVAL = 1
+# seconds a blocked File Watcher waits for room before checking it still runs
+PUT_TIMEOUT = 0.1
+
+# with event time windowing or checkpoints, a watermark
+# (source, timestamp, inode, offset) is sent after the batches of a source,
+# promising that its next records are not older than timestamp, and telling
+# the position in the log file following these batches.
+# The watermark is the latest timestamp read, it is sent at most every
+# WATERMARK_INTERVAL seconds while reading, and as a heartbeat when the watcher
+# waits at the end of file, when it is at least the time now minus WATERMARK_DELAY,
+# the time allowed for a line to be written into the log. It is never ahead of
+# the time now plus WATERMARK_DELAY, so that a line dated in the future, from a
+# typo or a host with a wrong clock, does not close the frames up to its date.
+WATERMARK_INTERVAL = 0.5
+WATERMARK_DELAY = 2
+
 DEFAULT_READLINE_SLEEP = 0.1
 DEFAULT_READLINE_TIMEOUT = 1
 
-# minic the "tail -f" on Linux
+# files are read in binary chunks which are split into lines
+READ_CHUNK_SIZE = 1024 * 1024
+# when more than this is left to read, catch up through mmap in bigger chunks
+MMAP_CATCHUP_THRESHOLD = 16 * 1024 * 1024
+MMAP_CHUNK_SIZE = 8 * 1024 * 1024
+# lines longer than this are not log lines, they are skipped
+MAX_LINE_SIZE = READ_CHUNK_SIZE
+
+
+class WeightedBatch(list):
+    # batch of sampled records, each standing for weight records
+    def __init__(self, records, weight):
+        super().__init__(records)
+        self.weight = weight
+
+
+class LogBatcher(object):
+    def __init__(self, log_queue, batch_size=DEFAULT_BATCH_SIZE, batch_age=DEFAULT_BATCH_AGE,
+                 block=True, running=None):
+        self._log_queue = log_queue
+        self._batch_size = batch_size
+        self._batch_age = batch_age
+        self._batch = []
+        self._batch_start_time = 0
+        # batches are dropped when the log queue is full unless blocking
+        self._block = block
+        # blocked puts give up once running is cleared
+        self._running = running
+        self.dropped = 0
+        # of the records being batched
+        self.weight = 1
+
+    def _put(self, item):
+        # False when item did not fit in the log queue, dropped or given up
+        # on once the monitor stops
+        if not self._block:
+            try:
+                self._log_queue.put(item, block=False)
+                return True
+            except queue.Full:
+                return False
+        while True:
+            try:
+                self._log_queue.put(item, timeout=PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                if self._running is not None and self._running.value != 1:
+                    return False
+
+    def _put_batch(self, batch):
+        if self.weight != 1:
+            batch = WeightedBatch(batch, self.weight)
+        if not self._put(batch) and not self._block:
+            self.dropped = self.dropped + len(batch) * self.weight
+
+    def set_weight(self, weight):
+        if weight != self.weight:
+            self.flush()
+            self.weight = weight
+
+    def add(self, record):
+        if not self._batch:
+            self._batch_start_time = time.monotonic()
+        self._batch.append(record)
+        if len(self._batch) >= self._batch_size or \
+                time.monotonic() - self._batch_start_time > self._batch_age:
+            self.flush()
+
+    def extend(self, records):
+        if not records:
+            return
+        if not self._batch:
+            self._batch_start_time = time.monotonic()
+        self._batch.extend(records)
+        while len(self._batch) >= self._batch_size:
+            self._put_batch(self._batch[:self._batch_size])
+            self._batch = self._batch[self._batch_size:]
+            self._batch_start_time = time.monotonic()
+        if time.monotonic() - self._batch_start_time > self._batch_age:
+            self.flush()
+
+    def flush(self):
+        if self._batch:
+            self._put_batch(self._batch)
+            self._batch = []
+
+    def watermark(self, source, timestamp, inode=0, offset=0):
+        # sent after the records it covers
+        # a dropped watermark is replaced by the next one
+        self.flush()
+        self._put((source, timestamp, inode, offset))
+
+    def close(self):
+        # on stop, the batches left in the log queue may never be read, the
+        # process exits without waiting for them to be sent
+        if hasattr(self._log_queue, 'cancel_join_thread'):
+            self._log_queue.cancel_join_thread()
+
+
+class ShardedLogBatcher(object):
+    # records are partitioned over the log queues of Analyzer shards by remote host,
+    # a host is spread more evenly than a section, which can be very hot
+    def __init__(self, log_queues, batch_size=DEFAULT_BATCH_SIZE, batch_age=DEFAULT_BATCH_AGE,
+                 block=True, running=None):
+        self._batchers = [LogBatcher(log_queue, batch_size, batch_age, block, running)
+                          for log_queue in log_queues]
+
+    @property
+    def dropped(self):
+        return sum(batcher.dropped for batcher in self._batchers)
+
+    @property
+    def weight(self):
+        return self._batchers[0].weight
+
+    def set_weight(self, weight):
+        for batcher in self._batchers:
+            batcher.set_weight(weight)
+
+    def add(self, record):
+        self._batchers[hash(record[1]) % len(self._batchers)].add(record)
+
+    def extend(self, records):
+        shard_count = len(self._batchers)
+        shard_records = [[] for _ in range(shard_count)]
+        for record in records:
+            shard_records[hash(record[1]) % shard_count].append(record)
+        for batcher, records in zip(self._batchers, shard_records):
+            batcher.extend(records)
+
+    def flush(self):
+        for batcher in self._batchers:
+            batcher.flush()
+
+    def watermark(self, source, timestamp, inode=0, offset=0):
+        # every shard waits for the watermarks of all sources
+        for batcher in self._batchers:
+            batcher.watermark(source, timestamp, inode, offset)
+
+    def close(self):
+        for batcher in self._batchers:
+            batcher.close()
+
+
+def make_log_batcher(log_queue, batch_size=DEFAULT_BATCH_SIZE, batch_age=DEFAULT_BATCH_AGE,
+                     block=True, running=None):
+    # log_queue is a list of queues when Analyzer is sharded
+    if isinstance(log_queue, (list, tuple)):
+        return ShardedLogBatcher(log_queue, batch_size, batch_age, block, running)
+    return LogBatcher(log_queue, batch_size, batch_age, block, running)
+
+
+class AdaptiveSampler(object):
+    '''
+    1 in rate lines of a File Watcher, the rate following the fill of the log
+    queues holding up to capacity batches, or slots of a shared ring, and the
+    backlog of the log file.
+    '''
+
+    def __init__(self, log_queues, capacity):
+        self._log_queues = log_queues if isinstance(log_queues, (list, tuple)) else [log_queues]
+        self._capacity = capacity
+        self.rate = 1
+        self._last_change = 0
+        # lines to skip before the next sampled line
+        self._skip = 0
+
+    def fill(self, backlog=0):
+        # of the fullest log queue, or of the backlog in bytes
+        try:
+            fill = max(log_queue.qsize() for log_queue in self._log_queues) / self._capacity
+        except NotImplementedError:
+            fill = 0
+        return max(fill, backlog / SAMPLING_BACKLOG)
+
+    def update(self, now, backlog=0):
+        # adapt the rate to the log queues and backlog, return it
+        fill = self.fill(backlog)
+        if fill > SAMPLING_HIGH_FILL and self.rate < MAX_SAMPLING_RATE and \
+                now > self._last_change + SAMPLING_INCREASE_INTERVAL:
+            self.rate = self.rate * 2
+            self._last_change = now
+        elif fill < SAMPLING_LOW_FILL and self.rate > 1 and \
+                now > self._last_change + SAMPLING_DECREASE_INTERVAL:
+            self.rate = self.rate // 2
+            self._last_change = now
+            self._skip = min(self._skip, self.rate - 1)
+        return self.rate
+
+    def sample(self, lines):
+        # every rate-th line, following on from the previous lines
+        rate = self.rate
+        if rate == 1:
+            return lines
+        sampled = lines[self._skip::rate]
+        self._skip = self._skip + rate * len(sampled) - len(lines)
+        return sampled
+
+
+# minic the "tail -F" on Linux: follow the file by name, across rotations.
+# File changes are waited for with inotify when available, by polling otherwise.
+# A rotation (file renamed or deleted, then created again) is detected by a new
+# inode under the same name, the old file is read to the end before switching.
+# A truncation is detected by the file size shrinking below the read position.
+#
+# The file is read in binary chunks split into lines, a partial last line is
+# kept until the rest of it is written, unless it grows beyond MAX_LINE_SIZE:
+# the line is then skipped up to its line feed. When far behind the end of the
+# file, the backlog is read through mmap.
+#
+# A watcher can resume at a position (inode, offset) saved by a checkpoint, when
+# the file has been rotated since then, the new file is read from its beginning.
 
 
 class FileWatcher(object):
-    def __init__(self, filename, timeout=DEFAULT_READLINE_TIMEOUT):
+    def __init__(self, filename, timeout=DEFAULT_READLINE_TIMEOUT, log_format=DEFAULT_LOG_FORMAT,
+                 use_inotify=True, from_beginning=False, position=None):
+        self._filename = filename
+        self._log_format = log_format
+        self._file_handle = None
+        self._file_id = None
+        self._position = 0
+        self._partial_line = b''
+        # skipping the rest of an overlong line
+        self._skipping_line = False
+        self._catching_up = False
+        # lines read but not returned yet by readline()
+        self._pending_lines = deque()
+        # (inode, offset) of the end of the file left at the last rotation
+        self.rotated_from = None
         try:
-            self._file_handle = open(filename, 'r')
-            self._file_handle.seek(0, os.SEEK_END)
+            self._open()
+            size = os.fstat(self._file_handle.fileno()).st_size
+            if position is not None:
+                inode, offset = position
+                if inode == self._file_id[1] and offset <= size:
+                    self._position = offset
+            elif not from_beginning:
+                self._position = size
         except FileNotFoundError as err:
             print(err)
             raise err
-        if timeout == 0:
-            self._readline_max_sleep_count = 0
-        else:
-            self._readline_max_sleep_count = int(
-                timeout / DEFAULT_READLINE_SLEEP)
+        self._timeout = timeout
+        self._use_inotify = use_inotify and INOTIFY_AVAILABLE
+        # created in the watching process, when waiting for the first time
+        self._inotify = None
+
+    def _open(self):
+        file_handle = open(self._filename, 'rb', buffering=0)
+        stat = os.fstat(file_handle.fileno())
+        if self._file_handle:
+            self._file_handle.close()
+        self._file_handle = file_handle
+        self._file_id = (stat.st_dev, stat.st_ino)
+        self._position = 0
+        self._partial_line = b''
+        self._skipping_line = False
+        self._catching_up = False
+
+    def _read_lines_mmap(self):
+        # read a big chunk of backlog through mmap, None when not far behind anymore
+        fileno = self._file_handle.fileno()
+        size = os.fstat(fileno).st_size
+        if size - self._position < MMAP_CATCHUP_THRESHOLD:
+            self._catching_up = False
+            return None
+        with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mapped:
+            end = mapped.rfind(b'\n', self._position,
+                               min(size, self._position + MMAP_CHUNK_SIZE))
+            if end < 0:
+                self._catching_up = False
+                return None
+            data = self._partial_line + mapped[self._position:end]
+        self._position = end + 1
+        self._partial_line = b''
+        lines = data.split(b'\n')
+        if self._skipping_line:
+            self._skipping_line = False
+            del lines[0]
+        return lines
+
+    def read_lines(self):
+        # complete lines available now, without line feed, may be empty
+        if self._catching_up:
+            lines = self._read_lines_mmap()
+            if lines is not None:
+                return lines
+        data = os.pread(self._file_handle.fileno(),
+                        READ_CHUNK_SIZE, self._position)
+        if not data:
+            return []
+        self._position = self._position + len(data)
+        if len(data) == READ_CHUNK_SIZE:
+            self._catching_up = True
+        if self._skipping_line:
+            end = data.find(b'\n')
+            if end < 0:
+                return []
+            self._skipping_line = False
+            data = data[end + 1:]
+        if self._partial_line:
+            data = self._partial_line + data
+        lines = data.split(b'\n')
+        self._partial_line = lines.pop()
+        if len(self._partial_line) > MAX_LINE_SIZE:
+            self._partial_line = b''
+            self._skipping_line = True
+        return lines
+
+    def backlog(self):
+        # bytes written to the file but not read yet
+        return max(0, os.fstat(self._file_handle.fileno()).st_size - self._position)
+
+    def position(self):
+        # (inode, offset) of the first line not returned yet
+        return self._file_id[1], self._position - len(self._partial_line)
+
+    def read_last_line(self):
+        # the last line of a file which is not written anymore may have no line feed
+        last_line = self._partial_line
+        self._partial_line = b''
+        return [last_line] if last_line else []
+
+    def _check_file(self):
+        # called once the current file is read to the end,
+        # return True when there is something new to read
+        try:
+            stat = os.stat(self._filename)
+        except FileNotFoundError:
+            # file is gone for now, wait for it to come back
+            return False
+        if (stat.st_dev, stat.st_ino) != self._file_id:
+            # rotated, the new file is read from the beginning
+            last_line = self._partial_line
+            self.rotated_from = (self._file_id[1], self._position)
+            try:
+                self._open()
+            except FileNotFoundError:
+                return False
+            if last_line:
+                # the old file did not end with a line feed
+                self._pending_lines.append(last_line)
+            return True
+        if stat.st_size < self._position:
+            # truncated
+            self._position = 0
+            self._partial_line = b''
+            self._skipping_line = False
+            return True
+        return False
+
+    def _wait(self, timeout):
+        # wait for a change of the file, or timeout
+        if not self._use_inotify:
+            time.sleep(min(timeout, DEFAULT_READLINE_SLEEP))
+            return
+        basename = os.path.basename(self._filename)
+        deadline = time.monotonic() + timeout
+        while timeout > 0:
+            events = self._inotify.wait(timeout)
+            if any(name == basename or mask & (IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF)
+                   for _, mask, name in events):
+                return
+            timeout = deadline - time.monotonic()
+
+    def poll_lines(self):
+        # complete lines available now, following rotation and truncation,
+        # empty when there is nothing new
+        while True:
+            lines = self.read_lines()
+            if self._pending_lines:
+                lines = list(self._pending_lines) + lines
+                self._pending_lines.clear()
+            if lines or not self._check_file():
+                return lines
+
+    def wait_lines(self):
+        # wait for new lines, return empty list after long time no line,
+        # wait forever if timeout is 0
+        deadline = time.monotonic() + self._timeout if self._timeout else None
+        if self._use_inotify and self._inotify is None:
+            try:
+                self._inotify = INotify()
+                # watching the directory follows the file across rotations
+                self._inotify.add_watch(os.path.dirname(
+                    os.path.abspath(self._filename)))
+            except OSError as err:
+                # out of inotify instances or watches
+                print(f'polling {self._filename}: {err}')
+                if self._inotify is not None:
+                    self._inotify.close()
+                    self._inotify = None
+                self._use_inotify = False
+        while True:
+            lines = self.poll_lines()
+            if lines:
+                return lines
+            if deadline is None:
+                self._wait(DEFAULT_READLINE_TIMEOUT)
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._wait(remaining)
 
     def readline(self):
-        line = None
-        sleep_count = 0
-        while not line:
-            line = self._file_handle.readline()
-            if line == '':
-                time.sleep(DEFAULT_READLINE_SLEEP)
-                # return empty line after long time no line
-                if self._readline_max_sleep_count and sleep_count > self._readline_max_sleep_count:
-                    return ''
-                sleep_count = sleep_count + 1
-
-        return line
+        if not self._pending_lines:
+            self._pending_lines.extend(self.wait_lines())
+            if not self._pending_lines:
+                return ''
+        return self._pending_lines.popleft().decode('utf-8', 'replace') + '\n'
 
     def __iter__(self):
         return self
@@ -72,21 +513,46 @@ class FileWatcher(object):
     def __next__(self):
         return self.readline()
 
-    def watch(self, log_queue, running):
-        parser = LogParser()
+    def watch(self, log_queue, running,
+              batch_size=DEFAULT_BATCH_SIZE, batch_age=DEFAULT_BATCH_AGE, source=None,
+              send_every_position=False, count_lines=None, block=True, sampler=None):
+        # watermarks and positions are sent with this source id when it is not None,
+        # after every chunk of records when send_every_position, so that a
+        # checkpoint covers every record counted.
+        # count_lines(lines, records, skipped, dropped) is called with the
+        # numbers of lines read, records parsed, lines skipped by the
+        # AdaptiveSampler and records dropped by each chunk.
+        # See OVERLOAD_POLICIES for block and sampler
+        parser = LogParser(log_format=self._log_format, binary=True)
+        batcher = make_log_batcher(log_queue, batch_size, batch_age, block, running)
+        dropped = 0
+        watermark = 0
+        next_watermark_time = 0
         while running.value == 1:
-            line = self.readline()
-            if line == '':
-                continue
-            remotehost, rfc931, authuser, date, request, status, size = parser.parse_line(
-                line)
-            if not request:
-                continue
-            section = parser.section_from_request(request)
-            try:
-                size = int(size)
-            except ValueError:
-                size = 0
-            log_item = LogItem(remotehost, rfc931, authuser,
-                               date, request, status, size, section)
-            log_queue.put(log_item)
+            lines = self.read_lines()
+            if not lines:
+                # reached end of file, send what we have before waiting
+                if source is None:
+                    batcher.flush()
+                else:
+                    watermark = max(watermark, time.time() - WATERMARK_DELAY)
+                    batcher.watermark(source, watermark, *self.position())
+                lines = self.wait_lines()
+            sampled_lines = lines
+            if sampler is not None and lines:
+                batcher.set_weight(sampler.update(time.monotonic(), self.backlog()))
+                sampled_lines = sampler.sample(lines)
+            records = parser.parse_records(sampled_lines)
+            batcher.extend(records)
+            if count_lines is not None and lines:
+                count_lines(len(lines), len(records), len(lines) - len(sampled_lines),
+                            batcher.dropped - dropped)
+                dropped = batcher.dropped
+            if source is not None and records:
+                # log lines are written in time order
+                watermark = max(watermark, min(records[-1][4], time.time() + WATERMARK_DELAY))
+                if send_every_position or time.monotonic() > next_watermark_time:
+                    batcher.watermark(source, watermark, *self.position())
+                    next_watermark_time = time.monotonic() + WATERMARK_INTERVAL
+        # records batched when stopping are not sent, Analyzer is stopping too
+        batcher.close()
@@ -0,0 +1,170 @@
+import os
+import signal
+import tempfile
+import time
+from multiprocessing.sharedctypes import RawArray
+
+# Counters of the monitor's own work, to tell which stage lags: lines read,
+# skipped by sampling, parsed into records and records dropped for each log
+# file, lines neither skipped nor parsed being parse errors; the depth of the
+# log queues; the share of time the aggregating processes are busy counting
+# records rather than waiting for them; and the time taken to close a frame.
+# They are added once per chunk of lines, batch of records or frame, never per
+# line, and reported with the statistics of each frame.
+#
+# File Watcher processes add their counts into shared memory, each in its own
+# slots, read by the process publishing the frames. The asyncio engine counts
+# into a dict, its files come and go. Shared counters only grow and are only
+# written by the process owning them, the publishing process keeps the values
+# of its last report, so no count is lost to concurrent updates.
+
+COUNTS = 4
+# samples of the sampling profiler, in seconds of CPU time
+PROFILE_INTERVAL = 0.005
+# wall clock duration of a profile
+PROFILE_SECONDS = 10
+
+
+class Health(object):
+    '''
+    sources is the number of File Watcher processes, None when the sources
+    are read by the publishing process, shards the number of processes
+    counting records.
+    '''
+
+    def __init__(self, sources=None, shards=1):
+        # lines, records, skipped lines and dropped records of each File Watcher
+        self._shared_counts = RawArray('Q', COUNTS * sources) if sources else None
+        # source -> [lines, records, skipped lines, dropped records]
+        self._counts = dict()
+        # seconds busy of each shard, and at the last report
+        self._busy = RawArray('d', shards)
+        self._last_busy = [0.0] * shards
+        self._frame_close_time = 0.0
+        self._frame_close_max = 0.0
+        # (time, lines, records) of the last report
+        self._last = (time.time(), 0, 0)
+
+    def count_lines(self, source, lines, records, skipped=0, dropped=0):
+        if self._shared_counts is not None:
+            counts = self._shared_counts
+            index = COUNTS * source
+        else:
+            counts = self._counts.get(source)
+            if counts is None:
+                counts = [0] * COUNTS
+                self._counts[source] = counts
+            index = 0
+        counts[index] += lines
+        counts[index + 1] += records
+        if skipped:
+            counts[index + 2] += skipped
+        if dropped:
+            counts[index + 3] += dropped
+
+    def count_busy(self, seconds, shard=0):
+        self._busy[shard] += seconds
+
+    def count_frame_close(self, seconds):
+        self._frame_close_time = seconds
+        self._frame_close_max = max(self._frame_close_max, seconds)
+
+    def source_counts(self):
+        # [(source, lines, records, skipped lines, dropped records)]
+        if self._shared_counts is not None:
+            counts = self._shared_counts[:]
+            return [(source, ) + tuple(counts[COUNTS * source:COUNTS * (source + 1)])
+                    for source in range(len(counts) // COUNTS)]
+        return [(source, ) + tuple(counts) for source, counts in self._counts.items()]
+
+    def report(self, now, names=None, queue_depth=None):
+        # dict of the counters, rates and busy shares are since the last
+        # report, names maps sources to the names shown
+        sources = self.source_counts()
+        lines = sum(row[1] for row in sources)
+        records = sum(row[2] for row in sources)
+        skipped = sum(row[3] for row in sources)
+        elapsed = now - self._last[0] if now > self._last[0] else None
+        busy = self._busy[:]
+        busy_since = [seconds - last for seconds, last in zip(busy, self._last_busy)]
+        self._last_busy = busy
+        report = {
+            'pid': os.getpid(),
+            'sources': [((names or {}).get(source, source), source_lines,
+                         source_lines - source_skipped - source_records)
+                        for source, source_lines, source_records, source_skipped, _ in sources],
+            'lines': lines,
+            'records': records,
+            'parse_errors': lines - skipped - records,
+            'skipped_lines': skipped,
+            'dropped': sum(row[4] for row in sources),
+            'lines_per_second': (lines - self._last[1]) / elapsed if elapsed else 0.0,
+            'records_per_second': (records - self._last[2]) / elapsed if elapsed else 0.0,
+            'queue_depth': queue_depth,
+            'busy': [min(1.0, seconds / elapsed) if elapsed else 0.0 for seconds in busy_since],
+            'frame_close_ms': self._frame_close_time * 1000,
+            'frame_close_max_ms': self._frame_close_max * 1000,
+        }
+        self._last = (now, lines, records)
+        return report
+
+
+def queue_depth(log_qs):
+    # batches waiting in the log queues, None when the platform can not tell
+    try:
+        return sum(log_q.qsize() for log_q in log_qs)
+    except NotImplementedError:
+        return None
+
+
+class SamplingProfiler(object):
+    '''
+    CPU profile of a process on demand: SIGUSR1 samples the Python stack
+    every PROFILE_INTERVAL of CPU time for PROFILE_SECONDS, or until the next
+    SIGUSR1, then writes the samples in the collapsed format of flame graphs,
+    "outer;inner count" per line, into profile-<pid>-<time>.txt.
+    Installed by each process doing the work of the monitor, see Monitor.
+    '''
+
+    def __init__(self, directory=None):
+        self._directory = directory or tempfile.gettempdir()
+        # stack -> samples
+        self._samples = None
+
+    def install(self):
+        signal.signal(signal.SIGUSR1, self._toggle)
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.signal(signal.SIGALRM, self._stop)
+
+    def _toggle(self, signum, frame):
+        if self._samples is None:
+            self._samples = dict()
+            signal.setitimer(signal.ITIMER_PROF, PROFILE_INTERVAL, PROFILE_INTERVAL)
+            signal.setitimer(signal.ITIMER_REAL, PROFILE_SECONDS)
+        else:
+            self._stop(signum, frame)
+
+    def _sample(self, signum, frame):
+        samples = self._samples
+        if samples is None:
+            return
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+            frame = frame.f_back
+        stack = ';'.join(reversed(stack))
+        samples[stack] = samples.get(stack, 0) + 1
+
+    def _stop(self, signum, frame):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        samples = self._samples
+        self._samples = None
+        if samples is None:
+            return
+        filename = os.path.join(self._directory, 'profile-{}-{}.txt'.format(
+            os.getpid(), time.strftime('%Y%m%d-%H%M%S')))
+        with open(filename, 'w') as profile:
+            for stack, count in sorted(samples.items(), key=lambda x: -x[1]):
+                profile.write(f'{stack} {count}\n')
@@ -0,0 +1,106 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+
+# Minimal binding of Linux inotify through ctypes.
+# INOTIFY_AVAILABLE is False on other systems, callers fall back to polling.
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# events on files of a directory, enough to follow appends, rotation and truncation
+IN_DIRECTORY_CHANGES = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+    IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+EVENT_BUFFER_SIZE = 64 * 1024
+
+
+def _load_libc():
+    if not hasattr(os, 'uname') or os.uname().sysname != 'Linux':
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+_libc = _load_libc()
+INOTIFY_AVAILABLE = _libc is not None
+
+
+class INotify(object):
+    def __init__(self):
+        if not INOTIFY_AVAILABLE:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._fd = fd
+        # poll, select is limited to descriptors below FD_SETSIZE
+        self._poller = select.poll()
+        self._poller.register(fd, select.POLLIN)
+
+    def fileno(self):
+        return self._fd
+
+    def add_watch(self, path, mask=IN_DIRECTORY_CHANGES):
+        wd = _libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        _libc.inotify_rm_watch(self._fd, wd)
+
+    def read_events(self):
+        # list of (wd, mask, name) available now, without blocking
+        events = []
+        while True:
+            try:
+                data = os.read(self._fd, EVENT_BUFFER_SIZE)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset = offset + EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset = offset + length
+                events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def wait(self, timeout):
+        # block until events are available or timeout, then return them
+        readable = self._poller.poll(None if timeout is None else timeout * 1000)
+        return self.read_events() if readable else []
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
@@ -1,15 +1,35 @@
 #!/usr/bin/env python
 
 # Log Monitor Entry Point
-from multiprocessing import Process, Queue, Value, Manager
+from collections import deque
+from functools import partial
+from multiprocessing import Process, Queue, Value
 import queue
-from datetime import datetime, timedelta
-from collections import OrderedDict
 import getopt
+import json
+import os
+import signal
 import sys
+import tempfile
+import time
 
-from file_watcher import FileWatcher
-from user_interface import MonitorUI
+from alert_rules import load_rules
+from analyzer import Analyzer, FrameCounter
+from async_engine import AsyncEngine, is_pattern
+from baseline import BaselineAlert, MODELS, BASELINE_SIGMAS
+from checkpoint import load_checkpoint, CheckpointWriter
+
+from file_watcher import FileWatcher, AdaptiveSampler, OVERLOAD_BLOCK, OVERLOAD_DROP, \
+    OVERLOAD_SAMPLE, OVERLOAD_POLICIES, DEFAULT_QUEUE_BATCHES
+from health import Health, SamplingProfiler, queue_depth
+from parser import LOG_FORMATS, DEFAULT_LOG_FORMAT
+from ring_buffer import SharedRingBuffer
+from snapshot import SharedSnapshot
+from snapshot_server import SnapshotServer, SnapshotClient
+from time_wheel import SlidingWindows, parse_window, DEFAULT_WINDOWS, DEFAULT_WINDOW_REFRESH, \
+    WHEEL_SPAN
+from replay import replay
+from recorder import Recorder
 
 
 # stat refreshes every 10 seconds, called a "frame"
@@ -18,46 +38,222 @@ REFRESH_INTERVAL = 10
 ALERT_WINDOW = 120
 # wait for maximum 1 second when polling log queue
 LOG_QUEUE_TIMEOUT = 1
+# transports carrying log records from File Watchers to Analyzer
+TRANSPORT_QUEUE = 'queue'
+TRANSPORT_SHARED_MEMORY = 'shm'
+# records are counted in the frame open when they arrive, or in the frame of
+# their log date
+WINDOWING_PROCESSING_TIME = 'processing'
+WINDOWING_EVENT_TIME = 'event'
+# a checkpoint of the log file positions and of the Analyzer state is saved at
+# the end of each frame and when stopping, a monitor started with the same
+# settings resumes from it: log lines written meanwhile are read at full speed.
+# They are counted in the frames of their dates, with processing windowing
+# until the File Watchers have caught up with the clock, see FrameCounter.
+
+# File Watchers run as one process per log file, or as asyncio tasks of the
+# process counting their records. Glob and directory sources, whose files come
+# and go, are watched by the asyncio engine.
+ENGINE_PROCESSES = 'processes'
+ENGINE_ASYNCIO = 'asyncio'
+
+# latest alerts kept in the statistics, for UIs attaching to a running monitor
+SNAPSHOT_ALERTS = 100
 
 
 class Monitor(object):
 
     def __init__(self, filenames, threshold_lps,
                  frame_interval=REFRESH_INTERVAL,
-                 scene_interval=ALERT_WINDOW):
+                 scene_interval=ALERT_WINDOW,
+                 transport=TRANSPORT_QUEUE,
+                 log_format=DEFAULT_LOG_FORMAT, use_inotify=True,
+                 shards=1, heavy_hitters=0, windowing=WINDOWING_PROCESSING_TIME,
+                 record_directory=None, checkpoint_file=None,
+                 ui=True, socket_path=None, engine=ENGINE_PROCESSES,
+                 windows=None, refresh_interval=DEFAULT_WINDOW_REFRESH,
+                 rules_file=None, baseline_model=None, sigmas=BASELINE_SIGMAS,
+                 health_log=None, overload=OVERLOAD_BLOCK, profiler=None):
         self._filenames = filenames
+        self._log_format = log_format
+        self._use_inotify = use_inotify
+        self._engine = engine
         self._processes = list()
-        self._resource_manager = Manager()
-        self._log_q = Queue()
-        self._alert_q = Queue()
+        # one log queue per Analyzer shard
+        if transport == TRANSPORT_SHARED_MEMORY:
+            self._log_qs = [SharedRingBuffer() for _ in range(shards)]
+        else:
+            self._log_qs = [Queue(DEFAULT_QUEUE_BATCHES) for _ in range(shards)]
+        # what File Watchers do when a log queue is full, see OVERLOAD_POLICIES
+        self._overload = overload
+        # File Watchers partition records over the queues of shards
+        self._log_q = self._log_qs[0] if shards == 1 else self._log_qs
+        self._shards = shards
+        # shards send their frames to the merger
+        self._merge_q = Queue() if shards > 1 else None
         self._running = Value('b', 1)
         self._alert_threshold = Value('L', threshold_lps)
         self._frame_interval = frame_interval
         self._scene_interval = scene_interval
-        self._frames_per_scene = int(scene_interval / frame_interval)
-        self._section_hits = self._resource_manager.dict()
-        self._aggregated_statistics = self._resource_manager.dict()
-        self._aggregated_statistics['total_hit_count'] = 0
-        self._aggregated_statistics['lps_frame'] = 0
-        self._ui = MonitorUI(self._aggregated_statistics,
-                             self._alert_q, self._running)
+        # lifetime rankings are exact when 0
+        self._heavy_hitters = heavy_hitters
+        # alert on the deviation from a baseline instead of the lifetime average
+        self._baseline_model = baseline_model
+        self._sigmas = sigmas
+        self._windowing = windowing
+        # counters of the monitor itself, published with each frame and
+        # appended as JSON lines to the health log
+        self._health = Health(len(filenames) if engine == ENGINE_PROCESSES else None, shards)
+        self._health_log = health_log
+        self._health_log_file = None
+        # SamplingProfiler installed by the processes counting and publishing
+        # the records and by File Watchers
+        self._profiler = profiler
+        # frame statistics are recorded on disk by the publishing process
+        self._record_directory = record_directory
+        self._recorder = None
+        # alerts of the sliding windows since the last frame, recorded with
+        # the next frame
+        self._window_alerts = []
+        self._start_time = time.time()
+        # alert rules evaluated on each frame by the publishing process
+        self._rules = None
+        if rules_file:
+            self._rules = load_rules(rules_file, frame_interval)
+        self._checkpoint_file = checkpoint_file
+        self._checkpoint = None
+        if checkpoint_file:
+            if shards > 1:
+                raise ValueError('checkpoints need a single Analyzer shard')
+            self._checkpoint = load_checkpoint(checkpoint_file)
+            if self._checkpoint is not None and \
+                    self._checkpoint['settings'] != self._checkpoint_settings():
+                print(f'ignoring checkpoint {checkpoint_file}: settings changed')
+                self._checkpoint = None
+            rules = self._checkpoint and self._checkpoint.get('rules')
+            if rules is not None and self._rules is not None and \
+                    rules.definitions == self._rules.definitions:
+                # the windows and alerts of the rules go on
+                self._rules = rules
+        # statistics are published once per frame into shared memory,
+        # _statistics is the copy of the publishing process
+        self._aggregated_statistics = SharedSnapshot()
+        self._statistics = dict()
+        self._statistics['total_hit_count'] = 0
+        self._statistics['lps_frame'] = 0
+        self._statistics['alert_count'] = 0
+        self._alerts = deque(maxlen=SNAPSHOT_ALERTS)
+        # a headless monitor has no UI, its statistics can be served to
+        # UIs attaching through a Unix domain socket
+        self._ui = ui
+        self._socket_path = socket_path
+        if engine == ENGINE_ASYNCIO and shards > 1:
+            raise ValueError('the asyncio engine counts records in a single process')
+        if engine != ENGINE_ASYNCIO and any(map(is_pattern, filenames)):
+            raise ValueError('glob and directory sources need the asyncio engine')
+        # rates over sliding windows in seconds, published every refresh interval
+        # between frames
+        self._windows = windows
+        self._refresh_interval = refresh_interval
+        # windows of the rules evaluated on the sliding windows, each refresh
+        self._rule_windows = self._rules.windows if self._rules is not None else []
+        if (windows or self._rule_windows) and shards > 1:
+            raise ValueError('sliding windows need a single Analyzer shard')
+        if windows:
+            if max(windows) > WHEEL_SPAN:
+                raise ValueError(f'sliding windows can not exceed {WHEEL_SPAN}s')
+            self._statistics['refresh_interval'] = refresh_interval
+
+    def _checkpoint_settings(self):
+        # a checkpoint is only resumed by a monitor counting the same way
+        return {
+            'filenames': [os.path.abspath(filename) for filename in self._filenames],
+            'frame_interval': self._frame_interval,
+            'scene_interval': self._scene_interval,
+            'heavy_hitters': self._heavy_hitters,
+            'windowing': self._windowing,
+            'baseline': (self._baseline_model, self._sigmas) if self._baseline_model else None,
+            # sources are file indexes or file paths
+            'engine': self._engine,
+        }
 
     def initialize(self):
-        # watch files
-        for filename in self._filenames:
-            fw = FileWatcher(filename)
-            proc = Process(target=fw.watch, args=(self._log_q, self._running))
+        if self._engine == ENGINE_ASYNCIO:
+            positions = None
+            if self._checkpoint is not None:
+                positions = self._checkpoint['positions']
+            engine = AsyncEngine(self._filenames, self._log_format,
+                                 self._use_inotify, positions, self._health)
+            proc = Process(target=self.aggregate, args=(engine, ))
+            self._processes.append(proc)
+        else:
+            self._initialize_processes()
+        if self._socket_path:
+            server = SnapshotServer(self._socket_path, self._aggregated_statistics)
+            proc = Process(target=server.serve, args=(self._running, ))
+            self._processes.append(proc)
+        # UI, curses is only loaded when there is one
+        if self._ui:
+            from user_interface import MonitorUI
+            ui = MonitorUI(self._aggregated_statistics, self._running)
+            proc = Process(target=ui.run)
+            self._processes.append(proc)
+
+    def _initialize_processes(self):
+        # watch files, watchers send their positions when checkpointing
+        send_positions = self._windowing == WINDOWING_EVENT_TIME or \
+            self._checkpoint_file is not None
+        for source, filename in enumerate(self._filenames):
+            position = None
+            if self._checkpoint is not None:
+                position = self._checkpoint['positions'].get(source)
+            fw = FileWatcher(filename, log_format=self._log_format,
+                             use_inotify=self._use_inotify, position=position)
+            proc = Process(target=self._watch, args=(fw, self._log_q, self._running), kwargs={
+                'source': source if send_positions else None,
+                'send_every_position': self._checkpoint_file is not None,
+                'count_lines': partial(self._health.count_lines, source),
+                'block': self._overload != OVERLOAD_DROP,
+                'sampler': self._sampler()})
             self._processes.append(proc)
         # aggregate statistics
-        proc = Process(target=self.aggregate)
-        self._processes.append(proc)
-        # UI
-        proc = Process(target=self._ui.run)
-        self._processes.append(proc)
+        if self._shards == 1:
+            proc = Process(target=self.aggregate)
+            self._processes.append(proc)
+        else:
+            for shard_index in range(self._shards):
+                proc = Process(target=self.aggregate_shard,
+                               args=(shard_index, ))
+                self._processes.append(proc)
+            proc = Process(target=self.merge)
+            self._processes.append(proc)
+
+    def _watch(self, fw, *args, **kwargs):
+        self._install_profiler()
+        fw.watch(*args, **kwargs)
+
+    def _install_profiler(self):
+        if self._profiler is not None:
+            self._profiler.install()
+
+    def _sampler(self):
+        if self._overload != OVERLOAD_SAMPLE:
+            return None
+        log_q = self._log_qs[0]
+        capacity = log_q.capacity if isinstance(log_q, SharedRingBuffer) else DEFAULT_QUEUE_BATCHES
+        return AdaptiveSampler(self._log_qs, capacity)
 
     def start(self):
-        self._aggregated_statistics['start_time'] = datetime.now()
-        self._aggregated_statistics['next_aggregate_time'] = datetime.now()
+        self._start_time = time.time()
+        if self._checkpoint is not None:
+            # frames stay aligned on the first start
+            self._start_time = self._checkpoint['start_time']
+        self._statistics['start_time'] = self._start_time
+        self._statistics['next_aggregate_time'] = self._start_time + \
+            self._frame_interval
+        self._statistics['lps_scene'] = 0
+        self._statistics['lps_lifetime'] = 0
+        self._aggregated_statistics.publish(self._statistics)
         for process in self._processes:
             process.start()
 
@@ -67,100 +263,334 @@ class Monitor(object):
     def wait_for_finish(self):
         for proc in self._processes:
             proc.join()
+        for log_q in self._log_qs:
+            if isinstance(log_q, SharedRingBuffer):
+                log_q.close()
+                log_q.unlink()
+        self._aggregated_statistics.close()
+        self._aggregated_statistics.unlink()
 
-    def aggregate(self):
-        total_hit_count = 0
-        frame_hit_count = 0
-        frame_heat_map = dict()
-        host_heat_map = dict()
-
-        # circular buffer for hit counter in alert window
-        frames_in_scene_hit_counts = [0 for _ in range(self._frames_per_scene)]
-        frame_index_in_scene = 0
-        start_time = self._aggregated_statistics['start_time']
-        alter_start_time = start_time + timedelta(seconds=self._scene_interval)
-        alert_on = False
-        self._aggregated_statistics['lps_frame'] = 0
-        self._aggregated_statistics['lps_scene'] = 0
-        self._aggregated_statistics['lps_lifetime'] = 0
-
-        next_aggregate_time = datetime.now() + timedelta(seconds=self._frame_interval)
-        self._aggregated_statistics['next_aggregate_time'] = next_aggregate_time
+    def _count_frames(self, log_q, close_frame, checkpoint=None, shard=0):
+        # count log records into frames, see FrameCounter
+        counter = self._frame_counter(close_frame, checkpoint)
+        health = self._health
+        timeout = LOG_QUEUE_TIMEOUT
+        if self._windows or self._rule_windows:
+            timeout = min(timeout, self._refresh_interval)
         while self._running.value == 1:
             try:
-                log_item = self._log_q.get(timeout=LOG_QUEUE_TIMEOUT)
-                frame_hit_count = frame_hit_count + 1
-                hit_count = frame_heat_map.get(log_item.section, 0)
-                frame_heat_map[log_item.section] = hit_count + 1
-                bandwidth_consumed = host_heat_map.get(log_item.remotehost, 0)
-                host_heat_map[log_item.remotehost] = bandwidth_consumed + \
-                    int(log_item.size)
-            except queue.Empty as err:
-                log_item = None
-
-            # aggregate results of frame
-            if datetime.now() > next_aggregate_time:
-                lps = 1.0 * frame_hit_count / self._frame_interval
-                self._aggregated_statistics['lps_frame'] = lps
-                total_hit_count = total_hit_count + frame_hit_count
-
-                time_delta = datetime.now() - start_time
-                total_lps = total_hit_count / time_delta.seconds
-                self._aggregated_statistics['lps_lifetime'] = total_lps
-
-                frames_in_scene_hit_counts[frame_index_in_scene] = frame_hit_count
-                frame_index_in_scene = (
-                    frame_index_in_scene + 1) % self._frames_per_scene
-                if datetime.now() > alter_start_time:
-                    scene_lps = sum(frames_in_scene_hit_counts) * \
-                        1.0 / self._scene_interval
+                item = log_q.get(timeout=timeout)
+                start = time.perf_counter()
+                if isinstance(item, tuple):
+                    counter.set_position(*item)
                 else:
-                    scene_lps = total_lps
-                self._aggregated_statistics['lps_scene'] = scene_lps
-                if scene_lps > total_lps + self._alert_threshold.value:
-                    alert_on = True
-                    alert_msg = 'High traffic generated an alert - hits = {:.2f}, triggered at {}'.format(
-                        scene_lps, datetime.now().strftime('%H:%M:%S'))
-                    self._alert_q.put((alert_on, alert_msg))
-                elif alert_on:
-                    alert_on = False
-                    alert_msg = 'Alert Off - Traffic returned to normal at {}'.format(
-                        datetime.now().strftime('%H:%M:%S'))
-                    self._alert_q.put((alert_on, alert_msg))
-
-                self._aggregated_statistics['heat_map_frame'] = frame_heat_map
-                self._aggregated_statistics['host_heat_map'] = host_heat_map
-                # update total heat map
-                for section, hit in frame_heat_map.items():
-                    hit_count = self._section_hits.get(section, 0) + hit
-                    self._section_hits[section] = hit_count
-
-                # new frame
-                frame_hit_count = 0
-                frame_heat_map = dict()
-                next_aggregate_time = datetime.now() + timedelta(seconds=self._frame_interval)
-                self._aggregated_statistics['next_aggregate_time'] = next_aggregate_time
+                    counter.add_batch(item, weight=getattr(item, 'weight', 1))
+            except queue.Empty as err:
+                start = time.perf_counter()
+            counter.tick(time.time())
+            health.count_busy(time.perf_counter() - start, shard)
+        counter.stop()
+
+    def _frame_counter(self, close_frame, checkpoint=None):
+        state = None
+        if self._checkpoint is not None:
+            state = (self._checkpoint['positions'], self._checkpoint['frames'])
+        # the asyncio engine adds the files it watches
+        sources = range(len(self._filenames)) if self._engine == ENGINE_PROCESSES else ()
+        windows = None
+        if self._windows or self._rule_windows:
+            windows = SlidingWindows(self._windows or [], self._refresh_interval,
+                                     time.time(), self._publish_windows)
+        self._sliding_windows = windows
+        return FrameCounter(self._frame_interval, self._start_time, sources,
+                            self._windowing == WINDOWING_EVENT_TIME,
+                            close_frame, checkpoint, state, windows)
+
+    def _publish_windows(self, rows):
+        # the frame statistics are published again with the new rates, and
+        # the alerts of the rules over sliding windows
+        alerts = None
+        if self._rule_windows:
+            firing = self._rules.firing
+            alerts = self._rules.evaluate_windows(self._sliding_windows, time.time())
+            if alerts:
+                self._statistics['alerts_firing'] = \
+                    self._statistics.get('alerts_firing', 0) + self._rules.firing - firing
+                self._add_alerts(self._statistics, alerts)
+                if self._recorder:
+                    self._window_alerts.extend(alerts)
+        if self._windows:
+            self._statistics['windows'] = rows
+        if self._windows or alerts:
+            self._aggregated_statistics.publish(self._statistics)
+
+    def _add_alerts(self, statistics, alerts):
+        self._alerts.extend(alerts)
+        statistics['alerts'] = list(self._alerts)
+        statistics['alert_count'] = self._statistics['alert_count'] + len(alerts)
+
+    def _publish_frame(self, analyzer, frame_index, frame, now):
+        start = time.perf_counter()
+        statistics, alert = analyzer.close_frame(
+            frame, now, self._alert_threshold.value)
+        statistics['next_aggregate_time'] = analyzer.frame_end_time(
+            frame_index + 1)
+        alerts = [alert] if alert else []
+        if self._rules is not None:
+            alerts.extend(self._rules.evaluate(frame, now))
+            statistics['alerts_firing'] = self._rules.firing + analyzer.alert_on
+        if alerts:
+            self._add_alerts(statistics, alerts)
+        close_time = time.perf_counter() - start
+        self._health.count_frame_close(close_time)
+        if self._engine == ENGINE_ASYNCIO:
+            # frames are closed by the process reading the files
+            self._health.count_busy(close_time)
+        statistics['health'] = self._health_report(now)
+        statistics['dropped_log_count'] = statistics['health']['dropped']
+        self._statistics.update(statistics)
+        self._aggregated_statistics.publish(self._statistics)
+        if self._recorder:
+            self._recorder.record_frame(analyzer.frame_end_time(frame_index),
+                                        self._frame_interval, frame, statistics,
+                                        self._window_alerts + alerts)
+            self._window_alerts = []
+
+    def _health_report(self, now):
+        names = None
+        depth = None
+        if self._engine == ENGINE_PROCESSES:
+            names = dict(enumerate(self._filenames))
+            depth = queue_depth(self._log_qs)
+        report = self._health.report(now, names, depth)
+        if self._health_log_file:
+            self._health_log_file.write(json.dumps(dict(time=now, **report)) + '\n')
+            self._health_log_file.flush()
+        return report
+
+    def _start_health_log(self):
+        if self._health_log:
+            self._health_log_file = open(self._health_log, 'a')
+
+    def _stop_health_log(self):
+        if self._health_log_file:
+            self._health_log_file.close()
+
+    def _start_recorder(self):
+        if self._record_directory:
+            self._recorder = Recorder(self._record_directory)
+
+    def _stop_recorder(self):
+        if self._recorder:
+            self._recorder.close()
+
+    def _save_checkpoint(self, writer, analyzer, positions, frames, final=False):
+        writer.save({
+            'settings': self._checkpoint_settings(),
+            'start_time': self._start_time,
+            'positions': positions,
+            'analyzer': analyzer,
+            'frames': frames,
+            'rules': self._rules,
+        }, wait=final)
+
+    def _analyzer(self):
+        baseline = None
+        if self._baseline_model:
+            baseline = BaselineAlert(self._frame_interval, self._baseline_model, self._sigmas)
+        return Analyzer(self._frame_interval, self._scene_interval, self._start_time,
+                        self._heavy_hitters, baseline)
+
+    def aggregate(self, engine=None):
+        # records come from the log queue, or from the files watched by the
+        # asyncio engine in this process
+        self._install_profiler()
+        analyzer = self._analyzer()
+        if self._checkpoint is not None:
+            analyzer = self._checkpoint['analyzer']
+
+        def close_frame(frame_index, frame, now):
+            self._publish_frame(analyzer, frame_index, frame, now)
+
+        checkpoint = None
+        writer = None
+        if self._checkpoint_file:
+            writer = CheckpointWriter(self._checkpoint_file)
+
+            def checkpoint(positions, frames, final=False):
+                self._save_checkpoint(writer, analyzer, positions, frames, final)
+        self._start_recorder()
+        self._start_health_log()
+        if engine is None:
+            self._count_frames(self._log_q, close_frame, checkpoint)
+        else:
+            engine.run(self._running, self._frame_counter(close_frame, checkpoint))
+        if writer is not None:
+            writer.close()
+        self._stop_recorder()
+        self._stop_health_log()
+
+    def aggregate_shard(self, shard_index):
+        self._install_profiler()
+
+        def close_frame(frame_index, frame, now):
+            self._merge_q.put((frame_index, frame))
+        self._count_frames(self._log_qs[shard_index], close_frame, shard=shard_index)
+        # the merger is stopping too, frames it will not read must not hold
+        # the exit of this process
+        self._merge_q.cancel_join_thread()
+
+    def merge(self):
+        # merge frames of all shards, then close them in order
+        self._install_profiler()
+        analyzer = self._analyzer()
+        # frame index -> [number of shards merged, merged frame]
+        pending_frames = dict()
+        next_frame_index = 0
+        self._start_recorder()
+        self._start_health_log()
+        while self._running.value == 1:
+            try:
+                frame_index, frame = self._merge_q.get(
+                    timeout=LOG_QUEUE_TIMEOUT)
+            except queue.Empty as err:
+                continue
+            pending = pending_frames.get(frame_index)
+            if pending is None:
+                pending_frames[frame_index] = [1, frame]
+            else:
+                pending[0] = pending[0] + 1
+                pending[1].merge(frame)
+            while next_frame_index in pending_frames and \
+                    pending_frames[next_frame_index][0] == self._shards:
+                _, frame = pending_frames.pop(next_frame_index)
+                self._publish_frame(analyzer, next_frame_index,
+                                    frame, time.time())
+                next_frame_index = next_frame_index + 1
+        self._stop_recorder()
+        self._stop_health_log()
 
 
 def usage():
     print('''
     HTTP Log Monitor
     Usage:
-    monitor.py -s access.log [-s other_access.log] [-t 10]
+    monitor.py -s access.log [-s other_access.log] [-t 10] [-f common]
+               [--transport shm] [--overload block] [--poll]
+               [--shards 1] [--heavy-hitters 1000] [--windowing processing]
+               [--record stats_dir] [--checkpoint monitor.ckpt] [--daemon]
+               [--socket monitor.sock] [--engine processes]
+               [--windows 30s,5m,1h [--refresh 1]] [--rules rules.ini]
+               [--baseline holt-winters [--sigmas 3]]
+    monitor.py --attach monitor.sock
+    monitor.py --replay access.log [-o stats.jsonl] [-t 10] [-f common]
+               [--heavy-hitters 1000] [--record stats_dir] [--rules rules.ini]
+               [--baseline holt-winters [--sigmas 3]]
+    monitor.py ... [--health-log health.jsonl] [--profile-dir /tmp]
     -s --source     HTTP access log,
-                    multiple log files can be passed by adding "-s log1 -s log2"
+                    multiple log files can be passed by adding "-s log1 -s log2".
+                    A glob on file names like "/var/log/nginx/*.access.log" or a
+                    directory watches the files matching it, and the files
+                    appearing later, with the asyncio engine.
     -t --threshold  Threshold in Access Per Second to trigger alarm when 2 minute
                     average is above the lifetime average of this threshold. Default is 10.
-    ''')
+    -f --format     Format of access logs: {}. Default is {}.
+    --transport     How log records are sent to Analyzer, "queue" (default) or
+                    "shm" for a ring buffer in shared memory.
+    --overload      When a log queue is full because Analyzer can not keep up,
+                    "block" File Watchers (default), "drop" and count the
+                    records, or "sample" 1 in N lines with N adapting to the
+                    fill of the log queues and to the unread end of the log
+                    files, the counts are scaled back up. Log queues hold up
+                    to {} batches. Does not apply to asyncio.
+                    --drop-when-full is kept as --overload drop.
+    --poll          Poll log files for changes instead of using inotify.
+    --shards        Number of Analyzer processes sharing the log records, their
+                    statistics are merged by another process. Default is 1.
+    --heavy-hitters Rank lifetime hosts and sections with this many counters
+                    in fixed memory, counts are then shown with their maximum
+                    overestimation. Default is 0 for exact counts.
+    --windowing     "processing" (default) counts log records in the frame open
+                    when they are received, "event" in the frame of their log
+                    date, a frame is then closed once all log files have been
+                    read past its end and older records are counted as late.
+    --record        Record the statistics of each frame, and their 1 minute and
+                    1 hour rollups into files of this directory, to be read
+                    with recorder.py.
+    --checkpoint    Save the log file positions and the statistics into this
+                    file at the end of each frame and when stopping, and resume
+                    from it when started again with the same settings.
+                    Needs a single shard.
+    --daemon        Run without UI until interrupted or terminated.
+    --socket        Serve the statistics on this Unix domain socket, to UIs
+                    started with --attach.
+    --engine        "processes" watches each log file from its own process,
+                    "asyncio" watches all log files and counts their records
+                    in a single process. Shards and transport do not apply to
+                    asyncio. Default is asyncio with glob or directory sources,
+                    processes otherwise.
+    --windows       Publish the rates over these sliding windows, up to 1d,
+                    between frames. Needs a single shard.
+    --refresh       Seconds between two publications of the sliding windows,
+                    and evaluations of the traffic rules, can be below 1.
+                    Default is 1, with windows {}.
+    --rules         Raise alerts on the rules of this file too: per section
+                    rates, 5xx ratios, host byte budgets and the traffic over
+                    sliding windows, see alert_rules.py.
+    --baseline      Alert when LPS, bytes or 5xx per second deviate from their
+                    baseline rather than on the threshold, baselines are
+                    forecast by {}, see baseline.py.
+    --sigmas        Deviation raising the baseline alert, in standard
+                    deviations. Default is {}.
+    --health-log    Append the counters of the monitor itself, published in the
+                    Monitor Health box, to this file as a JSON line per frame.
+    --profile-dir   Directory of the CPU profiles written by the aggregating
+                    processes and File Watchers receiving SIGUSR1, see
+                    health.py. Default is {}.
+    --attach        Show the statistics of a monitor started with --socket,
+                    the monitor keeps running when the UI exits.
+    --replay        Analyze an existing log file from its beginning as fast as
+                    possible, frames follow the dates of log lines. Statistics
+                    of each frame and alerts are written as JSON lines.
+    -o --output     File receiving the JSON lines of --replay, default is stdout.
+    '''.format(', '.join(LOG_FORMATS), DEFAULT_LOG_FORMAT, DEFAULT_QUEUE_BATCHES,
+               DEFAULT_WINDOWS, ' or '.join(MODELS), BASELINE_SIGMAS, tempfile.gettempdir()))
 
 
 if __name__ == "__main__":
     log_files = list()
     threshold_aps = 10
+    transport = TRANSPORT_QUEUE
+    overload = OVERLOAD_BLOCK
+    log_format = DEFAULT_LOG_FORMAT
+    use_inotify = True
+    shards = 1
+    heavy_hitters = 0
+    windowing = WINDOWING_PROCESSING_TIME
+    record_directory = None
+    checkpoint_file = None
+    ui = True
+    socket_path = None
+    attach_path = None
+    engine = None
+    windows = None
+    refresh_interval = None
+    rules_file = None
+    baseline_model = None
+    sigmas = BASELINE_SIGMAS
+    replay_file = None
+    output_file = None
+    health_log = None
+    profile_directory = None
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'hs:t:', [
-                                   'help', 'source=', 'threshold='])
+        opts, args = getopt.getopt(sys.argv[1:], 'hs:t:f:o:', [
+                                   'help', 'source=', 'threshold=', 'format=',
+                                   'transport=', 'drop-when-full', 'overload=', 'poll', 'shards=',
+                                   'heavy-hitters=', 'windowing=', 'record=', 'checkpoint=', 'daemon',
+                                   'socket=', 'attach=', 'engine=', 'windows=', 'refresh=',
+                                   'rules=', 'baseline=', 'sigmas=', 'replay=', 'output=',
+                                   'health-log=', 'profile-dir='])
     except getopt.GetoptError as err:
         print(err)
         usage()
@@ -173,9 +603,171 @@ if __name__ == "__main__":
             log_files.append(a)
         elif o in ("-t", "--threshold"):
             threshold_aps = int(a)
+        elif o in ("-f", "--format"):
+            if a not in LOG_FORMATS:
+                print(f'unknown log format {a}')
+                usage()
+                sys.exit(2)
+            log_format = a
+        elif o == "--transport":
+            if a not in (TRANSPORT_QUEUE, TRANSPORT_SHARED_MEMORY):
+                print(f'unknown transport {a}')
+                usage()
+                sys.exit(2)
+            transport = a
+        elif o == "--drop-when-full":
+            overload = OVERLOAD_DROP
+        elif o == "--overload":
+            if a not in OVERLOAD_POLICIES:
+                print(f'unknown overload policy {a}')
+                usage()
+                sys.exit(2)
+            overload = a
+        elif o == "--poll":
+            use_inotify = False
+        elif o == "--shards":
+            shards = int(a)
+            if shards < 1:
+                print('number of shards must be at least 1')
+                usage()
+                sys.exit(2)
+        elif o == "--heavy-hitters":
+            heavy_hitters = int(a)
+            if heavy_hitters < 0:
+                print('number of heavy hitters can not be negative')
+                usage()
+                sys.exit(2)
+        elif o == "--windowing":
+            if a not in (WINDOWING_PROCESSING_TIME, WINDOWING_EVENT_TIME):
+                print(f'unknown windowing {a}')
+                usage()
+                sys.exit(2)
+            windowing = a
+        elif o == "--record":
+            record_directory = a
+        elif o == "--checkpoint":
+            checkpoint_file = a
+        elif o == "--daemon":
+            ui = False
+        elif o == "--socket":
+            socket_path = a
+        elif o == "--attach":
+            attach_path = a
+        elif o == "--engine":
+            if a not in (ENGINE_PROCESSES, ENGINE_ASYNCIO):
+                print(f'unknown engine {a}')
+                usage()
+                sys.exit(2)
+            engine = a
+        elif o == "--windows":
+            try:
+                windows = [parse_window(window) for window in a.split(',')]
+            except ValueError as err:
+                print(f'invalid windows {a}: {err}')
+                usage()
+                sys.exit(2)
+            if max(windows) > WHEEL_SPAN:
+                print(f'sliding windows can not exceed {WHEEL_SPAN}s')
+                usage()
+                sys.exit(2)
+        elif o == "--refresh":
+            refresh_interval = float(a)
+            if refresh_interval <= 0:
+                print('refresh interval must be positive')
+                usage()
+                sys.exit(2)
+        elif o == "--rules":
+            rules_file = a
+        elif o == "--baseline":
+            if a not in MODELS:
+                print(f'unknown baseline {a}')
+                usage()
+                sys.exit(2)
+            baseline_model = a
+        elif o == "--sigmas":
+            sigmas = float(a)
+            if sigmas <= 0:
+                print('sigmas must be positive')
+                usage()
+                sys.exit(2)
+        elif o == "--replay":
+            replay_file = a
+        elif o in ("-o", "--output"):
+            output_file = a
+        elif o == "--health-log":
+            health_log = a
+        elif o == "--profile-dir":
+            if not os.path.isdir(a):
+                print(f'no such directory {a}')
+                usage()
+                sys.exit(2)
+            profile_directory = a
         else:
             assert False, "unhandled option"
-    monitor = Monitor(log_files, threshold_aps)
+    if engine is None:
+        engine = ENGINE_ASYNCIO if any(map(is_pattern, log_files)) else ENGINE_PROCESSES
+    elif engine == ENGINE_PROCESSES and any(map(is_pattern, log_files)):
+        print('glob and directory sources need --engine asyncio')
+        usage()
+        sys.exit(2)
+    if refresh_interval is not None and windows is None:
+        windows = [parse_window(window) for window in DEFAULT_WINDOWS.split(',')]
+    if windows and shards > 1:
+        print('--windows needs a single shard')
+        usage()
+        sys.exit(2)
+    if checkpoint_file and shards > 1:
+        print('--checkpoint needs a single shard')
+        usage()
+        sys.exit(2)
+    if engine == ENGINE_ASYNCIO and shards > 1:
+        print('--engine asyncio needs a single shard')
+        usage()
+        sys.exit(2)
+    if rules_file:
+        try:
+            rules = load_rules(rules_file, REFRESH_INTERVAL)
+        except (OSError, ValueError) as err:
+            print(f'invalid rules {rules_file}: {err}')
+            usage()
+            sys.exit(2)
+        if rules.windows and shards > 1:
+            print('traffic rules need a single shard')
+            usage()
+            sys.exit(2)
+    # the processes doing the work install the profiler, the others ignore
+    # SIGUSR1 rather than being terminated by it
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    profiler = SamplingProfiler(profile_directory)
+    if attach_path:
+        from user_interface import MonitorUI
+        MonitorUI(SnapshotClient(attach_path)).run()
+        sys.exit()
+    if replay_file:
+        # replayed in this process
+        profiler.install()
+        start = time.perf_counter()
+        lines = replay(replay_file, output_file, threshold_aps, REFRESH_INTERVAL,
+                       ALERT_WINDOW, log_format, heavy_hitters, record_directory,
+                       rules_file, baseline_model, sigmas)
+        print(f'replayed {lines} log lines in {time.perf_counter() - start:.1f}s',
+              file=sys.stderr)
+        sys.exit()
+    monitor = Monitor(log_files, threshold_aps,
+                      transport=transport,
+                      log_format=log_format, use_inotify=use_inotify,
+                      shards=shards, heavy_hitters=heavy_hitters,
+                      windowing=windowing, record_directory=record_directory,
+                      checkpoint_file=checkpoint_file, ui=ui,
+                      socket_path=socket_path, engine=engine, windows=windows,
+                      refresh_interval=refresh_interval or DEFAULT_WINDOW_REFRESH,
+                      rules_file=rules_file, baseline_model=baseline_model,
+                      sigmas=sigmas, health_log=health_log, overload=overload,
+                      profiler=profiler)
     monitor.initialize()
+    if not ui:
+        # inherited by all processes, they stop their loops
+        signal.signal(signal.SIGINT, lambda signum, frame: monitor.stop())
+        signal.signal(signal.SIGTERM, lambda signum, frame: monitor.stop())
     monitor.start()
     monitor.wait_for_finish()
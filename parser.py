@@ -1,14 +1,234 @@
 import re
+import json
+import calendar
+from datetime import datetime
+
+from sketches import hash64
 
 # pattern to get [date], "request" and space delimitd string
 PATTERN_LINE_ITEM = '\[.+\]|[^"\s]\S*|".+?"'
 PATTERN_SECTION = '/[^"\s/]+'
 
+MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12,
+}
+# date strings change once per second, cache the ones we have seen recently
+TIMESTAMP_CACHE_SIZE = 4096
+_timestamp_cache = dict()
+
+
+def timestamp_from_date(date):
+    # convert "[12/Dec/2015:18:25:11 +0100]" into seconds since epoch, 0 if invalid
+    # date can be str or bytes
+    timestamp = _timestamp_cache.get(date)
+    if timestamp is not None:
+        return timestamp
+    key = date
+    try:
+        if isinstance(date, bytes):
+            date = date.decode('ascii')
+        day = int(date[1:3])
+        month = MONTHS[date[4:7]]
+        year = int(date[8:12])
+        hour = int(date[13:15])
+        minute = int(date[16:18])
+        second = int(date[19:21])
+        tz_offset = int(date[23:25]) * 3600 + int(date[25:27]) * 60
+        if date[22] == '-':
+            tz_offset = -tz_offset
+        timestamp = float(calendar.timegm(
+            (year, month, day, hour, minute, second)) - tz_offset)
+    except (ValueError, KeyError, IndexError):
+        timestamp = 0.0
+    if len(_timestamp_cache) >= TIMESTAMP_CACHE_SIZE:
+        _timestamp_cache.clear()
+    _timestamp_cache[key] = timestamp
+    return timestamp
+
+# request paths repeat too, their hashes are cached the same way
+PATH_HASH_CACHE_SIZE = 4096
+_path_hash_cache = dict()
+
+
+def path_hash(path):
+    # hash64 of a request path, str or bytes give the same hash
+    key_hash = _path_hash_cache.get(path)
+    if key_hash is not None:
+        return key_hash
+    key_hash = hash64(path)
+    if len(_path_hash_cache) >= PATH_HASH_CACHE_SIZE:
+        _path_hash_cache.clear()
+    _path_hash_cache[path] = key_hash
+    return key_hash
+
+
+def path_from_request(request):
+    # '"GET /pages/create?id=1 HTTP/1.1"' -> "/pages/create?id=1", '' if there is no path
+    fields = request.strip('"').split(' ')
+    return fields[1] if len(fields) > 1 and fields[1].startswith('/') else ''
+
+
+def section_from_path(path):
+    # "/pages/create?id=1" -> "/pages"
+    end = path.find('/', 1)
+    return path[:end] if end > 0 else path
+
+
+# status and size of a record fit the fixed-width records of the shared ring,
+# a line with larger or negative values is not parsed
+MAX_STATUS = 999
+MAX_SIZE = 2 ** 63 - 1
+# digits of a size surely below MAX_SIZE
+MAX_SIZE_DIGITS = 18
+
+
+def to_int(value):
+    # int() accepts both str and bytes, "-" or garbage counts as 0
+    try:
+        return int(value)
+    except (ValueError, TypeError, OverflowError):
+        return 0
+
+
+# Log formats turn one line into a record
+# (section, remotehost, size, status, timestamp, path hash), or None when the
+# line can not be parsed. With binary=True lines are bytes and only the
+# extracted fields are decoded.
+LOG_FORMATS = dict()
+
+
+def register_log_format(format_class):
+    LOG_FORMATS[format_class.name] = format_class
+    return format_class
+
+
+@register_log_format
+class CommonLogFormat(object):
+    name = 'common'
+    # anchored at the beginning of line and stopping after the size field,
+    # the path and its section are captured from the request in the same pass
+    # status and size are captured only when they are numbers
+    PATTERN = r'(\S+) \S+ \S+ (\[[^\]]+\]) "(?:\S+ ((/[^"\s/]*)[^"\s]*))?[^"]*" (?:(\d+)|\S+) (?:(\d+)|\S+)'
+
+    def __init__(self, binary=False):
+        pattern = self.PATTERN.encode('ascii') if binary else self.PATTERN
+        self._match = re.compile(pattern).match
+        self.parse = self._parse_bytes if binary else self._parse_text
+
+    def _parse_text(self, line):
+        match = self._match(line)
+        if match is None:
+            return None
+        remotehost, date, path, section, status, size = match.groups()
+        if status and len(status) > 3 or size and len(size) > MAX_SIZE_DIGITS:
+            return None
+        timestamp = _timestamp_cache.get(date)
+        if timestamp is None:
+            timestamp = timestamp_from_date(date)
+        path = path or ''
+        key_hash = _path_hash_cache.get(path)
+        if key_hash is None:
+            key_hash = path_hash(path)
+        return (section or '', remotehost, int(size) if size else 0,
+                int(status) if status else 0, timestamp, key_hash)
+
+    def _parse_bytes(self, line):
+        match = self._match(line)
+        if match is None:
+            return None
+        remotehost, date, path, section, status, size = match.groups()
+        if status and len(status) > 3 or size and len(size) > MAX_SIZE_DIGITS:
+            return None
+        timestamp = _timestamp_cache.get(date)
+        if timestamp is None:
+            timestamp = timestamp_from_date(date)
+        path = path or b''
+        key_hash = _path_hash_cache.get(path)
+        if key_hash is None:
+            key_hash = path_hash(path)
+        try:
+            remotehost = remotehost.decode()
+            section = section.decode() if section else ''
+        except UnicodeDecodeError:
+            remotehost = remotehost.decode('utf-8', 'replace') \
+                if isinstance(remotehost, bytes) else remotehost
+            section = section.decode('utf-8', 'replace') if section else ''
+        return (section, remotehost, int(size) if size else 0,
+                int(status) if status else 0, timestamp, key_hash)
+
+
+@register_log_format
+class CombinedLogFormat(CommonLogFormat):
+    # referer and user agent follow the size field, they are never read
+    name = 'combined'
+
+
+@register_log_format
+class JsonLogFormat(object):
+    # one JSON object per line, field names default to nginx variable names
+    name = 'json'
+
+    def __init__(self, binary=False, remotehost_field='remote_addr',
+                 request_field='request', status_field='status',
+                 size_field='body_bytes_sent', date_field='time_local'):
+        self._remotehost_field = remotehost_field
+        self._request_field = request_field
+        self._status_field = status_field
+        self._size_field = size_field
+        self._date_field = date_field
+
+    @staticmethod
+    def timestamp(date):
+        # seconds since epoch, common log format date or ISO 8601
+        if isinstance(date, (int, float)):
+            return float(date)
+        if not date or not isinstance(date, str):
+            return 0.0
+        if date[0] != '[' and '/' in date[:6]:
+            return timestamp_from_date('[' + date + ']')
+        if date[0] == '[':
+            return timestamp_from_date(date)
+        try:
+            return datetime.fromisoformat(date).timestamp()
+        except ValueError:
+            return 0.0
+
+    def parse(self, line):
+        try:
+            item = json.loads(line)
+            request = item[self._request_field]
+            remotehost = item.get(self._remotehost_field, '')
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+        # valid JSON with fields of other types is not a log record
+        if not isinstance(request, str) or not isinstance(remotehost, str):
+            return None
+        size = to_int(item.get(self._size_field, 0))
+        status = to_int(item.get(self._status_field, 0))
+        if not (0 <= size <= MAX_SIZE and 0 <= status <= MAX_STATUS):
+            return None
+        path = path_from_request(request)
+        return (section_from_path(path) if path else '',
+                remotehost, size, status,
+                self.timestamp(item.get(self._date_field)),
+                path_hash(path))
+
+
+DEFAULT_LOG_FORMAT = CommonLogFormat.name
+
 
 class LogParser(object):
-    def __init__(self, pattern_item=PATTERN_LINE_ITEM, pattern_section=PATTERN_SECTION):
+    def __init__(self, pattern_item=PATTERN_LINE_ITEM, pattern_section=PATTERN_SECTION,
+                 log_format=DEFAULT_LOG_FORMAT, binary=False):
         self._pattern_item = re.compile(pattern_item)
         self._pattern_section = re.compile(pattern_section)
+        self._log_format = LOG_FORMATS[log_format](binary=binary)
+        self.parse_record = self._log_format.parse
+
+    def parse_records(self, lines):
+        # records of the lines which could be parsed
+        return [record for record in map(self.parse_record, lines) if record is not None]
 
     def parse_line(self, line):
         # fields are defined as https://www.w3.org/Daemon/User/Config/Logging.html#common-logfile-format
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+import bisect
+import datetime
+import getopt
+import json
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+
+from sketches import make_counter
+
+# Frame statistics kept on disk, in append only files of fixed-width records:
+#   <directory>/<YYYY-MM-DD>.<resolution>
+# with one file per UTC day for each resolution: frames as closed by Analyzer,
+# and 1 minute and 1 hour rollups of the frames. Records are appended in time
+# order, so the record starting a time range is found by bisection over the
+# record index, the offset of record i being HEADER_SIZE + i * RECORD_SIZE.
+
+RESOLUTION_FRAMES = 'frames'
+RESOLUTION_MINUTES = 'minutes'
+RESOLUTION_HOURS = 'hours'
+ROLLUP_INTERVALS = {
+    RESOLUTION_MINUTES: 60,
+    RESOLUTION_HOURS: 3600,
+}
+RESOLUTIONS = (RESOLUTION_FRAMES, RESOLUTION_MINUTES, RESOLUTION_HOURS)
+
+MAGIC = b'HLMREC01'
+# magic, record size
+HEADER = struct.Struct('<8sQ')
+HEADER_SIZE = HEADER.size
+
+TOP_COUNT = 5
+SECTION_SIZE = 32  # bytes, longer sections are truncated
+HOST_SIZE = 48  # bytes, long enough for IPv6 addresses
+# start time, interval, hit count, bytes, lps scene, lps lifetime, alert flags,
+# then TOP_COUNT (section, hits) and TOP_COUNT (host, bytes)
+RECORD = struct.Struct('<dfQQffB3x' + f'{SECTION_SIZE}sQ' * TOP_COUNT +
+                       f'{HOST_SIZE}sQ' * TOP_COUNT)
+RECORD_SIZE = RECORD.size
+TIME = struct.Struct('<d')
+
+# alert flags: an alert, of the high traffic or of a rule, went on, went off
+# during the interval
+ALERT_ON = 1
+ALERT_OFF = 2
+
+# counters of a rollup keep the heaviest sections and hosts only
+ROLLUP_HEAVY_HITTERS = 1000
+
+
+def utc_date(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).date()
+
+
+def day_of(timestamp):
+    return utc_date(timestamp).isoformat()
+
+
+def record_path(directory, resolution, day):
+    return os.path.join(directory, f'{day}.{resolution}')
+
+
+def encode_name(name, size):
+    # truncated to size bytes, the end of a cut character is dropped when decoding
+    return name.encode('utf-8', 'replace')[:size]
+
+
+def decode_name(name):
+    return name.rstrip(b'\0').decode('utf-8', 'ignore')
+
+
+class Rollup(object):
+    '''
+    Statistics of the frames starting during one rollup interval.
+    '''
+
+    def __init__(self, start_time, interval):
+        self.start_time = start_time
+        self.interval = interval
+        self.hit_count = 0
+        self.bytes = 0
+        # the highest over the interval, and the last one
+        self.lps_scene = 0
+        self.lps_lifetime = 0
+        self.alert = 0
+        self.section_hits = make_counter(ROLLUP_HEAVY_HITTERS)
+        self.host_bytes = make_counter(ROLLUP_HEAVY_HITTERS)
+
+    def add(self, frame_record):
+        self.hit_count = self.hit_count + frame_record['hit_count']
+        self.bytes = self.bytes + frame_record['bytes']
+        self.lps_scene = max(self.lps_scene, frame_record['lps_scene'])
+        self.lps_lifetime = frame_record['lps_lifetime']
+        self.alert = self.alert | frame_record['alert']
+        self.section_hits.update(frame_record['section_hits'])
+        self.host_bytes.update(frame_record['host_bytes'])
+
+    def record(self):
+        return {
+            'start_time': self.start_time,
+            'interval': self.interval,
+            'hit_count': self.hit_count,
+            'bytes': self.bytes,
+            'lps_scene': self.lps_scene,
+            'lps_lifetime': self.lps_lifetime,
+            'alert': self.alert,
+            'top_sections': [(section, hits) for section, hits, _ in
+                             self.section_hits.top(TOP_COUNT)],
+            'top_hosts': [(host, size) for host, size, _ in
+                          self.host_bytes.top(TOP_COUNT)],
+        }
+
+
+def pack_record(record):
+    fields = [record['start_time'], record['interval'], record['hit_count'],
+              record['bytes'], record['lps_scene'], record['lps_lifetime'],
+              record['alert']]
+    top_sections = list(record['top_sections'])[:TOP_COUNT]
+    top_sections += [('', 0)] * (TOP_COUNT - len(top_sections))
+    for section, hits in top_sections:
+        fields += (encode_name(section, SECTION_SIZE), hits)
+    top_hosts = list(record['top_hosts'])[:TOP_COUNT]
+    top_hosts += [('', 0)] * (TOP_COUNT - len(top_hosts))
+    for host, size in top_hosts:
+        fields += (encode_name(host, HOST_SIZE), size)
+    return RECORD.pack(*fields)
+
+
+def unpack_record(data):
+    fields = RECORD.unpack(data)
+    start_time, interval, hit_count, size, lps_scene, lps_lifetime, alert = fields[:7]
+    tops = fields[7:]
+    sections = tops[:2 * TOP_COUNT]
+    hosts = tops[2 * TOP_COUNT:]
+    return {
+        'start_time': start_time,
+        'interval': interval,
+        'hit_count': hit_count,
+        'lps': hit_count / interval if interval else 0,
+        'bytes': size,
+        'lps_scene': lps_scene,
+        'lps_lifetime': lps_lifetime,
+        'alert': alert,
+        'top_sections': [(decode_name(sections[i]), sections[i + 1])
+                         for i in range(0, len(sections), 2) if sections[i + 1]],
+        'top_hosts': [(decode_name(hosts[i]), hosts[i + 1])
+                      for i in range(0, len(hosts), 2) if hosts[i + 1]],
+    }
+
+
+class Recorder(object):
+    '''
+    Appends frame statistics and their rollups to the files of a directory.
+    record_frame() only queues the frame, files are written by a thread so that
+    disk writes never hold the aggregation loop.
+    '''
+
+    def __init__(self, directory):
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._queue = queue.Queue()
+        # resolution -> (day, file)
+        self._files = dict()
+        # resolution -> Rollup in progress
+        self._rollups = dict()
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def record_frame(self, end_time, interval, frame, statistics, alerts=()):
+        # frame is not modified anymore once it is closed, it is used as is,
+        # alerts are the (alert_on, alert_msg) of all the alerts going on or
+        # off during the frame
+        self._queue.put((end_time, interval, frame, statistics, alerts))
+
+    def close(self):
+        # write what is queued and the rollups in progress
+        self._queue.put(None)
+        self._thread.join()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._write_frame(*item)
+            if self._queue.empty():
+                self._flush()
+        for resolution, rollup in self._rollups.items():
+            self._append(resolution, rollup.record())
+        self._rollups.clear()
+        self._flush()
+        for _, record_file in self._files.values():
+            record_file.close()
+        self._files.clear()
+
+    def _write_frame(self, end_time, interval, frame, statistics, alerts):
+        alert_flags = 0
+        for alert_on, _ in alerts:
+            alert_flags = alert_flags | (ALERT_ON if alert_on else ALERT_OFF)
+        frame_record = {
+            'start_time': end_time - interval,
+            'interval': interval,
+            'hit_count': frame.hit_count,
+            'bytes': sum(frame.host_bytes.values()),
+            'lps_scene': statistics.get('lps_scene', 0),
+            'lps_lifetime': statistics.get('lps_lifetime', 0),
+            'alert': alert_flags,
+            'section_hits': frame.section_hits,
+            'host_bytes': frame.host_bytes,
+        }
+        frame_record['top_sections'] = sorted(
+            frame.section_hits.items(), key=lambda item: item[1], reverse=True)[:TOP_COUNT]
+        frame_record['top_hosts'] = sorted(
+            frame.host_bytes.items(), key=lambda item: item[1], reverse=True)[:TOP_COUNT]
+        self._append(RESOLUTION_FRAMES, frame_record)
+
+        for resolution, rollup_interval in ROLLUP_INTERVALS.items():
+            start_time = frame_record['start_time'] // rollup_interval * rollup_interval
+            rollup = self._rollups.get(resolution)
+            if rollup is not None and rollup.start_time != start_time:
+                self._append(resolution, rollup.record())
+                rollup = None
+            if rollup is None:
+                rollup = Rollup(start_time, rollup_interval)
+                self._rollups[resolution] = rollup
+            rollup.add(frame_record)
+
+    def _append(self, resolution, record):
+        day = day_of(record['start_time'])
+        day_file = self._files.get(resolution)
+        if day_file is None or day_file[0] != day:
+            if day_file is not None:
+                day_file[1].close()
+            record_file = open(record_path(self._directory, resolution, day), 'ab')
+            if record_file.tell() == 0:
+                record_file.write(HEADER.pack(MAGIC, RECORD_SIZE))
+            day_file = (day, record_file)
+            self._files[resolution] = day_file
+        day_file[1].write(pack_record(record))
+
+    def _flush(self):
+        for _, record_file in self._files.values():
+            record_file.flush()
+
+
+class RecordStartTimes(object):
+    # start times of the records of a file as a sequence, for bisect
+    def __init__(self, fileno, count):
+        self._fileno = fileno
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        return TIME.unpack(os.pread(self._fileno, TIME.size,
+                                    HEADER_SIZE + index * RECORD_SIZE))[0]
+
+
+def read_records(directory, start_time, end_time, resolution=RESOLUTION_FRAMES):
+    # records starting from start_time until before end_time, in time order
+    day = utc_date(start_time)
+    last_day = utc_date(end_time)
+    while day <= last_day:
+        path = record_path(directory, resolution, day.isoformat())
+        day = day + datetime.timedelta(days=1)
+        if not os.path.exists(path):
+            continue
+        with open(path, 'rb') as record_file:
+            magic, record_size = HEADER.unpack(record_file.read(HEADER_SIZE))
+            if magic != MAGIC or record_size != RECORD_SIZE:
+                raise ValueError(f'{path} is not a record file of this version')
+            # a record being written by the recorder is not complete yet
+            count = (os.fstat(record_file.fileno()).st_size - HEADER_SIZE) // RECORD_SIZE
+            index = bisect.bisect_left(
+                RecordStartTimes(record_file.fileno(), count), start_time)
+            record_file.seek(HEADER_SIZE + index * RECORD_SIZE)
+            while index < count:
+                record = unpack_record(record_file.read(RECORD_SIZE))
+                if record['start_time'] >= end_time:
+                    return
+                yield record
+                index = index + 1
+
+
+def parse_time(value):
+    # seconds since epoch, or local date and time like "2019-11-05 01:44"
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def usage():
+    print('''
+    Read statistics recorded by monitor.py --record, as JSON lines
+    recorder.py -d stats_dir [-r frames] [--from "2019-11-05 01:00"] [--to "2019-11-05 02:00"]
+    -d --directory   directory of the records
+    -r --resolution  {}. Default is frames.
+    --from           start of the time range, local time or seconds since epoch.
+                     Default is one hour ago.
+    --to             end of the time range. Default is now.
+    '''.format(', '.join(RESOLUTIONS)))
+
+
+if __name__ == "__main__":
+    directory = None
+    resolution = RESOLUTION_FRAMES
+    end_time = time.time()
+    start_time = end_time - 3600
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hd:r:', [
+                                   'help', 'directory=', 'resolution=', 'from=', 'to='])
+    except getopt.GetoptError as err:
+        print(err)
+        usage()
+        sys.exit(2)
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif o in ("-d", "--directory"):
+            directory = a
+        elif o in ("-r", "--resolution"):
+            if a not in RESOLUTIONS:
+                print(f'unknown resolution {a}')
+                usage()
+                sys.exit(2)
+            resolution = a
+        elif o == "--from":
+            start_time = parse_time(a)
+        elif o == "--to":
+            end_time = parse_time(a)
+        else:
+            assert False, "unhandled option"
+    if directory is None:
+        usage()
+        sys.exit(2)
+    for record in read_records(directory, start_time, end_time, resolution):
+        print(json.dumps(record))
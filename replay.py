@@ -0,0 +1,193 @@
+import json
+import math
+import sys
+import time
+from operator import itemgetter
+
+from alert_rules import load_rules
+from analyzer import Analyzer, FrameStats
+from baseline import BaselineAlert, BASELINE_SIGMAS
+from file_watcher import FileWatcher, WATERMARK_DELAY
+from parser import LogParser, DEFAULT_LOG_FORMAT
+from recorder import Recorder
+from time_wheel import SlidingWindows, DEFAULT_WINDOW_REFRESH
+
+# Offline analysis of an existing log file: the file is read from its beginning
+# as fast as possible and frames are driven by the timestamps of the log lines
+# instead of the clock. Log lines are expected in time order, a line older than
+# the current frame is counted in the current frame. A line dated after the
+# clock, like a typo of the year, is counted as late rather than closing the
+# frames up to its date. Traffic rules are evaluated
+# every second of log dates, on a time wheel counting the records by their dates.
+#
+# Statistics of each frame and alerts are written as JSON lines:
+#   {"type": "frame", "frame_end_time": ..., <statistics>}
+#   {"type": "alert", "time": ..., "alert_on": ..., "message": ...}
+
+
+class Replay(object):
+    def __init__(self, filename, output, threshold_lps, frame_interval, scene_interval,
+                 log_format=DEFAULT_LOG_FORMAT, heavy_hitters=0, recorder=None,
+                 rules=None, baseline_model=None, sigmas=BASELINE_SIGMAS):
+        self._filename = filename
+        self._output = output
+        self._threshold_lps = threshold_lps
+        self._frame_interval = frame_interval
+        self._scene_interval = scene_interval
+        self._log_format = log_format
+        self._heavy_hitters = heavy_hitters
+        # frames are also recorded when a Recorder is given
+        self._recorder = recorder
+        # RuleEngine raising alerts beyond the high traffic alert
+        self._rules = rules
+        # alert on the deviation from a baseline, see Analyzer
+        self._baseline_model = baseline_model
+        self._sigmas = sigmas
+        self._analyzer = None
+        # time wheel of the traffic rules
+        self._windows = None
+        self._next_window_time = None
+        self._frame = None
+        self._frame_index = 0
+        self._frame_end_time = None
+        # alerts written since the start of the frame, recorded with it
+        self._frame_alerts = []
+        self.record_count = 0
+        self.frame_count = 0
+        self.alert_count = 0
+
+    def run(self):
+        fw = FileWatcher(self._filename, log_format=self._log_format,
+                         use_inotify=False, from_beginning=True)
+        parser = LogParser(log_format=self._log_format, binary=True)
+        # a chunk of an overlong line gives no lines, the file is read until
+        # nothing is left
+        lines = fw.read_lines()
+        while lines or fw.backlog():
+            self._count(parser.parse_records(lines))
+            lines = fw.read_lines()
+        self._count(parser.parse_records(fw.read_last_line()))
+        if self._frame is not None:
+            self._close_frame()
+        self._output.flush()
+        return self.record_count
+
+    def _start(self, timestamp):
+        # frames are aligned on multiples of the frame interval
+        start_time = math.floor(timestamp / self._frame_interval) * self._frame_interval
+        baseline = None
+        if self._baseline_model:
+            baseline = BaselineAlert(self._frame_interval, self._baseline_model, self._sigmas)
+        self._analyzer = Analyzer(self._frame_interval, self._scene_interval,
+                                  start_time, self._heavy_hitters, baseline)
+        self._frame = FrameStats()
+        self._frame_end_time = self._analyzer.frame_end_time(0)
+        if self._rules is not None and self._rules.windows:
+            self._windows = SlidingWindows([], DEFAULT_WINDOW_REFRESH, start_time, None)
+            self._next_window_time = start_time + DEFAULT_WINDOW_REFRESH
+
+    def _count(self, records):
+        if not records:
+            return
+        future_count = 0
+        limit = time.time() + WATERMARK_DELAY
+        if max(map(itemgetter(4), records)) > limit:
+            count = len(records)
+            records = [record for record in records if record[4] <= limit]
+            future_count = count - len(records)
+        if self._analyzer is None:
+            # lines before the first valid date can not be placed in time
+            first_timestamp = next((record[4] for record in records if record[4]), None)
+            if first_timestamp is None:
+                return
+            self._start(first_timestamp)
+        self._frame.late_count = self._frame.late_count + future_count
+        if not records:
+            return
+        self.record_count = self.record_count + len(records)
+        start = 0
+        while records[-1][4] >= self._frame_end_time:
+            # records from start to end belong to the current frame
+            end = start
+            frame_end_time = self._frame_end_time
+            while records[end][4] < frame_end_time:
+                end = end + 1
+            self._add(records[start:end])
+            frame_index = self._analyzer.frame_index(records[end][4])
+            while self._frame_index < frame_index:
+                self._close_frame()
+            start = end
+        self._add(records[start:] if start else records)
+
+    def _add(self, records):
+        self._frame.add_batch(records)
+        windows = self._windows
+        if windows is None or not records:
+            return
+        start = 0
+        while records[-1][4] >= self._next_window_time:
+            # records from start to end are before the next evaluation
+            now = self._next_window_time
+            end = start
+            while records[end][4] < now:
+                end = end + 1
+            if end > start:
+                windows.add_batch(records[start:end], records[end - 1][4])
+            self._write_alerts(self._rules.evaluate_windows(windows, now), now)
+            self._next_window_time = now + DEFAULT_WINDOW_REFRESH
+            start = end
+        if start < len(records):
+            windows.add_batch(records[start:], records[-1][4])
+
+    def _close_frame(self):
+        now = self._frame_end_time
+        statistics, alert = self._analyzer.close_frame(
+            self._frame, now, self._threshold_lps)
+        statistics['type'] = 'frame'
+        statistics['frame_end_time'] = now
+        self._write(statistics)
+        self.frame_count = self.frame_count + 1
+        alerts = [alert] if alert else []
+        if self._rules is not None:
+            alerts.extend(self._rules.evaluate(self._frame, now))
+            if self._windows is not None:
+                alerts.extend(self._rules.evaluate_windows(self._windows, now))
+        self._write_alerts(alerts, now)
+        if self._recorder:
+            self._recorder.record_frame(now, self._frame_interval,
+                                        self._frame, statistics, self._frame_alerts)
+        self._frame_alerts = []
+        self._frame_index = self._frame_index + 1
+        self._frame = FrameStats()
+        self._frame_end_time = self._analyzer.frame_end_time(self._frame_index)
+
+    def _write_alerts(self, alerts, now):
+        for alert_on, alert_msg in alerts:
+            self._write({'type': 'alert', 'time': now,
+                         'alert_on': alert_on, 'message': alert_msg})
+            self.alert_count = self.alert_count + 1
+        self._frame_alerts.extend(alerts)
+
+    def _write(self, item):
+        self._output.write(json.dumps(item))
+        self._output.write('\n')
+
+
+def replay(filename, output_filename, threshold_lps, frame_interval, scene_interval,
+           log_format=DEFAULT_LOG_FORMAT, heavy_hitters=0, record_directory=None,
+           rules_file=None, baseline_model=None, sigmas=BASELINE_SIGMAS):
+    # write to stdout when output_filename is None
+    rules = load_rules(rules_file, frame_interval) if rules_file else None
+    recorder = Recorder(record_directory) if record_directory else None
+    try:
+        if output_filename is None:
+            return Replay(filename, sys.stdout, threshold_lps, frame_interval,
+                          scene_interval, log_format, heavy_hitters, recorder,
+                          rules, baseline_model, sigmas).run()
+        with open(output_filename, 'w') as output:
+            return Replay(filename, output, threshold_lps, frame_interval,
+                          scene_interval, log_format, heavy_hitters, recorder,
+                          rules, baseline_model, sigmas).run()
+    finally:
+        if recorder:
+            recorder.close()
@@ -0,0 +1,273 @@
+import os
+import queue
+import struct
+import time
+from multiprocessing import Lock, shared_memory
+
+from file_watcher import WeightedBatch
+
+# A multi-producer single-consumer ring of fixed-width records in shared memory.
+# It can replace the multiprocessing.Queue between File Watchers and Analyzer:
+# put() takes a batch of (section, remotehost, size, status, timestamp, path hash) records
+# and get() returns one batch in the same format. A watermark
+# (source, timestamp, inode, offset) is put and got the same way, in a single record.
+#
+# Each put() writes, under a single lock, one batch header followed by the
+# records of the batch. Section and host strings are interned per producer
+# process, a name record carrying the string bytes in the following slots is
+# written the first time a producer sends a string. The consumer does not
+# take the lock, it reads records in place and then moves the tail forward.
+# A producer forgets its strings once it has sent name_table_size of a kind,
+# ids start again from 0 and strings are sent again: the consumer tables of
+# a producer, indexed by id, are bounded too, however many hosts are seen.
+
+DEFAULT_RING_CAPACITY = 65536  # number of record slots
+RING_GET_MAX_SLEEP = 0.01
+DEFAULT_NAME_TABLE_SIZE = 65536  # strings of each kind known per producer
+
+# head and tail are ever-increasing slot counters, slot index is counter % capacity
+HEADER = struct.Struct('<QQ')
+HEADER_SIZE = 64
+# kind, status, section id, host id, producer, size, timestamp, path hash
+RECORD = struct.Struct('<BxHIIIQdQ')
+RECORD_FIELDS = 8
+RECORD_SIZE = RECORD.size
+
+KIND_LOG = 0
+# producer = pid, size = number of slots following the header, section id =
+# weight of sampled records, 0 when not sampled
+KIND_BATCH = 1
+KIND_SECTION_NAME = 2  # section id = string id, size = length of the string
+KIND_HOST_NAME = 3  # host id = string id, size = length of the string
+# not in a batch: section id = source, timestamp = watermark, path hash = inode,
+# size = offset
+KIND_WATERMARK = 4
+
+
+_batch_structs = dict()
+
+
+def batch_struct(count):
+    # struct packing count records at once, much faster than one pack per record
+    batch = _batch_structs.get(count)
+    if batch is None:
+        batch = struct.Struct('<' + RECORD.format[1:] * count)
+        _batch_structs[count] = batch
+    return batch
+
+
+def name_slots(name_length):
+    return (name_length + RECORD_SIZE - 1) // RECORD_SIZE
+
+
+class SharedRingBuffer(object):
+    def __init__(self, capacity=DEFAULT_RING_CAPACITY, name_table_size=DEFAULT_NAME_TABLE_SIZE):
+        self._capacity = capacity
+        self._name_table_size = name_table_size
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=HEADER_SIZE + capacity * RECORD_SIZE)
+        HEADER.pack_into(self._shm.buf, 0, 0, 0)
+        self._lock = Lock()
+        # producer side string tables, only valid in the process owning them
+        self._pid = None
+        self._section_ids = dict()
+        self._host_ids = dict()
+        # consumer side string tables, by producer pid
+        self._sections = dict()
+        self._hosts = dict()
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def qsize(self):
+        head, tail = HEADER.unpack_from(self._shm.buf, 0)
+        return head - tail
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def close(self):
+        self._shm.close()
+
+    def unlink(self):
+        self._shm.unlink()
+
+    @staticmethod
+    def _intern(table, values, kind, names):
+        # (ids of values, new strings by id), strings not in table yet are given
+        # the next ids and appended to names
+        ids = list(map(table.get, values))
+        new = dict()
+        if None in ids:
+            for index, name_id in enumerate(ids):
+                if name_id is None:
+                    value = values[index]
+                    name_id = new.get(value)
+                    if name_id is None:
+                        name_id = len(table) + len(new)
+                        new[value] = name_id
+                        names.append((kind, name_id, value.encode('utf-8', 'replace')))
+                    ids[index] = name_id
+        return ids, new
+
+    def _encode(self, batch):
+        pid = os.getpid()
+        if pid != self._pid:
+            # tables inherited from parent process belong to another producer
+            self._pid = pid
+            self._section_ids = dict()
+            self._host_ids = dict()
+        if len(self._section_ids) + len(batch) > self._name_table_size:
+            self._section_ids.clear()
+        if len(self._host_ids) + len(batch) > self._name_table_size:
+            self._host_ids.clear()
+        names = []
+        sections, hosts, sizes, statuses, timestamps, path_hashes = zip(*batch)
+        section_ids, new_sections = self._intern(
+            self._section_ids, sections, KIND_SECTION_NAME, names)
+        host_ids, new_hosts = self._intern(self._host_ids, hosts, KIND_HOST_NAME, names)
+        # fields of the records interleaved by slice, much faster than per record
+        logs = [pid] * (len(batch) * RECORD_FIELDS)
+        logs[0::RECORD_FIELDS] = [KIND_LOG] * len(batch)
+        logs[1::RECORD_FIELDS] = statuses
+        logs[2::RECORD_FIELDS] = section_ids
+        logs[3::RECORD_FIELDS] = host_ids
+        logs[5::RECORD_FIELDS] = sizes
+        logs[6::RECORD_FIELDS] = timestamps
+        logs[7::RECORD_FIELDS] = path_hashes
+
+        log_count = len(logs) // RECORD_FIELDS
+        slot_count = log_count + sum(1 + name_slots(len(name))
+                                     for _, _, name in names)
+        payload = bytearray((1 + slot_count) * RECORD_SIZE)
+        RECORD.pack_into(payload, 0, KIND_BATCH, 0, getattr(batch, 'weight', 0), 0, pid,
+                         slot_count, 0, 0)
+        offset = RECORD_SIZE
+        for kind, name_id, name in names:
+            if kind == KIND_SECTION_NAME:
+                RECORD.pack_into(payload, offset, kind, 0,
+                                 name_id, 0, pid, len(name), 0, 0)
+            else:
+                RECORD.pack_into(payload, offset, kind, 0,
+                                 0, name_id, pid, len(name), 0, 0)
+            offset = offset + RECORD_SIZE
+            payload[offset:offset + len(name)] = name
+            offset = offset + name_slots(len(name)) * RECORD_SIZE
+        batch_struct(log_count).pack_into(payload, offset, *logs)
+        return payload, new_sections, new_hosts
+
+    def put(self, batch, block=True, timeout=None):
+        # like multiprocessing.Queue.put, raises queue.Full when the ring has
+        # no room after timeout, File Watchers put with a timeout so that
+        # they notice the monitor stopping
+        if not batch:
+            return
+        if isinstance(batch, tuple):
+            source, watermark, inode, offset = batch
+            payload = RECORD.pack(KIND_WATERMARK, 0, source, 0,
+                                  os.getpid(), offset, watermark, inode)
+            new_sections = new_hosts = dict()
+        else:
+            payload, new_sections, new_hosts = self._encode(batch)
+        slots = len(payload) // RECORD_SIZE
+        if slots > self._capacity:
+            raise ValueError(
+                f'batch of {slots} slots exceeds ring capacity {self._capacity}')
+        buf = self._shm.buf
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._lock.acquire()
+        try:
+            head, tail = HEADER.unpack_from(buf, 0)
+            while self._capacity - (head - tail) < slots:
+                if not block or (deadline is not None and time.monotonic() > deadline):
+                    raise queue.Full
+                self._lock.release()
+                time.sleep(0.001)
+                self._lock.acquire()
+                head, tail = HEADER.unpack_from(buf, 0)
+            start = HEADER_SIZE + (head % self._capacity) * RECORD_SIZE
+            end = start + len(payload)
+            ring_end = HEADER_SIZE + self._capacity * RECORD_SIZE
+            if end <= ring_end:
+                buf[start:end] = payload
+            else:
+                first = ring_end - start
+                buf[start:ring_end] = payload[:first]
+                buf[HEADER_SIZE:HEADER_SIZE + len(payload) - first] = payload[first:]
+            # publish the batch only once it has been written
+            struct.pack_into('<Q', buf, 0, head + slots)
+        finally:
+            self._lock.release()
+        # strings are known by the consumer only once they have been sent
+        self._section_ids.update(new_sections)
+        self._host_ids.update(new_hosts)
+
+    def _read_name(self, position, length):
+        buf = self._shm.buf
+        start = HEADER_SIZE + (position % self._capacity) * RECORD_SIZE
+        end = start + length
+        ring_end = HEADER_SIZE + self._capacity * RECORD_SIZE
+        if end <= ring_end:
+            name = bytes(buf[start:end])
+        else:
+            name = bytes(buf[start:ring_end]) + \
+                bytes(buf[HEADER_SIZE:HEADER_SIZE + end - ring_end])
+        return name.decode('utf-8', 'replace')
+
+    def _slots(self, position, count):
+        # bytes of count slots from position, copied only when they wrap around
+        buf = self._shm.buf
+        index = position % self._capacity
+        start = HEADER_SIZE + index * RECORD_SIZE
+        if index + count <= self._capacity:
+            return buf[start:start + count * RECORD_SIZE]
+        first = self._capacity - index
+        return bytes(buf[start:start + first * RECORD_SIZE]) + \
+            bytes(buf[HEADER_SIZE:HEADER_SIZE + (count - first) * RECORD_SIZE])
+
+    def get(self, block=True, timeout=None):
+        buf = self._shm.buf
+        deadline = None if timeout is None else time.monotonic() + timeout
+        sleep = 0.0001
+        head, tail = HEADER.unpack_from(buf, 0)
+        while head == tail:
+            if not block or (deadline is not None and time.monotonic() > deadline):
+                raise queue.Empty
+            time.sleep(sleep)
+            sleep = min(sleep * 2, RING_GET_MAX_SLEEP)
+            head, tail = HEADER.unpack_from(buf, 0)
+
+        kind, _, source, _, pid, slot_count, watermark, inode = RECORD.unpack_from(
+            buf, HEADER_SIZE + (tail % self._capacity) * RECORD_SIZE)
+        if kind == KIND_WATERMARK:
+            struct.pack_into('<Q', buf, 8, tail + 1)
+            return (source, watermark, inode, slot_count)
+        sections = self._sections.setdefault(pid, dict())
+        hosts = self._hosts.setdefault(pid, dict())
+        position = tail + 1
+        end = position + slot_count
+        # the names sent with a batch come before its records
+        while position < end:
+            kind, _, section_id, host_id, _, size, _, _ = RECORD.unpack_from(
+                buf, HEADER_SIZE + (position % self._capacity) * RECORD_SIZE)
+            if kind == KIND_SECTION_NAME:
+                sections[section_id] = self._read_name(position + 1, size)
+            elif kind == KIND_HOST_NAME:
+                hosts[host_id] = self._read_name(position + 1, size)
+            else:
+                break
+            position = position + 1 + name_slots(size)
+        # records are unpacked at once, then zipped back field by field
+        count = end - position
+        fields = batch_struct(count).unpack_from(self._slots(position, count)) if count else ()
+        batch = list(zip(map(sections.__getitem__, fields[2::RECORD_FIELDS]),
+                         map(hosts.__getitem__, fields[3::RECORD_FIELDS]),
+                         fields[5::RECORD_FIELDS], fields[1::RECORD_FIELDS],
+                         fields[6::RECORD_FIELDS], fields[7::RECORD_FIELDS]))
+        # release the slots to producers
+        struct.pack_into('<Q', buf, 8, tail + 1 + slot_count)
+        # the section id of a batch header is its weight
+        if source > 1:
+            return WeightedBatch(batch, source)
+        return batch
@@ -0,0 +1,243 @@
+import heapq
+import math
+from hashlib import blake2b
+
+# Streaming summaries keeping statistics in fixed memory whatever the number of keys.
+
+DEFAULT_HLL_PRECISION = 12  # 4096 registers, standard error of 1.6%
+DEFAULT_RELATIVE_ACCURACY = 0.01
+DEFAULT_MAX_BUCKETS = 1024
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(65)]
+_HIGH_BITS = dict()
+
+
+def hash64(key):
+    # 64 bit hash of a str or bytes, stable across processes and runs unlike hash()
+    if isinstance(key, str):
+        key = key.encode('utf-8', 'replace')
+    return int.from_bytes(blake2b(key, digest_size=8).digest(), 'little')
+
+
+class SpaceSaving(object):
+    '''
+    Space-Saving heavy hitters: counts of at most capacity keys.
+    A new key replaces the key with the smallest count and inherits that count
+    as its error: the true count of a key is between count - error and count.
+    '''
+
+    def __init__(self, capacity):
+        self._capacity = capacity
+        # key -> [count, error]
+        self._counters = dict()
+        # (count, key) with one entry per key, the count may be lower than the
+        # current one, it is fixed when the entry reaches the top of the heap
+        self._heap = []
+
+    def __len__(self):
+        return len(self._counters)
+
+    def add(self, key, weight=1):
+        counter = self._counters.get(key)
+        if counter is not None:
+            counter[0] = counter[0] + weight
+            return
+        if len(self._counters) < self._capacity:
+            self._counters[key] = [weight, 0]
+            heapq.heappush(self._heap, (weight, key))
+            return
+        heap = self._heap
+        while True:
+            count, smallest_key = heap[0]
+            current_count = self._counters[smallest_key][0]
+            if count == current_count:
+                break
+            heapq.heapreplace(heap, (current_count, smallest_key))
+        del self._counters[smallest_key]
+        self._counters[key] = [count + weight, count]
+        heapq.heapreplace(heap, (count + weight, key))
+
+    def update(self, counts):
+        # add the counts of a dict
+        for key, weight in counts.items():
+            self.add(key, weight)
+
+    def top(self, n):
+        # [(key, count, error)] by decreasing count
+        return [(key, count, error) for key, (count, error) in heapq.nlargest(
+            n, self._counters.items(), key=lambda item: item[1][0])]
+
+
+class HyperLogLog(object):
+    '''
+    HyperLogLog estimation of the number of distinct keys added, from their hash64.
+    Sketches with the same precision are merged into the sketch of the union.
+    '''
+
+    def __init__(self, precision=DEFAULT_HLL_PRECISION):
+        self._precision = precision
+        # the first bits of a hash select a register, which keeps the maximum
+        # rank of the first 1 bit in the remaining bits
+        self._shift = 64 - precision
+        self._mask = (1 << self._shift) - 1
+        self._registers = bytearray(1 << precision)
+
+    def add(self, key):
+        self.add_hashes((hash64(key), ))
+
+    def add_hashes(self, hashes):
+        registers = self._registers
+        shift = self._shift
+        mask = self._mask
+        for key_hash in hashes:
+            index = key_hash >> shift
+            rank = shift - (key_hash & mask).bit_length() + 1
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def merge(self, other):
+        if other._precision != self._precision:
+            raise ValueError('can not merge HyperLogLog of different precisions')
+        # register wise maximum computed on all registers at once as big integers:
+        # ranks are below 128, so with the high bit of each byte set the
+        # subtraction never borrows from the next byte, and the high bit left
+        # tells which register is greater
+        size = len(self._registers)
+        high_bits = _HIGH_BITS.get(size)
+        if high_bits is None:
+            high_bits = int.from_bytes(b'\x80' * size, 'little')
+            _HIGH_BITS[size] = high_bits
+        registers = int.from_bytes(self._registers, 'little')
+        other_registers = int.from_bytes(other._registers, 'little')
+        greater = ((((registers | high_bits) - other_registers) & high_bits) >> 7) * 0xff
+        self._registers = bytearray(
+            ((registers & greater) | (other_registers & ~greater)).to_bytes(size, 'little'))
+
+    def copy(self):
+        sketch = HyperLogLog(self._precision)
+        sketch._registers = bytearray(self._registers)
+        return sketch
+
+    def count(self):
+        registers = self._registers
+        m = len(registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / \
+            sum(map(_INVERSE_POWERS.__getitem__, registers))
+        zeros = registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class DDSketch(object):
+    '''
+    DDSketch quantiles of non negative values: values are counted in buckets
+    growing geometrically, a quantile is within relative_accuracy of the value
+    of that rank. Above max_buckets, the lowest buckets are collapsed so that
+    only low quantiles lose accuracy. Sketches with the same accuracy are merged
+    into the sketch of the union.
+    '''
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY,
+                 max_buckets=DEFAULT_MAX_BUCKETS):
+        self._relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._inverse_log_gamma = 1.0 / math.log(self._gamma)
+        self._max_buckets = max_buckets
+        # bucket index -> count, bucket i holds values in (gamma^(i-1), gamma^i]
+        self._buckets = dict()
+        self._zero_count = 0
+        self.count = 0
+
+    def add(self, value):
+        self.add_values((value, ))
+
+    def add_values(self, values, weight=1):
+        # each value counted weight times
+        buckets = self._buckets
+        inverse_log_gamma = self._inverse_log_gamma
+        log = math.log
+        ceil = math.ceil
+        zero_count = 0
+        for value in values:
+            if value > 0:
+                index = ceil(log(value) * inverse_log_gamma)
+                buckets[index] = buckets.get(index, 0) + weight
+            else:
+                zero_count = zero_count + 1
+        self._zero_count = self._zero_count + zero_count * weight
+        self.count = self.count + len(values) * weight
+        if len(buckets) > self._max_buckets:
+            self._collapse()
+
+    def _collapse(self):
+        buckets = self._buckets
+        indexes = sorted(buckets)
+        extra = len(indexes) - self._max_buckets
+        lowest = indexes[extra]
+        for index in indexes[:extra]:
+            buckets[lowest] = buckets[lowest] + buckets.pop(index)
+
+    def merge(self, other):
+        if other._relative_accuracy != self._relative_accuracy:
+            raise ValueError('can not merge DDSketch of different accuracies')
+        buckets = self._buckets
+        for index, count in other._buckets.items():
+            buckets[index] = buckets.get(index, 0) + count
+        self._zero_count = self._zero_count + other._zero_count
+        self.count = self.count + other.count
+        if len(buckets) > self._max_buckets:
+            self._collapse()
+
+    def copy(self):
+        sketch = DDSketch(self._relative_accuracy, self._max_buckets)
+        sketch.merge(self)
+        return sketch
+
+    def quantiles(self, qs):
+        # values at the quantiles qs given in increasing order, 0 when empty
+        values = []
+        if self.count == 0:
+            return [0 for _ in qs]
+        ranks = iter(q * (self.count - 1) for q in qs)
+        rank = next(ranks)
+        seen = self._zero_count
+        while seen > rank:
+            values.append(0)
+            rank = next(ranks, None)
+            if rank is None:
+                return values
+        for index in sorted(self._buckets):
+            seen = seen + self._buckets[index]
+            while seen > rank:
+                # middle of the bucket in relative terms
+                values.append(2 * self._gamma ** index / (self._gamma + 1))
+                rank = next(ranks, None)
+                if rank is None:
+                    return values
+        return values
+
+    def quantile(self, q):
+        return self.quantiles((q, ))[0]
+
+
+class ExactCounter(dict):
+    '''
+    Exact counts with the interface of SpaceSaving, memory grows with the number of keys.
+    '''
+
+    def add(self, key, weight=1):
+        self[key] = self.get(key, 0) + weight
+
+    def update(self, counts):
+        for key, weight in counts.items():
+            self[key] = self.get(key, 0) + weight
+
+    def top(self, n):
+        return [(key, count, 0) for key, count in heapq.nlargest(
+            n, self.items(), key=lambda item: item[1])]
+
+
+def make_counter(capacity=0):
+    # heavy hitters in fixed memory when capacity is set, exact counts otherwise
+    return SpaceSaving(capacity) if capacity else ExactCounter()
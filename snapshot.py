@@ -0,0 +1,100 @@
+import json
+import struct
+from multiprocessing import shared_memory
+
+# Statistics published by Analyzer once per frame, read by UI without IPC.
+#
+# The snapshot is a JSON document written in shared memory with double buffering.
+# The sequence counter is odd while a snapshot is being written, version v of
+# the snapshot is in buffer v % 2 and the next version is written into the other
+# buffer. A reader copies the latest buffer and checks with the sequence counter
+# that the writer did not start writing into that buffer in the meantime.
+
+DEFAULT_SNAPSHOT_SIZE = 16 * 1024 * 1024  # bytes per buffer
+SNAPSHOT_READ_RETRIES = 100
+
+# sequence counter, length of buffer 0, length of buffer 1
+HEADER = struct.Struct('<QQQ')
+HEADER_SIZE = 64
+SEQUENCE = struct.Struct('<Q')
+
+
+class SharedSnapshot(object):
+    def __init__(self, size=DEFAULT_SNAPSHOT_SIZE):
+        self._size = size
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=HEADER_SIZE + 2 * size)
+        HEADER.pack_into(self._shm.buf, 0, 0, 0, 0)
+        # reader cache
+        self._sequence = None
+        self._data = b''
+        self._snapshot = dict()
+
+    @property
+    def version(self):
+        return SEQUENCE.unpack_from(self._shm.buf, 0)[0] // 2
+
+    def close(self):
+        self._shm.close()
+
+    def unlink(self):
+        self._shm.unlink()
+
+    # writer side, a single process publishes at a time
+
+    def publish(self, statistics):
+        self.publish_data(json.dumps(statistics).encode('utf-8'))
+
+    def publish_data(self, data):
+        if len(data) > self._size:
+            raise ValueError(
+                f'snapshot of {len(data)} bytes exceeds buffer size {self._size}')
+        buf = self._shm.buf
+        sequence = SEQUENCE.unpack_from(buf, 0)[0]
+        buffer_index = (sequence // 2 + 1) % 2
+        SEQUENCE.pack_into(buf, 0, sequence + 1)
+        start = HEADER_SIZE + buffer_index * self._size
+        buf[start:start + len(data)] = data
+        struct.pack_into('<Q', buf, 8 + buffer_index * 8, len(data))
+        SEQUENCE.pack_into(buf, 0, sequence + 2)
+
+    # reader side
+
+    @property
+    def data_version(self):
+        # version of the snapshot returned by the last read_data()
+        return self._sequence // 2 if self._sequence else 0
+
+    def read_data(self):
+        # latest consistent snapshot as JSON bytes
+        buf = self._shm.buf
+        for _ in range(SNAPSHOT_READ_RETRIES):
+            sequence = SEQUENCE.unpack_from(buf, 0)[0]
+            if sequence == self._sequence:
+                return self._data
+            version = sequence // 2
+            if version == 0:
+                return b''
+            buffer_index = version % 2
+            length = struct.unpack_from('<Q', buf, 8 + buffer_index * 8)[0]
+            start = HEADER_SIZE + buffer_index * self._size
+            data = bytes(buf[start:start + length])
+            # the writer writes into this buffer again for version + 2
+            if SEQUENCE.unpack_from(buf, 0)[0] < 2 * version + 3:
+                self._sequence = sequence
+                self._data = data
+                self._snapshot = None
+                return data
+        raise RuntimeError('could not read a consistent snapshot')
+
+    def snapshot(self):
+        data = self.read_data()
+        if self._snapshot is None:
+            self._snapshot = json.loads(data) if data else dict()
+        return self._snapshot
+
+    def get(self, key, default=None):
+        return self.snapshot().get(key, default)
+
+    def __getitem__(self, key):
+        return self.snapshot()[key]
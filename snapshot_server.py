@@ -0,0 +1,175 @@
+import json
+import os
+import selectors
+import socket
+import struct
+
+# Statistics served to clients through a Unix domain socket, so that a
+# headless monitor can be looked at by any number of UIs attaching and
+# detaching at will.
+#
+# A client sends the version of the snapshot it holds as a decimal line, the
+# server answers with the latest version and the length of the snapshot, then
+# the snapshot as JSON, or no snapshot when the client holds the latest one.
+# The JSON is the one published once per frame into shared memory, the reply is
+# built once per version and sent as is to every client.
+
+# version, length of the JSON snapshot
+REPLY_HEADER = struct.Struct('<QQ')
+SERVER_SELECT_TIMEOUT = 0.5
+CLIENT_TIMEOUT = 5
+RECEIVE_SIZE = 4096
+
+
+class SnapshotConnection(object):
+    def __init__(self, client_socket):
+        self.socket = client_socket
+        self.request = b''
+        # replies waiting for the socket to be writable
+        self.replies = []
+
+
+class SnapshotServer(object):
+    def __init__(self, path, snapshot):
+        self._path = path
+        # SharedSnapshot
+        self._snapshot = snapshot
+        self._version = None
+        self._reply = b''
+        self._latest_reply = b''
+
+    def _listen(self):
+        if os.path.exists(self._path):
+            # left behind by a monitor which did not stop cleanly
+            os.unlink(self._path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self._path)
+        listener.listen()
+        listener.setblocking(False)
+        return listener
+
+    def reply(self, client_version):
+        data = self._snapshot.read_data()
+        version = self._snapshot.data_version
+        if version != self._version:
+            self._version = version
+            self._reply = REPLY_HEADER.pack(version, len(data)) + data
+            self._latest_reply = REPLY_HEADER.pack(version, 0)
+        return self._latest_reply if client_version == version else self._reply
+
+    def serve(self, running):
+        listener = self._listen()
+        selector = selectors.DefaultSelector()
+        selector.register(listener, selectors.EVENT_READ)
+        try:
+            while running.value == 1:
+                for key, events in selector.select(SERVER_SELECT_TIMEOUT):
+                    if key.fileobj is listener:
+                        self._accept(selector, listener)
+                        continue
+                    connection = key.data
+                    try:
+                        if events & selectors.EVENT_READ:
+                            self._read(selector, connection)
+                        elif events & selectors.EVENT_WRITE:
+                            self._write(selector, connection)
+                    except (OSError, ValueError):
+                        # gone, or not speaking the protocol
+                        self._close(selector, connection)
+        finally:
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+            selector.close()
+            os.unlink(self._path)
+
+    def _accept(self, selector, listener):
+        try:
+            client_socket, _ = listener.accept()
+        except BlockingIOError:
+            return
+        client_socket.setblocking(False)
+        selector.register(client_socket, selectors.EVENT_READ,
+                          SnapshotConnection(client_socket))
+
+    def _read(self, selector, connection):
+        data = connection.socket.recv(RECEIVE_SIZE)
+        if not data:
+            # detached
+            self._close(selector, connection)
+            return
+        connection.request = connection.request + data
+        *lines, connection.request = connection.request.split(b'\n')
+        for line in lines:
+            connection.replies.append(memoryview(self.reply(int(line))))
+        self._write(selector, connection)
+
+    def _write(self, selector, connection):
+        while connection.replies:
+            reply = connection.replies[0]
+            try:
+                sent = connection.socket.send(reply)
+            except BlockingIOError:
+                break
+            if sent < len(reply):
+                connection.replies[0] = reply[sent:]
+            else:
+                connection.replies.pop(0)
+        events = selectors.EVENT_READ
+        if connection.replies:
+            events = events | selectors.EVENT_WRITE
+        selector.modify(connection.socket, events, connection)
+
+    def _close(self, selector, connection):
+        selector.unregister(connection.socket)
+        connection.socket.close()
+
+
+class SnapshotClient(object):
+    '''
+    Latest statistics of a monitor serving them on a Unix domain socket.
+    The connection is opened again when the monitor restarts, the last
+    snapshot received is kept meanwhile.
+    '''
+
+    def __init__(self, path, timeout=CLIENT_TIMEOUT):
+        self._path = path
+        self._timeout = timeout
+        self._socket = None
+        self._version = 0
+        self._snapshot = dict()
+
+    @property
+    def attached(self):
+        return self._socket is not None
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _receive(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self._socket.recv(size - len(data))
+            if not chunk:
+                raise ConnectionResetError('monitor closed the connection')
+            data += chunk
+        return data
+
+    def snapshot(self):
+        try:
+            if self._socket is None:
+                self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._socket.settimeout(self._timeout)
+                self._socket.connect(self._path)
+            self._socket.sendall(f'{self._version}\n'.encode('ascii'))
+            version, length = REPLY_HEADER.unpack(self._receive(REPLY_HEADER.size))
+            if length:
+                self._snapshot = json.loads(self._receive(length))
+            self._version = version
+        except OSError:
+            self.close()
+        return self._snapshot
+
+    def get(self, key, default=None):
+        return self.snapshot().get(key, default)
@@ -0,0 +1,146 @@
+import pickle
+import unittest
+
+from alert_rules import parse_rules, WindowedCounter
+from analyzer import FrameStats
+from time_wheel import SlidingWindows
+
+RULES = '''
+[api-rate]
+rule = section_rate
+section = /api
+window = 20s
+above = 2
+below = 1
+
+[errors]
+rule = error_ratio
+section = *
+above = 0.5
+min_hits = 4
+
+[all-errors]
+rule = error_ratio
+above = 0.5
+
+[budget]
+rule = host_bytes
+host = 10.0.0.1
+window = 30s
+above = 1000
+below = 700
+'''
+
+
+def make_frame(records):
+    # records are (section, host, size, status)
+    frame = FrameStats()
+    frame.add_batch([(section, host, size, status, 0, 0)
+                     for section, host, size, status in records])
+    return frame
+
+
+class AlertRulesTest(unittest.TestCase):
+    def test_hysteresis(self):
+        rules = parse_rules(RULES, 10)
+        on = [('/api', '10.0.0.2', 10, 200)] * 50
+        # 2.5 hits/s over 20s
+        alerts = rules.evaluate(make_frame(on), 0)
+        self.assertEqual([alert_on for alert_on, _ in alerts], [True])
+        self.assertIn('api-rate', alerts[0][1])
+        # 1.5 hits/s, between the thresholds, stays on
+        alerts = rules.evaluate(make_frame(on[:10]), 10)
+        self.assertEqual((alerts, rules.firing), ([], 1))
+        # 0.5 hits/s
+        alerts = rules.evaluate(make_frame([]), 20)
+        self.assertEqual([alert_on for alert_on, _ in alerts], [False])
+        self.assertEqual(rules.firing, 0)
+
+    def test_error_ratio(self):
+        rules = parse_rules(RULES, 10)
+        frame = make_frame([('/a', '10.0.0.2', 10, 503)] * 3 +
+                           [('/b', '10.0.0.2', 10, 500)] * 4 +
+                           [('/b', '10.0.0.2', 10, 200)] * 2)
+        alerts = rules.evaluate(frame, 0)
+        # /a has too few hits, 7 of 9 hits are errors
+        self.assertEqual(sorted(msg.split(' - ')[1].split(',')[0] for _, msg in alerts),
+                         ['all sections 5xx ratio 77.8% over 10s',
+                          'section /b 5xx ratio 66.7% over 10s'])
+        alerts = rules.evaluate(make_frame([('/b', '10.0.0.2', 10, 200)] * 9), 10)
+        self.assertEqual(len(alerts), 2)
+        self.assertEqual(rules.firing, 0)
+
+    def test_host_budget(self):
+        rules = parse_rules(RULES, 10)
+        for now in (0, 10):
+            self.assertEqual(rules.evaluate(make_frame([('/', '10.0.0.1', 400, 200)]), now), [])
+        alerts = rules.evaluate(make_frame([('/', '10.0.0.1', 400, 200)]), 20)
+        self.assertEqual([alert_on for alert_on, _ in alerts], [True])
+        # rules go on from where they were after a checkpoint
+        rules = pickle.loads(pickle.dumps(rules))
+        # the first frame leaves the window, 800 bytes is still over 700
+        self.assertEqual(rules.evaluate(make_frame([]), 30), [])
+        alerts = rules.evaluate(make_frame([]), 40)
+        self.assertEqual([alert_on for alert_on, _ in alerts], [False])
+        self.assertEqual(rules.firing, 0)
+
+    def test_changed_keys(self):
+        counter = WindowedCounter('section_hits', 2, {'/a', '/b'})
+        self.assertEqual(counter.update({'/a': 1, '/c': 5}), {'/a'})
+        self.assertEqual(counter.update({'/b': 2}), {'/b'})
+        # the first frame leaves the window
+        self.assertEqual(counter.update({}), {'/a'})
+        self.assertEqual(counter.sums, {'/b': 2})
+        counter = WindowedCounter('section_hits', 1)
+        self.assertEqual(counter.update({'/a': 1, '/c': 5}), {'/a', '/c'})
+        self.assertEqual(counter.update({'/c': 1}), {'/a', '/c'})
+        self.assertEqual(counter.sums, {'/c': 1})
+
+    def test_bounded_keys(self):
+        # counting all keys, the 2 largest counts of each frame are kept
+        counter = WindowedCounter('host_bytes', 2, max_keys=4)
+        counter.update({'a': 5, 'b': 1, 'c': 3})
+        self.assertEqual(counter.update({'a': 1, 'b': 4, 'd': 2}), {'b', 'd'})
+        self.assertEqual(counter.sums, {'a': 5, 'b': 4, 'c': 3, 'd': 2})
+        self.assertEqual(counter.update({'e': 9}), {'a', 'c', 'e'})
+        self.assertEqual(counter.sums, {'b': 4, 'd': 2, 'e': 9})
+
+    def test_traffic(self):
+        rules = parse_rules('[burst]\nrule = traffic\nwindow = 5s\nabove = 10\n'
+                            '[errors]\nrule = traffic\nmetric = error_ratio\nwindow = 2s\n'
+                            'above = 0.4\n', 10)
+        self.assertEqual(rules.windows, [2, 5])
+        windows = SlidingWindows([], 1, 1000, None)
+        # evaluated on sliding windows of any length, between frames
+        windows.add_batch([('/a', '10.0.0.1', 10, 200, 0, 0)] * 60, 1001.5)
+        alerts = rules.evaluate_windows(windows, 1001.5)
+        self.assertEqual([alert_on for alert_on, _ in alerts], [True])
+        self.assertIn('burst', alerts[0][1])
+        windows.add_batch([('/a', '10.0.0.1', 10, 503, 0, 0)] * 50, 1005.5)
+        alerts = rules.evaluate_windows(windows, 1005.5)
+        self.assertEqual([alert_on for alert_on, _ in alerts], [True])
+        self.assertIn('errors', alerts[0][1])
+        self.assertEqual(rules.firing, 2)
+        # no traffic over the last 5s
+        alerts = rules.evaluate_windows(windows, 1011.5)
+        self.assertEqual([alert_on for alert_on, _ in alerts], [False, False])
+        # not evaluated on frames
+        self.assertEqual(rules.evaluate(make_frame([]), 1010), [])
+
+    def test_invalid_rules(self):
+        for text in ('[a]\nrule = nope\nabove = 1\n',
+                     '[a]\nrule = section_rate\nabove = 1\n',
+                     '[a]\nrule = host_bytes\nhost = *\n',
+                     '[a]\nrule = host_bytes\nhost = *\nabove = 1\nbelow = 2\n',
+                     '[a]\nrule = host_bytes\nhost = *\nabove = x\n',
+                     '[a]\nrule = host_bytes\nhost = *\nabove = 1\nwindow = 5x\n',
+                     '[a]\nrule = host_bytes\nhost = *\nabove = 1\nfoo = 1\n',
+                     '[a]\nrule = traffic\nmetric = lps\nabove = 1\n',
+                     '[a]\nrule = traffic\nwindow = 2d\nabove = 1\n',
+                     'rule = host_bytes\n'):
+            with self.assertRaises(ValueError, msg=text):
+                parse_rules(text, 10)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
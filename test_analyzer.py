@@ -0,0 +1,215 @@
+import time
+import unittest
+
+from analyzer import Analyzer, FrameStats, EventTimeFrames, TOP_SECTIONS, TOP_SIZE_SECTIONS, \
+    OTHER_SECTIONS, ALL_SECTIONS
+from sketches import DDSketch, HyperLogLog, SpaceSaving, hash64
+
+FRAME_INTERVAL = 10
+SCENE_INTERVAL = 40
+START_TIME = 1000000.0
+
+
+def make_frame(hits, section='/item', remotehost='10.0.0.1'):
+    frame = FrameStats()
+    frame.add_batch([(section, remotehost, 100, 200, START_TIME, hash64(section))] * hits)
+    return frame
+
+
+class FrameStatsTest(unittest.TestCase):
+    def test_merge(self):
+        frame = make_frame(3)
+        frame.merge(make_frame(2, '/images', '10.0.0.2'))
+        frame.merge(make_frame(1))
+        self.assertEqual(frame.hit_count, 6)
+        self.assertEqual(frame.section_hits, {'/item': 4, '/images': 2})
+        self.assertEqual(frame.host_bytes, {'10.0.0.1': 400, '10.0.0.2': 200})
+
+    def test_weighted_batch(self):
+        frame = make_frame(100)
+        frame.add_batch([('/images', '10.0.0.2', 100, 500, START_TIME, 0)] * 100, weight=4)
+        self.assertEqual(frame.hit_count, 500)
+        self.assertEqual(frame.section_hits, {'/item': 100, '/images': 400})
+        self.assertEqual(frame.host_bytes, {'10.0.0.1': 10000, '10.0.0.2': 40000})
+        self.assertEqual(frame.error_count, 400)
+        self.assertEqual(frame.sampling_rate, 2.5)
+        # 100 records sampled 1 in 4 stand for 400 +- sqrt(100 * 4 * 3) hits
+        self.assertAlmostEqual(frame.sampling_error, 34.64 / 500, places=4)
+        frame.merge(make_frame(100))
+        self.assertEqual(frame.sampling_rate, 2)
+
+
+class AnalyzerTest(unittest.TestCase):
+    def test_alert_on_and_off(self):
+        analyzer = Analyzer(FRAME_INTERVAL, SCENE_INTERVAL, START_TIME)
+        now = START_TIME
+        alerts = []
+        # 1 hit per second for a scene, 100 hits per second for a scene, then 1 again
+        for hits in [10] * 4 + [1000] * 4 + [10] * 8:
+            now = now + FRAME_INTERVAL
+            statistics, alert = analyzer.close_frame(make_frame(hits), now, 10)
+            if alert:
+                alerts.append(alert[0])
+        self.assertEqual(statistics['lps_frame'], 1)
+        self.assertEqual(statistics['frame_version'], 16)
+        self.assertEqual(statistics['total_hit_count'], 12 * 10 + 4 * 1000)
+        self.assertEqual(statistics['top_hosts'], [('10.0.0.1', 412000, 0)])
+        self.assertEqual(statistics['top_sections_lifetime'],
+                         [('/item', 12 * 10 + 4 * 1000, 0)])
+        self.assertTrue(alerts[0])
+        self.assertFalse(alerts[-1])
+        self.assertEqual(alerts.count(False), 1)
+
+    def test_top_sections_frame(self):
+        analyzer = Analyzer(FRAME_INTERVAL, SCENE_INTERVAL, START_TIME)
+        frame = FrameStats()
+        for i in range(1000):
+            frame.add_batch([(f'/s{i}', 'h', 100, 200, START_TIME, 0)] * (i % 300 + 1))
+        statistics, _ = analyzer.close_frame(frame, START_TIME + 10, 10)
+        top = statistics['top_sections_frame']
+        self.assertEqual(len(top), TOP_SECTIONS)
+        self.assertEqual(top[0][1], 300)
+        self.assertEqual([hits for _, hits in top], sorted(
+            frame.section_hits.values(), reverse=True)[:TOP_SECTIONS])
+
+
+class EventTimeFramesTest(unittest.TestCase):
+    def test_watermarks_close_frames(self):
+        frames = EventTimeFrames(FRAME_INTERVAL, START_TIME, range(2))
+        record = ('/item', '10.0.0.1', 100, 200, START_TIME + 5, 0)
+        later_record = ('/item', '10.0.0.1', 100, 200, START_TIME + 25, 0)
+        frames.add_batch([record, later_record, record])
+        frames.set_watermark(0, START_TIME + 30)
+        # the second source has not been read past the first frame yet
+        self.assertEqual(list(frames.closed_frames()), [])
+        frames.set_watermark(1, START_TIME + 12)
+        closed = list(frames.closed_frames())
+        self.assertEqual([(index, frame.hit_count) for index, frame in closed], [(0, 2)])
+        # a record of the closed frame is late
+        frames.add_batch([record] * 3)
+        frames.set_watermark(1, START_TIME + 30)
+        closed = list(frames.closed_frames())
+        self.assertEqual([(index, frame.hit_count, frame.late_count) for index, frame in closed],
+                         [(1, 0, 3), (2, 1, 0)])
+
+    def test_sources_come_and_go(self):
+        frames = EventTimeFrames(FRAME_INTERVAL, START_TIME, ['a.log'])
+        record = ('/item', '10.0.0.1', 100, 200, START_TIME + 5, 0)
+        frames.add_batch([record] * 2, 'a.log')
+        frames.add_source('b.log')
+        frames.add_batch([record], 'b.log')
+        frames.set_watermark('a.log', START_TIME + 12)
+        # the new source holds the frame until its first watermark
+        self.assertEqual(list(frames.closed_frames()), [])
+        frames.remove_source('b.log')
+        closed = list(frames.closed_frames())
+        self.assertEqual([(index, frame.source_hits) for index, frame in closed],
+                         [(0, {'a.log': 2, 'b.log': 1})])
+        analyzer = Analyzer(FRAME_INTERVAL, SCENE_INTERVAL, START_TIME)
+        statistics, _ = analyzer.close_frame(closed[0][1], START_TIME + 10, 10)
+        self.assertEqual(statistics['top_sources_frame'],
+                         [('a.log', 2 / FRAME_INTERVAL), ('b.log', 1 / FRAME_INTERVAL)])
+
+    def test_future_records(self):
+        # a record dated a year ahead does not close the frames up to its date
+        start_time = time.time() - 3 * FRAME_INTERVAL
+        frames = EventTimeFrames(FRAME_INTERVAL, start_time, range(1))
+        future = start_time + 365 * 86400
+        frames.add_batch([('/item', '10.0.0.1', 100, 200, start_time + 5, 0),
+                          ('/item', '10.0.0.1', 100, 200, future, 0)])
+        frames.set_watermark(0, future)
+        closed = list(frames.closed_frames())
+        self.assertEqual(len(closed), 3)
+        self.assertEqual((closed[0][1].hit_count, closed[0][1].late_count), (1, 1))
+        self.assertEqual(frames.pop_open_frames().hit_count, 0)
+
+
+class SpaceSavingTest(unittest.TestCase):
+    def test_heavy_hitters_within_error(self):
+        counts = {f'10.0.0.{i}': i for i in range(1, 201)}
+        heavy_hitters = SpaceSaving(20)
+        # heavy hitters arrive with many small keys in between
+        for key, count in counts.items():
+            for _ in range(count):
+                heavy_hitters.add(key)
+        self.assertEqual(len(heavy_hitters), 20)
+        top = heavy_hitters.top(5)
+        self.assertEqual([key for key, _, _ in top],
+                         [f'10.0.0.{i}' for i in range(200, 195, -1)])
+        for key, count, error in top:
+            self.assertLessEqual(count - error, counts[key])
+            self.assertGreaterEqual(count, counts[key])
+
+    def test_analyzer_top_hosts(self):
+        analyzer = Analyzer(FRAME_INTERVAL, SCENE_INTERVAL, START_TIME, 2)
+        analyzer.close_frame(make_frame(10), START_TIME + 10, 10)
+        analyzer.close_frame(make_frame(1, '/a', '10.0.0.2'), START_TIME + 20, 10)
+        statistics, _ = analyzer.close_frame(
+            make_frame(1, '/b', '10.0.0.3'), START_TIME + 30, 10)
+        # 10.0.0.3 replaced 10.0.0.2 and inherited its bytes as error
+        self.assertEqual(statistics['top_hosts'],
+                         [('10.0.0.1', 1000, 0), ('10.0.0.3', 200, 100)])
+        self.assertEqual(statistics['top_sections_lifetime'],
+                         [('/item', 10, 0), ('/b', 2, 1)])
+
+
+class HyperLogLogTest(unittest.TestCase):
+    def test_count_and_merge(self):
+        first = HyperLogLog()
+        first.add_hashes(hash64(f'/page{i}') for i in range(20000))
+        second = HyperLogLog()
+        second.add_hashes(hash64(f'/page{i}') for i in range(10000, 30000))
+        self.assertAlmostEqual(first.count(), 20000, delta=20000 * 0.05)
+        first.merge(second)
+        self.assertAlmostEqual(first.count(), 30000, delta=30000 * 0.05)
+
+    def test_analyzer_unique_counts(self):
+        analyzer = Analyzer(FRAME_INTERVAL, SCENE_INTERVAL, START_TIME)
+        now = START_TIME
+        for i in range(6):
+            now = now + FRAME_INTERVAL
+            frame = make_frame(5, f'/section{i}', f'10.0.0.{i}')
+            frame.merge(make_frame(5, '/item', '10.0.0.100'))
+            statistics, _ = analyzer.close_frame(frame, now, 10)
+        self.assertEqual(statistics['unique_hosts_frame'], 2)
+        self.assertEqual(statistics['unique_paths_frame'], 2)
+        # the scene holds the last 4 frames
+        self.assertEqual(statistics['unique_hosts_scene'], 5)
+        self.assertEqual(statistics['unique_paths_scene'], 5)
+        self.assertEqual(statistics['unique_hosts_lifetime'], 7)
+        self.assertEqual(statistics['unique_paths_lifetime'], 7)
+
+
+class DDSketchTest(unittest.TestCase):
+    def test_quantiles_and_merge(self):
+        first = DDSketch()
+        first.add_values(range(1, 1001))
+        second = DDSketch()
+        second.add_values([0] * 1000)
+        for q, expected in zip((0.5, 0.95, 0.99), (500, 950, 990)):
+            self.assertAlmostEqual(first.quantile(q), expected, delta=expected * 0.01)
+        first.merge(second)
+        self.assertEqual(first.count, 2000)
+        self.assertEqual(first.quantile(0.25), 0)
+        self.assertAlmostEqual(first.quantile(0.75), 500, delta=5)
+
+    def test_analyzer_size_quantiles(self):
+        analyzer = Analyzer(FRAME_INTERVAL, SCENE_INTERVAL, START_TIME)
+        frame = FrameStats()
+        # one section with large responses and more sections than are published
+        frame.add_batch([('/big', 'h', 10 ** 6, 200, START_TIME, 0)] * 100)
+        for i in range(TOP_SIZE_SECTIONS + 5):
+            frame.add_batch([(f'/s{i}', 'h', 100, 200, START_TIME, 0)] * (i + 1))
+        statistics, _ = analyzer.close_frame(frame, START_TIME + 10, 10)
+        rows = {row[0]: row for row in statistics['size_quantiles_frame']}
+        self.assertEqual(len(rows), TOP_SIZE_SECTIONS + 2)
+        self.assertEqual(rows[OTHER_SECTIONS][1], sum(range(1, 7)))
+        self.assertEqual(rows[ALL_SECTIONS][1], frame.hit_count)
+        self.assertAlmostEqual(rows['/s14'][2], 100, delta=1)
+        self.assertGreater(rows[ALL_SECTIONS][4], 10 ** 5)
+        self.assertEqual(statistics['size_quantiles_scene'],
+                         statistics['size_quantiles_frame'])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
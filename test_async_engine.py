@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from multiprocessing import Value
+
+from async_engine import AsyncEngine
+from inotify import INOTIFY_AVAILABLE
+
+LINE = '10.0.0.{} - - [12/Dec/2015:18:25:11 +0100] "GET /item{}/x HTTP/1.1" 200 100\n'
+
+
+class RecordingCounter(object):
+    # FrameCounter interface, keeping what the engine sends
+    def __init__(self):
+        self.sections = []
+        self.source_hits = dict()
+        self.positions = dict()
+        self.sources = []
+        self.stopped = False
+
+    def add_source(self, source):
+        self.sources.append(source)
+
+    def remove_source(self, source):
+        self.sources.remove(source)
+        self.positions.pop(source, None)
+
+    def add_batch(self, batch, source=None):
+        self.sections.extend(record[0] for record in batch)
+        self.source_hits[source] = self.source_hits.get(source, 0) + len(batch)
+
+    def set_position(self, source, watermark, inode, offset):
+        self.positions[source] = (inode, offset)
+
+    def tick(self, now):
+        pass
+
+    def stop(self):
+        self.stopped = True
+
+
+class AsyncEngineTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._filenames = [os.path.join(self._directory, f'access{i}.log')
+                           for i in range(3)]
+        for filename in self._filenames:
+            open(filename, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def write(self, source, count, section):
+        with open(self._filenames[source], 'a') as log_file:
+            for i in range(count):
+                log_file.write(LINE.format(i, section))
+
+    def wait_for(self, counter, count):
+        deadline = time.monotonic() + 5
+        while len(counter.sections) < count and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(counter.sections), count)
+
+    def start(self, sources, use_inotify):
+        engine = AsyncEngine(sources, use_inotify=use_inotify)
+        counter = RecordingCounter()
+        running = Value('b', 1)
+        thread = threading.Thread(target=engine.run, args=(running, counter))
+        thread.start()
+        # files found at start are read from their end
+        deadline = time.monotonic() + 5
+        while not counter.sources and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return counter, running, thread
+
+    def watch_files(self, use_inotify):
+        counter, running, thread = self.start(self._filenames, use_inotify)
+        try:
+            self.write(0, 10, 0)
+            self.write(2, 5, 2)
+            self.wait_for(counter, 15)
+            # rotate, the new file is read from its beginning
+            os.rename(self._filenames[2], self._filenames[2] + '.1')
+            self.write(2, 3, 3)
+            self.wait_for(counter, 18)
+        finally:
+            running.value = 0
+            thread.join()
+        self.assertTrue(counter.stopped)
+        self.assertEqual(sorted(set(counter.sections)), ['/item0', '/item2', '/item3'])
+        self.assertEqual(counter.positions[self._filenames[0]][1],
+                         os.path.getsize(self._filenames[0]))
+        self.assertEqual(counter.positions[self._filenames[2]],
+                         (os.stat(self._filenames[2]).st_ino,
+                          os.path.getsize(self._filenames[2])))
+        self.assertEqual(counter.source_hits, {self._filenames[0]: 10, self._filenames[2]: 8})
+
+    def discover_files(self, use_inotify):
+        # access0.log is there from the start, access3.log comes later
+        pattern = os.path.join(self._directory, 'access*.log')
+        counter, running, thread = self.start([pattern], use_inotify)
+        new_filename = os.path.join(self._directory, 'access3.log')
+        try:
+            self.write(0, 4, 0)
+            self.wait_for(counter, 4)
+            with open(new_filename, 'w') as log_file:
+                log_file.write(LINE.format(0, 3) * 6)
+            self.wait_for(counter, 10)
+            # rotated into a name which matches too, it is not read again
+            os.rename(self._filenames[0], self._filenames[0][:-4] + '9.log')
+            self.write(0, 2, 0)
+            os.unlink(new_filename)
+            self.wait_for(counter, 12)
+            # deleted files are dropped, by the next scan without inotify
+            deadline = time.monotonic() + 5
+            while new_filename in counter.sources and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            running.value = 0
+            thread.join()
+        self.assertEqual(len(counter.sections), 12)
+        self.assertEqual(counter.source_hits, {self._filenames[0]: 6, new_filename: 6})
+        self.assertEqual(sorted(counter.sources), sorted(
+            self._filenames + [self._filenames[0][:-4] + '9.log']))
+
+    def test_polling(self):
+        self.watch_files(use_inotify=False)
+
+    def test_discovery_polling(self):
+        self.discover_files(use_inotify=False)
+
+    @unittest.skipUnless(INOTIFY_AVAILABLE, 'inotify is not available')
+    def test_inotify(self):
+        self.watch_files(use_inotify=True)
+
+    @unittest.skipUnless(INOTIFY_AVAILABLE, 'inotify is not available')
+    def test_discovery_inotify(self):
+        self.discover_files(use_inotify=True)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,76 @@
+import math
+import pickle
+import random
+import unittest
+
+from analyzer import Analyzer, FrameStats
+from baseline import BaselineAlert, replay_records, MODEL_EWMA, MODEL_HOLT_WINTERS
+
+FRAME_INTERVAL = 60
+START_TIME = 1700006400
+DAY_FRAMES = 86400 // FRAME_INTERVAL
+
+
+def daily_traffic(days, spike_day=None, seed=1):
+    # (end time, lps, bytes per second) of frames following a daily cycle,
+    # with a 5 minutes spike at noon of spike_day
+    rng = random.Random(seed)
+    for i in range(days * DAY_FRAMES):
+        now = START_TIME + (i + 1) * FRAME_INTERVAL
+        lps = 20 * (1.2 + math.sin(2 * math.pi * (now % 86400) / 86400))
+        if i // DAY_FRAMES == spike_day and 43200 <= now % 86400 < 43500:
+            lps = lps * 3
+        hits = max(0, rng.gauss(lps * FRAME_INTERVAL, math.sqrt(lps * FRAME_INTERVAL)))
+        yield now, hits / FRAME_INTERVAL, hits * 1000 / FRAME_INTERVAL
+
+
+class BaselineTest(unittest.TestCase):
+    def run_baseline(self, model, traffic):
+        baseline = BaselineAlert(FRAME_INTERVAL, model, metrics=('lps', 'bytes'))
+        alerts = []
+        for now, lps, size in traffic:
+            alert = baseline.update({'lps': lps, 'bytes': size}, now)
+            if alert:
+                alerts.append((now,) + alert)
+        return baseline, alerts
+
+    def test_daily_cycle(self):
+        # the lifetime average would alert every day as the traffic rises
+        for model in (MODEL_EWMA, MODEL_HOLT_WINTERS):
+            _, alerts = self.run_baseline(model, daily_traffic(3))
+            self.assertEqual(alerts, [], model)
+
+    def test_spike(self):
+        for model in (MODEL_EWMA, MODEL_HOLT_WINTERS):
+            baseline, alerts = self.run_baseline(model, daily_traffic(2, spike_day=1))
+            self.assertEqual([alert_on for _, alert_on, _ in alerts], [True, False], model)
+            self.assertEqual(alerts[0][0] % 86400, 43200 + 2 * FRAME_INTERVAL)
+            self.assertIn('lps = ', alerts[0][2])
+            self.assertLessEqual(alerts[1][0] % 86400, 43500 + 3 * FRAME_INTERVAL)
+            # small enough to checkpoint
+            self.assertLess(len(pickle.dumps(baseline)), 20000)
+
+    def test_replay_records(self):
+        records = [{'start_time': now - FRAME_INTERVAL, 'interval': FRAME_INTERVAL,
+                    'lps': lps, 'bytes': size * FRAME_INTERVAL}
+                   for now, lps, size in daily_traffic(2, spike_day=1)]
+        alerts = list(replay_records(records))
+        self.assertEqual([alert_on for _, alert_on, _ in alerts], [True, False])
+
+    def test_analyzer(self):
+        analyzer = Analyzer(FRAME_INTERVAL, FRAME_INTERVAL * 2, START_TIME,
+                            baseline=BaselineAlert(FRAME_INTERVAL, MODEL_EWMA))
+        for i in range(30):
+            frame = FrameStats()
+            hits = 600 if i < 25 else 3000
+            frame.add_batch([('/a', '10.0.0.1', 100, 200, 0, 0)] * hits)
+            statistics, alert = analyzer.close_frame(
+                frame, START_TIME + (i + 1) * FRAME_INTERVAL, 10)
+            # on once the burst lasted BASELINE_PERSISTENCE frames
+            self.assertEqual(alert is not None, i == 27)
+        self.assertTrue(analyzer.alert_on)
+        self.assertEqual([row[0] for row in statistics['baseline']], ['lps', 'bytes', 'errors'])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from analyzer import Analyzer, EventTimeFrames, FrameCounter
+from checkpoint import save_checkpoint, load_checkpoint, CheckpointWriter
+from test_analyzer import make_frame, FRAME_INTERVAL, SCENE_INTERVAL, START_TIME
+
+
+class SlowState(object):
+    def __getstate__(self):
+        time.sleep(0.2)
+        return {}
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._path = os.path.join(self._directory, 'monitor.ckpt')
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def test_resume_analyzer(self):
+        analyzer = Analyzer(FRAME_INTERVAL, SCENE_INTERVAL, START_TIME)
+        frames = EventTimeFrames(FRAME_INTERVAL, START_TIME, range(1))
+        analyzer.close_frame(make_frame(10), START_TIME + 10, 10)
+        frames.add_batch([('/item', '10.0.0.1', 100, 200, START_TIME + 15, 0)])
+        save_checkpoint(self._path, {'positions': {0: (12, 3400)},
+                                     'analyzer': analyzer, 'frames': frames})
+        state = load_checkpoint(self._path)
+        self.assertEqual(state['positions'], {0: (12, 3400)})
+        # the resumed state goes on counting where it stopped
+        frames = state['frames']
+        frames.set_watermark(0, START_TIME + 20)
+        closed = list(frames.closed_frames())
+        self.assertEqual([(index, frame.hit_count) for index, frame in closed],
+                         [(0, 0), (1, 1)])
+        for frame_index, frame in closed:
+            statistics, _ = state['analyzer'].close_frame(
+                frame, START_TIME + 20 + frame_index * FRAME_INTERVAL, 10)
+        self.assertEqual(statistics['total_hit_count'], 11)
+        self.assertEqual(statistics['unique_hosts_lifetime'], 1)
+        self.assertEqual(os.listdir(self._directory), ['monitor.ckpt'])
+
+    def test_resume_processing_time_with_backlog(self):
+        # lines written while stopped are counted in the frames of their dates,
+        # not all at once in the first frame after the restart
+        analyzer = Analyzer(FRAME_INTERVAL, SCENE_INTERVAL, START_TIME)
+        closed = []
+        alerts = []
+
+        def close_frame(frame_index, frame, now):
+            closed.append((frame_index, frame.hit_count))
+            statistics, alert = analyzer.close_frame(frame, now, 2)
+            if alert:
+                alerts.append(alert)
+
+        def records(start, end):
+            return [('/item', '10.0.0.1', 100, 200, float(t), 0) for t in range(int(start), int(end))]
+
+        counter = FrameCounter(FRAME_INTERVAL, START_TIME, range(1), False, close_frame)
+        for i in range(10):
+            counter.add_batch(records(START_TIME + i * 10, START_TIME + (i + 1) * 10))
+            counter.tick(START_TIME + (i + 1) * 10 + 0.5)
+        save_checkpoint(self._path, {'analyzer': analyzer, 'positions': counter.positions,
+                                     'frames': counter.frames})
+        # restarted 100 seconds later
+        state = load_checkpoint(self._path)
+        analyzer = state['analyzer']
+        closed.clear()
+        counter = FrameCounter(FRAME_INTERVAL, START_TIME, range(1), False, close_frame,
+                               state=(state['positions'], state['frames']))
+        # with a line dated before the open frame, as by a skewed clock
+        counter.add_batch(records(START_TIME + 50, START_TIME + 51))
+        counter.add_batch(records(START_TIME + 100, START_TIME + 200))
+        counter.set_position(0, START_TIME + 198.5, 1, 100)
+        counter.tick(START_TIME + 200.5)
+        self.assertTrue(counter.catching_up)
+        counter.add_batch(records(START_TIME + 200, START_TIME + 202))
+        counter.set_position(0, START_TIME + 201, 1, 120)
+        counter.tick(START_TIME + 203)
+        self.assertFalse(counter.catching_up)
+        self.assertEqual(closed, [(10, 11)] + [(index, 10) for index in range(11, 20)])
+        self.assertEqual(alerts, [])
+        # then by processing time
+        self.assertEqual(counter.frames[0], 20)
+        self.assertEqual(counter.frames[1].hit_count, 2)
+
+    def test_resume_with_future_dated_backlog(self):
+        # a line of the backlog dated far ahead does not close the frames up
+        # to its date
+        closed = []
+        counter = FrameCounter(FRAME_INTERVAL, START_TIME, range(1), False,
+                               lambda frame_index, frame, now: closed.append(frame_index),
+                               state=({0: (1, 0)}, (10, make_frame(0))))
+        counter.add_batch([('/item', '10.0.0.1', 100, 200, START_TIME + 150, 0),
+                           ('/item', '10.0.0.1', 100, 200, START_TIME + 10 ** 7, 0)])
+        counter.set_position(0, START_TIME + 10 ** 7, 1, 100)
+        counter.tick(START_TIME + 200.5)
+        self.assertEqual(closed, list(range(10, 20)))
+        self.assertFalse(counter.catching_up)
+        self.assertEqual(counter.frames[0], 20)
+
+    def test_checkpoint_writer(self):
+        writer = CheckpointWriter(self._path)
+        self.assertTrue(writer.save({'positions': {0: (12, 3400)}, 'slow': SlowState()}))
+        # skipped while the forked child writes the previous checkpoint
+        self.assertFalse(writer.save({'positions': {0: (12, 5000)}}))
+        self.assertEqual(writer.skipped, 1)
+        writer.close()
+        self.assertEqual(load_checkpoint(self._path)['positions'], {0: (12, 3400)})
+        self.assertTrue(writer.save({'positions': {0: (12, 6000)}}, wait=True))
+        self.assertEqual(load_checkpoint(self._path)['positions'], {0: (12, 6000)})
+        self.assertEqual(os.listdir(self._directory), ['monitor.ckpt'])
+
+    def test_unusable_checkpoint(self):
+        self.assertIsNone(load_checkpoint(self._path))
+        with open(self._path, 'wb') as checkpoint_file:
+            checkpoint_file.write(b'not a checkpoint')
+        self.assertIsNone(load_checkpoint(self._path))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,122 @@
+import os
+import queue
+import shutil
+import tempfile
+import unittest
+
+from file_watcher import FileWatcher, LogBatcher, AdaptiveSampler, WeightedBatch, \
+    SAMPLING_INCREASE_INTERVAL, SAMPLING_DECREASE_INTERVAL, SAMPLING_BACKLOG
+from inotify import INOTIFY_AVAILABLE
+
+
+class FileWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._filename = os.path.join(self._directory, 'access.log')
+        self.write('before start\n')
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def write(self, text, mode='a'):
+        with open(self._filename, mode) as log_file:
+            log_file.write(text)
+
+    def follow_rotation_and_truncation(self, use_inotify):
+        fw = FileWatcher(self._filename, timeout=0.3, use_inotify=use_inotify)
+        self.assertEqual(fw.readline(), '')
+        self.write('line 1\n')
+        self.assertEqual(fw.readline(), 'line 1\n')
+
+        # rotate, lines written to the old file are read before switching
+        os.rename(self._filename, self._filename + '.1')
+        with open(self._filename + '.1', 'a') as old_file:
+            old_file.write('line 2\n')
+        self.write('line 3\n')
+        self.assertEqual(fw.readline(), 'line 2\n')
+        self.assertEqual(fw.readline(), 'line 3\n')
+
+        # truncate
+        self.write('', 'w')
+        self.assertEqual(fw.readline(), '')
+        self.write('line 4\n')
+        self.assertEqual(fw.readline(), 'line 4\n')
+
+        # missing file coming back
+        os.remove(self._filename)
+        self.assertEqual(fw.readline(), '')
+        self.write('line 5\n')
+        self.assertEqual(fw.readline(), 'line 5\n')
+
+    def test_partial_line(self):
+        fw = FileWatcher(self._filename, timeout=0.3, use_inotify=False)
+        self.write('line 1\nline')
+        self.assertEqual(fw.read_lines(), [b'line 1'])
+        self.assertEqual(fw.read_lines(), [])
+        self.write(' 2\n')
+        self.assertEqual(fw.read_lines(), [b'line 2'])
+
+    def test_resume_at_position(self):
+        fw = FileWatcher(self._filename, timeout=0.3, use_inotify=False)
+        self.write('line 1\nline')
+        self.assertEqual(fw.read_lines(), [b'line 1'])
+        position = fw.position()
+        # written while stopped
+        self.write(' 2\nline 3\n')
+        fw = FileWatcher(self._filename, use_inotify=False, position=position)
+        self.assertEqual(fw.read_lines(), [b'line 2', b'line 3'])
+        # rotated while stopped, the new file is read from its beginning
+        os.rename(self._filename, self._filename + '.1')
+        self.write('line 4\n')
+        fw = FileWatcher(self._filename, use_inotify=False, position=position)
+        self.assertEqual(fw.read_lines(), [b'line 4'])
+
+    def test_polling(self):
+        self.follow_rotation_and_truncation(use_inotify=False)
+
+    @unittest.skipUnless(INOTIFY_AVAILABLE, 'inotify is not available')
+    def test_inotify(self):
+        self.follow_rotation_and_truncation(use_inotify=True)
+
+
+class OverloadTest(unittest.TestCase):
+    def test_drop_when_full(self):
+        log_queue = queue.Queue(1)
+        batcher = LogBatcher(log_queue, batch_size=2, block=False)
+        batcher.extend([('/a', 'host', 1, 200, 0.0, 0)] * 6)
+        batcher.watermark(0, 1.0)
+        self.assertEqual(len(log_queue.get()), 2)
+        self.assertEqual(batcher.dropped, 4)
+        self.assertTrue(log_queue.empty())
+
+    def test_adaptive_sampling(self):
+        log_queue = queue.Queue(4)
+        sampler = AdaptiveSampler(log_queue, 4)
+        batcher = LogBatcher(log_queue, batch_size=1)
+        self.assertEqual(sampler.update(0), 1)
+        for _ in range(3):
+            log_queue.put([])
+        # doubles at most every SAMPLING_INCREASE_INTERVAL
+        self.assertEqual(sampler.update(1), 2)
+        self.assertEqual(sampler.update(1), 2)
+        self.assertEqual(sampler.update(1 + SAMPLING_INCREASE_INTERVAL * 2), 4)
+        # every 4th line, across chunks
+        self.assertEqual(sampler.sample(list(range(6))), [0, 4])
+        self.assertEqual(sampler.sample(list(range(6, 10))), [8])
+        # sampled records carry the rate
+        while not log_queue.empty():
+            log_queue.get()
+        batcher.set_weight(sampler.rate)
+        batcher.add(('/a', 'host', 1, 200, 0.0, 0))
+        batch = log_queue.get()
+        self.assertIsInstance(batch, WeightedBatch)
+        self.assertEqual(batch.weight, 4)
+        # halves slowly once the log queue is empty
+        self.assertEqual(sampler.update(2), 4)
+        self.assertEqual(sampler.update(3 + SAMPLING_DECREASE_INTERVAL), 2)
+        # the backlog of the log file counts as a full log queue
+        self.assertEqual(sampler.update(10, backlog=SAMPLING_BACKLOG), 4)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
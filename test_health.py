@@ -0,0 +1,56 @@
+import glob
+import os
+import signal
+import tempfile
+import time
+import unittest
+
+from health import Health, SamplingProfiler
+
+
+class HealthTest(unittest.TestCase):
+    def test_report(self):
+        for health, sources in ((Health(2, shards=2), [0, 1]),
+                                (Health(), ['a.log', 'b.log'])):
+            now = time.time()
+            health.report(now)
+            health.count_lines(sources[0], 100, 98)
+            health.count_lines(sources[1], 50, 50)
+            health.count_lines(sources[0], 10, 10)
+            health.count_busy(0.5)
+            health.count_frame_close(0.002)
+            report = health.report(now + 10, {sources[0]: 'first'})
+            self.assertEqual(report['sources'], [('first', 110, 2), (sources[1], 50, 0)])
+            self.assertEqual((report['lines'], report['parse_errors']), (160, 2))
+            self.assertAlmostEqual(report['records_per_second'], 15.8)
+            self.assertAlmostEqual(report['busy'][0], 0.05)
+            self.assertAlmostEqual(report['frame_close_ms'], 2)
+            # rates and busy shares are since the last report
+            report = health.report(now + 20)
+            self.assertEqual((report['lines_per_second'], report['busy'][0]), (0, 0))
+            health.count_busy(1.0)
+            report = health.report(now + 30)
+            self.assertAlmostEqual(report['busy'][0], 0.1)
+
+    def test_profiler(self):
+        with tempfile.TemporaryDirectory() as directory:
+            SamplingProfiler(directory).install()
+            try:
+                os.kill(os.getpid(), signal.SIGUSR1)
+                deadline = time.process_time() + 0.3
+                while time.process_time() < deadline:
+                    sum(range(1000))
+                os.kill(os.getpid(), signal.SIGUSR1)
+                profiles = glob.glob(os.path.join(directory, 'profile-*.txt'))
+                self.assertEqual(len(profiles), 1)
+                with open(profiles[0]) as profile:
+                    stack, count = profile.readline().rsplit(' ', 1)
+                self.assertIn('test_health.py:test_profiler', stack)
+                self.assertGreater(int(count), 0)
+            finally:
+                for signum in (signal.SIGUSR1, signal.SIGPROF, signal.SIGALRM):
+                    signal.signal(signum, signal.SIG_DFL)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -1,9 +1,12 @@
+import os
+import signal
+import tempfile
 import unittest
 from multiprocessing import Value, Process
-import queue
 import time
 from monitor import Monitor
 from file_watcher import LogItem
+from traffic_generator import BulkLogGenerator
 
 
 class LogQProducer(object):
@@ -37,45 +40,17 @@ class LogQProducer(object):
                            8000,
                            '/item'
                            )
-            self._log_q.put(item)
+            self._log_q.put([item.to_record()])
             time.sleep(self._sleep_interval.value)
 
     def set_lps(self, lps):
         self._sleep_interval.value = 1.0 / lps
 
 
-class AlertQConsumer(object):
-    def __init__(self, alert_q):
-        self._alert_on = Value('b', 0)
-        self._alert_q = alert_q
-        self._get_timeout = 1
-        self._consumer_proc = None
-        self._running = Value('b', 1)
-
-    def start(self):
-        self._running.value = 1
-        self._consumer_proc = Process(target=self.consume)
-        self._consumer_proc.start()
-
-    def consume(self):
-        while self._running.value == 1:
-            try:
-                item = self._alert_q.get(timeout=self._get_timeout)
-                if item and item[0]:
-                    self._alert_on.value = 1
-                elif item and not item[0]:
-                    self._alert_on.value = 0
-            except queue.Empty:
-                continue
-
-    def stop(self):
-        self._running.value = 0
-
-    def wait_for_finish(self):
-        self._consumer_proc.join()
-
-    def alert_on(self):
-        return self._alert_on.value == 1
+def alert_on(statistics):
+    # the latest alerts are published with the statistics
+    alerts = statistics.get('alerts', [])
+    return bool(alerts) and alerts[-1][0]
 
 
 # shorter duration for faster testing
@@ -88,28 +63,22 @@ class MonitorTest(unittest.TestCase):
         self._threshold = 10
         # shorter duration for faster testing
         self._monitor = Monitor([], self._threshold,
-                                FRAME_INTERVAL, SCENE_INTERVAL)
+                                FRAME_INTERVAL, SCENE_INTERVAL, ui=False)
         self._log_producer = LogQProducer(self._monitor._log_q)
-        self._alert_consumer = AlertQConsumer(self._monitor._alert_q)
 
     def tearDown(self):
         self._log_producer.stop()
         self._log_producer.wait_for_finish()
-        self._alert_consumer.stop()
-        self._alert_consumer.wait_for_finish()
         self._monitor.stop()
         self._monitor.wait_for_finish()
 
     def test_alert_on_and_off(self):
-        self._alert_consumer.start()
-        self.assertFalse(self._alert_consumer.alert_on())
         self._monitor.initialize()
-        ui_proc = self._monitor._processes.pop()
         self._monitor.start()
         self._log_producer.set_lps(1)
         self._log_producer.start()
         time.sleep(SCENE_INTERVAL)
-        self.assertFalse(self._alert_consumer.alert_on())
+        self.assertFalse(alert_on(self._monitor._aggregated_statistics))
         # increase traffic
         self._log_producer.set_lps(90)
         lps_scene = 0
@@ -124,7 +93,7 @@ class MonitorTest(unittest.TestCase):
 
         # check alert
         time.sleep(1)
-        self.assertTrue(self._alert_consumer.alert_on())
+        self.assertTrue(alert_on(self._monitor._aggregated_statistics))
 
         # drop traffic and wait alert release condition met
         self._log_producer.set_lps(1)
@@ -136,7 +105,68 @@ class MonitorTest(unittest.TestCase):
 
         # check alert is off
         time.sleep(1)
-        self.assertFalse(self._alert_consumer.alert_on())
+        self.assertFalse(alert_on(self._monitor._aggregated_statistics))
+
+
+class PipelineTest(unittest.TestCase):
+    def test_bulk_lines_are_counted(self):
+        # lines appended to a watched file reach the published statistics
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'access.log')
+            open(filename, 'w').close()
+            monitor = Monitor([filename], 10, 0.2, 0.8, ui=False)
+            monitor.initialize()
+            monitor.start()
+            generator = BulkLogGenerator(filename, 20000, pool_lines=1000)
+            generator.run(lines=10000)
+            generator.close()
+            deadline = time.time() + 10
+            while monitor._aggregated_statistics.get('total_hit_count', 0) < 10000 and \
+                    time.time() < deadline:
+                time.sleep(0.1)
+            counted = monitor._aggregated_statistics.get('total_hit_count', 0)
+            health = monitor._aggregated_statistics.get('health')
+            monitor.stop()
+            monitor.wait_for_finish()
+        self.assertEqual(counted, 10000)
+        self.assertEqual(health['sources'], [[filename, 10000, 0]])
+
+    def stop_with_full_queue(self, transport):
+        # File Watchers blocked on a full log queue stop with the monitor
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'access.log')
+            open(filename, 'w').close()
+            monitor = Monitor([filename], 10, 0.2, 0.8, ui=False, transport=transport)
+            monitor.initialize()
+            monitor.start()
+            watcher, aggregator = monitor._processes
+            os.kill(aggregator.pid, signal.SIGSTOP)
+            try:
+                generator = BulkLogGenerator(filename, pool_lines=1000)
+                generator.write_lines(400000)
+                generator.close()
+                log_q = monitor._log_q
+                capacity = getattr(log_q, 'capacity', None)
+                deadline = time.time() + 20
+                while time.time() < deadline and not (
+                        log_q.qsize() > capacity - 1000 if capacity else log_q.full()):
+                    time.sleep(0.1)
+                monitor.stop()
+            finally:
+                os.kill(aggregator.pid, signal.SIGCONT)
+            for proc in monitor._processes:
+                proc.join(10)
+            alive = [proc for proc in monitor._processes if proc.is_alive()]
+            for proc in alive:
+                proc.kill()
+            monitor.wait_for_finish()
+        self.assertEqual(alive, [])
+
+    def test_stop_with_full_queue(self):
+        self.stop_with_full_queue('queue')
+
+    def test_stop_with_full_ring(self):
+        self.stop_with_full_queue('shm')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,66 @@
+import unittest
+
+from parser import LogParser, timestamp_from_date
+from sketches import hash64
+
+COMMON_LINE = '9.169.248.247 - - [12/Dec/2015:18:25:11 +0100] "GET /administrator/index.php HTTP/1.1" 200 4263'
+COMBINED_LINE = COMMON_LINE + \
+    ' "-" "Mozilla/5.0 (Windows NT 6.0; rv:34.0) Gecko/20100101 Firefox/34.0" "-"'
+JSON_LINE = '{"remote_addr": "9.169.248.247", "time_local": "12/Dec/2015:18:25:11 +0100", "request": "GET /administrator/index.php HTTP/1.1", "status": "200", "body_bytes_sent": 4263}'
+RECORD = ('/administrator', '9.169.248.247', 4263, 200, 1449941111.0,
+          hash64('/administrator/index.php'))
+
+
+class LogParserTest(unittest.TestCase):
+    def test_timestamp_from_date(self):
+        self.assertEqual(timestamp_from_date(
+            '[12/Dec/2015:18:25:11 +0100]'), 1449941111.0)
+        self.assertEqual(timestamp_from_date(
+            b'[12/Dec/2015:16:25:11 -0100]'), 1449941111.0)
+        self.assertEqual(timestamp_from_date('[garbage]'), 0.0)
+
+    def test_formats(self):
+        for log_format, line in (('common', COMMON_LINE),
+                                 ('combined', COMBINED_LINE),
+                                 ('json', JSON_LINE)):
+            for binary in (False, True):
+                parser = LogParser(log_format=log_format, binary=binary)
+                record = parser.parse_record(
+                    line.encode('utf-8') if binary else line)
+                self.assertEqual(record, RECORD, (log_format, binary))
+
+    def test_malformed_lines(self):
+        parser = LogParser()
+        self.assertIsNone(parser.parse_record('garbage'))
+        self.assertEqual(parser.parse_record(
+            '9.169.248.247 - - [12/Dec/2015:18:25:11 +0100] "-" 400 -'),
+            ('', '9.169.248.247', 0, 400, 1449941111.0, hash64('')))
+        self.assertIsNone(LogParser(log_format='json').parse_record('{"x": 1'))
+
+    def test_json_field_types(self):
+        parser = LogParser(log_format='json')
+        for line in ('{"request": null}', '{"request": 1}', '{"request": ["GET / HTTP/1.1"]}',
+                     '{"request": "GET / HTTP/1.1", "remote_addr": {"ip": "10.0.0.1"}}',
+                     '["GET / HTTP/1.1"]', '"GET / HTTP/1.1"', '1'):
+            self.assertIsNone(parser.parse_record(line), line)
+        # fields of other types count as missing
+        self.assertEqual(parser.parse_record(
+            '{"request": "GET /a/b HTTP/1.1", "status": null, "body_bytes_sent": [1], '
+            '"time_local": {"t": 1}}'), ('/a', '', 0, 0, 0.0, hash64('/a/b')))
+
+    def test_out_of_range_lines(self):
+        # status and size which do not fit the records of the shared ring
+        for status, size in (('200000', '1'), ('200', '1' * 25)):
+            line = COMMON_LINE.replace('200 4263', f'{status} {size}')
+            for binary in (False, True):
+                self.assertIsNone(LogParser(binary=binary).parse_record(
+                    line.encode('utf-8') if binary else line))
+        parser = LogParser(log_format='json')
+        for field, value in (('status', '70000'), ('body_bytes_sent', -1),
+                             ('body_bytes_sent', 2 ** 64)):
+            line = JSON_LINE.replace('}', f', "{field}": {value!r}}}'.replace("'", '"'))
+            self.assertIsNone(parser.parse_record(line), line)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
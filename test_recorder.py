@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+
+from analyzer import FrameStats
+from recorder import Recorder, read_records, RESOLUTION_FRAMES, RESOLUTION_MINUTES, \
+    RESOLUTION_HOURS, ALERT_ON, ALERT_OFF
+
+# 23:58:00 UTC, the records span two days
+START_TIME = 1449964680.0
+FRAME_INTERVAL = 10
+
+
+def make_frame(hits):
+    frame = FrameStats()
+    frame.add_batch([('/item', '10.0.0.1', 100, 200, START_TIME, 0)] * hits +
+                    [('/other', '10.0.0.2', 10, 200, START_TIME, 0)])
+    return frame
+
+
+class RecorderTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        recorder = Recorder(self._directory.name)
+        # 5 minutes of frames with i + 1 hits of /item, an alert in the 3rd minute
+        # and a rule going on as the alert goes off in the 5th minute
+        for i in range(30):
+            alerts = []
+            if i == 13:
+                alerts = [(True, 'on')]
+            elif i == 16:
+                alerts = [(False, 'off')]
+            elif i == 25:
+                alerts = [(True, 'on'), (False, 'rule off')]
+            recorder.record_frame(START_TIME + (i + 1) * FRAME_INTERVAL, FRAME_INTERVAL,
+                                  make_frame(i + 1), {'lps_scene': i, 'lps_lifetime': 1}, alerts)
+        recorder.close()
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_files_per_day(self):
+        self.assertEqual(sorted(os.listdir(self._directory.name)), [
+            '2015-12-12.frames', '2015-12-12.hours', '2015-12-12.minutes',
+            '2015-12-13.frames', '2015-12-13.hours', '2015-12-13.minutes'])
+
+    def test_read_frames(self):
+        records = list(read_records(self._directory.name, START_TIME + 55,
+                                    START_TIME + 150, RESOLUTION_FRAMES))
+        # frames starting from the one after START_TIME + 55 across midnight
+        self.assertEqual([record['start_time'] for record in records],
+                         [START_TIME + 10 * i for i in range(6, 15)])
+        self.assertEqual(records[0]['hit_count'], 8)
+        self.assertEqual(records[0]['top_sections'], [('/item', 7), ('/other', 1)])
+        self.assertEqual(records[0]['top_hosts'], [('10.0.0.1', 700), ('10.0.0.2', 10)])
+
+    def test_rollups(self):
+        minutes = list(read_records(self._directory.name, START_TIME,
+                                    START_TIME + 3600, RESOLUTION_MINUTES))
+        self.assertEqual(len(minutes), 5)
+        self.assertEqual(minutes[0]['hit_count'], sum(range(1, 7)) + 6)
+        self.assertEqual(minutes[0]['lps_scene'], 5)
+        self.assertEqual([minute['alert'] for minute in minutes],
+                         [0, 0, ALERT_ON | ALERT_OFF, 0, ALERT_ON | ALERT_OFF])
+        hours = list(read_records(self._directory.name, START_TIME - 3600,
+                                  START_TIME + 3600, RESOLUTION_HOURS))
+        self.assertEqual([hour['hit_count'] for hour in hours],
+                         [sum(range(1, 13)) + 12, sum(range(13, 31)) + 18])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,93 @@
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from alert_rules import parse_rules
+from recorder import ALERT_OFF, ALERT_ON, Recorder, read_records
+from replay import Replay
+
+START_TIME = 1449941110
+LINE = '10.0.0.{} - - [{}] "GET /item/{} HTTP/1.1" 200 100\n'
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._filename = os.path.join(self._directory.name, 'access.log')
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def write_log(self, lines_per_second):
+        with open(self._filename, 'w') as log_file:
+            for second, count in enumerate(lines_per_second):
+                date = time.strftime('%d/%b/%Y:%H:%M:%S +0000',
+                                     time.gmtime(START_TIME + second))
+                for i in range(count):
+                    log_file.write(LINE.format(i % 5, date, i % 3))
+
+    def replay(self, rules=None, recorder=None):
+        output = io.StringIO()
+        Replay(self._filename, output, 10, 10, 40, recorder=recorder, rules=rules).run()
+        return [json.loads(line) for line in output.getvalue().splitlines()]
+
+    def test_frames_follow_log_dates(self):
+        # 1 line per second, nothing for 30 seconds, then 3 lines per second
+        self.write_log([1] * 20 + [0] * 30 + [3] * 10)
+        frames = [item for item in self.replay() if item['type'] == 'frame']
+        self.assertEqual([frame['frame_end_time'] for frame in frames],
+                         [START_TIME + 10 * (i + 1) for i in range(6)])
+        self.assertEqual([frame['lps_frame'] for frame in frames],
+                         [1, 1, 0, 0, 0, 3])
+        self.assertEqual(frames[-1]['total_hit_count'], 50)
+        self.assertEqual(frames[-1]['unique_hosts_frame'], 3)
+
+    def test_alerts(self):
+        self.write_log([1] * 60 + [50] * 40 + [1] * 60)
+        alerts = [item for item in self.replay() if item['type'] == 'alert']
+        self.assertTrue(alerts[0]['alert_on'])
+        self.assertEqual(alerts[0]['time'], START_TIME + 80)
+        self.assertFalse(alerts[-1]['alert_on'])
+        self.assertEqual([alert['alert_on'] for alert in alerts].count(False), 1)
+
+    def test_overlong_and_future_lines(self):
+        self.write_log([1] * 30)
+        with open(self._filename) as log_file:
+            lines = log_file.readlines()
+        # a line longer than a read chunk, and a line dated far in the future
+        future = time.strftime('%d/%b/%Y:%H:%M:%S +0000', time.gmtime(START_TIME + 10 ** 9))
+        with open(self._filename, 'w') as log_file:
+            log_file.writelines(lines[:10])
+            log_file.write('x' * 2 * 1024 * 1024 + '\n')
+            log_file.write(LINE.format(0, future, 0))
+            log_file.writelines(lines[10:])
+        frames = [item for item in self.replay() if item['type'] == 'frame']
+        self.assertEqual(len(frames), 3)
+        self.assertEqual(frames[-1]['total_hit_count'], 30)
+        self.assertEqual(frames[-1]['late_log_count'], 1)
+
+    def test_traffic_rules(self):
+        # a 3 seconds burst within a frame
+        self.write_log([1] * 14 + [50] * 3 + [1] * 23)
+        rules = parse_rules('[burst]\nrule = traffic\nwindow = 3s\nabove = 20\n', 10)
+        alerts = [item for item in self.replay(rules) if item['type'] == 'alert']
+        self.assertEqual([(alert['alert_on'], alert['time'] - START_TIME) for alert in alerts],
+                         [(True, 15), (False, 19)])
+
+    def test_traffic_rules_recorded(self):
+        # the alerts of the burst are recorded with the frame they went on in
+        self.write_log([1] * 14 + [50] * 3 + [1] * 23)
+        rules = parse_rules('[burst]\nrule = traffic\nwindow = 3s\nabove = 20\n', 10)
+        recorder = Recorder(self._directory.name)
+        self.replay(rules, recorder)
+        recorder.close()
+        records = read_records(self._directory.name, START_TIME, START_TIME + 40)
+        self.assertEqual([record['alert'] for record in records],
+                         [0, ALERT_ON | ALERT_OFF, 0, 0])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,86 @@
+import unittest
+import queue
+from multiprocessing import Process
+
+from file_watcher import WeightedBatch
+from ring_buffer import SharedRingBuffer
+
+
+def produce(ring, producer_index, batches):
+    for i in range(batches):
+        ring.put([(f'/section{i % 7}', f'10.0.{producer_index}.{i % 13}', i, 200, 1.5, i)] * 3)
+
+
+class SharedRingBufferTest(unittest.TestCase):
+    def setUp(self):
+        # small capacity so that batches wrap around the end of the ring
+        self._ring = SharedRingBuffer(capacity=50)
+
+    def tearDown(self):
+        self._ring.close()
+        self._ring.unlink()
+
+    def test_multiple_producers(self):
+        producers = [Process(target=produce, args=(self._ring, index, 300))
+                     for index in range(3)]
+        for proc in producers:
+            proc.start()
+        records = []
+        while len(records) < 3 * 3 * 300:
+            records.extend(self._ring.get(timeout=5))
+        for proc in producers:
+            proc.join()
+        self.assertEqual(sum(size for _, _, size, _, _, _ in records),
+                         3 * 3 * sum(range(300)))
+        self.assertEqual({section for section, _, _, _, _, _ in records},
+                         {f'/section{i}' for i in range(7)})
+        self.assertEqual(len({host for _, host, _, _, _, _ in records}), 3 * 13)
+        self.assertRaises(queue.Empty, self._ring.get, timeout=0.1)
+
+    def test_full(self):
+        ring = SharedRingBuffer(capacity=10)
+        try:
+            ring.put([('/a', 'host', 1, 200, 0.0, 0)] * 3)
+            # header, 2 slots for each name and 3 records fill 8 of 10 slots
+            self.assertRaises(queue.Full, ring.put, [('/a', 'host', 1, 200, 0.0, 0)] * 3,
+                              block=False)
+            self.assertRaises(queue.Full, ring.put, [('/a', 'host', 1, 200, 0.0, 0)] * 3,
+                              timeout=0.05)
+            self.assertEqual(len(ring.get()), 3)
+        finally:
+            ring.close()
+            ring.unlink()
+
+    def test_watermark(self):
+        self._ring.put([('/a', 'host', 1, 200, 0.0, 0)])
+        self._ring.put((2, 1449941111.5, 2 ** 40, 123456))
+        self.assertEqual(len(self._ring.get()), 1)
+        self.assertEqual(self._ring.get(), (2, 1449941111.5, 2 ** 40, 123456))
+        self.assertTrue(self._ring.empty())
+
+    def test_name_tables_are_bounded(self):
+        ring = SharedRingBuffer(capacity=50, name_table_size=4)
+        try:
+            records = []
+            for i in range(20):
+                ring.put([('/a', f'10.0.0.{i}', i, 200, 0.0, 0),
+                          ('/a', f'10.0.0.{i % 3}', i, 200, 0.0, 0)])
+                records.extend(ring.get())
+            self.assertEqual(records, [record for i in range(20) for record in (
+                ('/a', f'10.0.0.{i}', i, 200, 0.0, 0), ('/a', f'10.0.0.{i % 3}', i, 200, 0.0, 0))])
+            self.assertLessEqual(len(ring._host_ids), 4)
+            self.assertLessEqual(max(len(hosts) for hosts in ring._hosts.values()), 4)
+        finally:
+            ring.close()
+            ring.unlink()
+
+    def test_weighted_batch(self):
+        self._ring.put(WeightedBatch([('/a', 'host', 1, 200, 0.0, 0)] * 2, 8))
+        self._ring.put([('/a', 'host', 1, 200, 0.0, 0)])
+        batch = self._ring.get()
+        self.assertEqual((len(batch), batch.weight), (2, 8))
+        self.assertFalse(hasattr(self._ring.get(), 'weight'))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
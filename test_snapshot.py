@@ -0,0 +1,41 @@
+import unittest
+from multiprocessing import Process
+
+from snapshot import SharedSnapshot
+
+
+def publish(snapshot, count):
+    for i in range(count):
+        snapshot.publish({'version': i, 'values': [i] * (i % 100)})
+
+
+class SharedSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self._snapshot = SharedSnapshot(size=4096)
+
+    def tearDown(self):
+        self._snapshot.close()
+        self._snapshot.unlink()
+
+    def test_consistent_reads(self):
+        self.assertEqual(self._snapshot.get('version', -1), -1)
+        writer = Process(target=publish, args=(self._snapshot, 2000))
+        writer.start()
+        last_version = -1
+        while writer.is_alive() or last_version < 1999:
+            statistics = self._snapshot.snapshot()
+            if statistics:
+                version = statistics['version']
+                self.assertEqual(statistics['values'], [version] * (version % 100))
+                self.assertGreaterEqual(version, last_version)
+                last_version = version
+        writer.join()
+        self.assertEqual(self._snapshot['version'], 1999)
+        self.assertEqual(self._snapshot.version, 2000)
+
+    def test_too_large(self):
+        self.assertRaises(ValueError, self._snapshot.publish, {'x': 'x' * 5000})
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from multiprocessing import Process, Value
+
+from snapshot import SharedSnapshot
+from snapshot_server import SnapshotServer, SnapshotClient
+
+
+class SnapshotServerTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._path = os.path.join(self._directory, 'monitor.sock')
+        self._snapshot = SharedSnapshot(size=4096)
+        self._running = Value('b', 1)
+        server = SnapshotServer(self._path, self._snapshot)
+        self._server_proc = Process(target=server.serve, args=(self._running, ))
+        self._server_proc.start()
+        while not os.path.exists(self._path):
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self._running.value = 0
+        self._server_proc.join()
+        self._snapshot.close()
+        self._snapshot.unlink()
+        shutil.rmtree(self._directory)
+
+    def test_attach_and_detach(self):
+        clients = [SnapshotClient(self._path) for _ in range(3)]
+        self.assertEqual(clients[0].snapshot(), {})
+        self._snapshot.publish({'lps_frame': 1.5})
+        for client in clients:
+            self.assertEqual(client.get('lps_frame'), 1.5)
+        # a client detaching does not disturb the others
+        clients.pop().close()
+        self._snapshot.publish({'lps_frame': 2.5})
+        for client in clients:
+            self.assertEqual(client.get('lps_frame'), 2.5)
+            self.assertTrue(client.attached)
+        # the last snapshot is kept once the monitor is gone
+        self._running.value = 0
+        self._server_proc.join()
+        self.assertEqual(clients[0].get('lps_frame'), 2.5)
+        self.assertFalse(clients[0].attached)
+        self.assertFalse(os.path.exists(self._path))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,64 @@
+import random
+import unittest
+
+from time_wheel import TimeWheel, SlidingWindows, parse_window, format_window, WHEEL_SPAN
+
+START_TIME = 1000000.0
+
+
+class TimeWheelTest(unittest.TestCase):
+    def test_windows_match_recounting(self):
+        wheel = TimeWheel(START_TIME)
+        rng = random.Random(7)
+        records = []
+        now = START_TIME
+        # two hours with idle gaps, longer than the 1s and 10s levels
+        while now < START_TIME + 7200:
+            now = now + rng.choice((0.3, 0.7, 2.5, 45, 400))
+            hits = rng.randint(1, 10)
+            records.append((now, hits))
+            wheel.add(now, (hits, hits * 100, 0))
+        for window, resolution in ((1, 1), (30, 1), (60, 1), (300, 10), (3600, 10),
+                                   (5400, 60), (WHEEL_SPAN, 60)):
+            (hits, size, errors), seconds = wheel.window(window, now)
+            # whole buckets of the level, the current one included
+            bucket_start = (now // resolution - (window // resolution) + 1) * resolution
+            expected = sum(h for t, h in records if t >= bucket_start)
+            self.assertEqual(hits, expected, window)
+            self.assertEqual(size, expected * 100)
+            self.assertAlmostEqual(seconds, min(now - bucket_start, now - START_TIME))
+
+    def test_idle_wheel_is_empty(self):
+        wheel = TimeWheel(START_TIME)
+        wheel.add(START_TIME + 1, (5, 500, 1))
+        (hits, _, _), _ = wheel.window(60, START_TIME + 30)
+        self.assertEqual(hits, 5)
+        # more than a level later, the level is empty
+        (hits, _, _), _ = wheel.window(60, START_TIME + 1000)
+        self.assertEqual(hits, 0)
+        (hits, _, errors), _ = wheel.window(3600, START_TIME + 1000)
+        self.assertEqual((hits, errors), (5, 1))
+        with self.assertRaises(ValueError):
+            wheel.window(WHEEL_SPAN + 1, START_TIME + 1000)
+
+    def test_sliding_windows(self):
+        published = []
+        windows = SlidingWindows([10, 300], 0.5, START_TIME, published.append)
+        windows.add_batch([('/item', '10.0.0.1', 100, 200, START_TIME, 0)] * 3 +
+                          [('/item', '10.0.0.1', 100, 503, START_TIME, 0)], START_TIME + 2.5)
+        windows.tick(START_TIME + 0.4)
+        self.assertEqual(published, [])
+        windows.tick(START_TIME + 5)
+        self.assertEqual(published, [[('10s', 0.8, 80.0, 0.25), ('5m', 0.8, 80.0, 0.25)]])
+
+    def test_parse_window(self):
+        self.assertEqual([parse_window(text) for text in ('30s', '5m', '1h', '1d', '0.5')],
+                         [30, 300, 3600, 86400, 0.5])
+        self.assertEqual([format_window(seconds) for seconds in (30, 300, 3600, 90, 0.5)],
+                         ['30s', '5m', '1h', '90s', '0.5s'])
+        with self.assertRaises(ValueError):
+            parse_window('5x')
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,165 @@
+import math
+from operator import itemgetter
+
+# Counters of the recent traffic at several resolutions, for rates over any
+# sliding window up to a day, unlike frames and scenes which only give two
+# windows of whole frames.
+#
+# A level is a circular buffer of buckets of a fixed duration. Instead of the
+# count of each bucket, a level keeps the running totals since the start, and
+# in each bucket the totals at its end: the counts of the last k buckets are
+# the running totals minus the totals at the end of the bucket k buckets ago,
+# whatever k. Buckets are aligned on the epoch, the current bucket is partial.
+#
+# Each record is added to all levels, a window is answered by the finest level
+# spanning it, in whole buckets of that level.
+
+# (bucket seconds, number of buckets) of each level, finest first
+WHEEL_LEVELS = ((1, 60), (10, 360), (60, 1440))
+WHEEL_SPAN = WHEEL_LEVELS[-1][0] * WHEEL_LEVELS[-1][1]
+# counted for each record
+WHEEL_FIELDS = ('hits', 'bytes', 'errors')
+# windows published by default with --windows, and how often
+DEFAULT_WINDOWS = '30s,5m,1h'
+DEFAULT_WINDOW_REFRESH = 1
+
+WINDOW_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_window(text):
+    # '30s', '5m', '1h' or a number of seconds
+    text = text.strip()
+    unit = WINDOW_UNITS.get(text[-1:])
+    if unit is None:
+        seconds = float(text)
+    else:
+        seconds = float(text[:-1]) * unit
+    if seconds <= 0:
+        raise ValueError(f'window {text} is not positive')
+    return seconds
+
+
+def format_window(seconds):
+    for unit in ('d', 'h', 'm'):
+        if seconds >= WINDOW_UNITS[unit] and seconds % WINDOW_UNITS[unit] == 0:
+            return f'{seconds // WINDOW_UNITS[unit]:.0f}{unit}'
+    return f'{seconds:g}s'
+
+
+class WheelLevel(object):
+    def __init__(self, resolution, size, fields):
+        self.resolution = resolution
+        self.size = size
+        # running totals of each field, including the current bucket
+        self.totals = [0 for _ in range(fields)]
+        # totals at the end of each bucket, for each field
+        self._prefixes = [[0 for _ in range(size)] for _ in range(fields)]
+        # number of the current bucket since the epoch
+        self.bucket = None
+
+    def advance(self, now):
+        bucket = int(now // self.resolution)
+        if self.bucket is None:
+            self.bucket = bucket
+            return
+        # buckets passed without records end with the same totals, only
+        # the last size buckets are kept
+        passed = min(bucket - self.bucket, self.size)
+        for i in range(passed):
+            slot = (bucket - passed + i) % self.size
+            for prefixes, total in zip(self._prefixes, self.totals):
+                prefixes[slot] = total
+        if bucket > self.bucket:
+            self.bucket = bucket
+
+    def add(self, values):
+        totals = self.totals
+        for i, value in enumerate(values):
+            totals[i] = totals[i] + value
+
+    def last(self, buckets):
+        # counts of the last buckets, including the current one
+        slot = (self.bucket - buckets) % self.size
+        return [total - prefixes[slot]
+                for prefixes, total in zip(self._prefixes, self.totals)]
+
+
+class TimeWheel(object):
+    '''
+    Counts of the records over the last minute by second, the last hour by
+    10 seconds and the last day by minute. Records are added at the time they
+    are received, in the current bucket.
+    '''
+
+    def __init__(self, start_time, levels=WHEEL_LEVELS, fields=len(WHEEL_FIELDS)):
+        self._start_time = start_time
+        self._levels = [WheelLevel(resolution, size, fields) for resolution, size in levels]
+        self.advance(start_time)
+
+    @property
+    def span(self):
+        return self._levels[-1].resolution * self._levels[-1].size
+
+    def advance(self, now):
+        for level in self._levels:
+            level.advance(now)
+
+    def add(self, now, values):
+        for level in self._levels:
+            level.advance(now)
+            level.add(values)
+
+    def _level(self, window):
+        for level in self._levels:
+            if window <= level.resolution * level.size:
+                return level
+        raise ValueError(f'window of {window}s exceeds the span of {self.span}s')
+
+    def window(self, window, now):
+        # (counts, seconds covered) of the window ending now, in whole buckets
+        level = self._level(window)
+        self.advance(now)
+        buckets = min(int(math.ceil(window / level.resolution)), level.size)
+        seconds = (buckets - 1) * level.resolution + now - level.bucket * level.resolution
+        return level.last(buckets), min(seconds, now - self._start_time)
+
+
+class SlidingWindows(object):
+    '''
+    Rates over sliding windows, counted into a TimeWheel and published every
+    refresh interval with publish(rows), rows are [(window, lps, bytes per
+    second, ratio of 5xx)] in the order of the windows.
+    '''
+
+    def __init__(self, windows, refresh_interval, start_time, publish):
+        self._wheel = TimeWheel(start_time)
+        for window in windows:
+            if window > self._wheel.span:
+                raise ValueError(f'window of {window}s exceeds the span of {self._wheel.span}s')
+        self._windows = windows
+        self._refresh_interval = refresh_interval
+        self._publish = publish
+        self._next_refresh_time = start_time + refresh_interval
+
+    def add_batch(self, batch, now, weight=1):
+        # records of sampled batches stand for weight records
+        errors = 0
+        for record in batch:
+            if record[3] >= 500:
+                errors = errors + 1
+        self._wheel.add(now, (len(batch) * weight, sum(map(itemgetter(2), batch)) * weight,
+                              errors * weight))
+
+    def rates(self, window, now):
+        # (lps, bytes per second, ratio of 5xx) over the window ending now
+        (hits, size, errors), seconds = self._wheel.window(window, now)
+        seconds = max(seconds, 1e-3)
+        return hits / seconds, size / seconds, errors / hits if hits else 0
+
+    def rows(self, now):
+        return [(format_window(window), ) + self.rates(window, now) for window in self._windows]
+
+    def tick(self, now):
+        if now >= self._next_refresh_time:
+            self._publish(self.rows(now))
+            self._next_refresh_time = now + self._refresh_interval
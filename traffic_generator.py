@@ -9,6 +9,13 @@ from datetime import datetime, timedelta
 DEFAULT_LOG_SOURCE_FILE = 'sample_logs/access.log'
 DEFAULT_OUTPUT_FILE = 'sample_logs/test.log'
 DEFAULT_LPS = 1  # lines per second
+DEFAULT_BULK_LPS = 100000
+BULK_POOL_LINES = 10000  # distinct random lines written over and over
+BULK_WRITE_INTERVAL = 0.01  # seconds between batched writes
+# dates are in the local time zone, like the logs of a web server
+TIMESTAMP_FORMAT = '[%d/%b/%Y:%H:%M:%S %z]'
+# same length as the timestamps, replaced by the time of the writes
+TIMESTAMP_PLACEHOLDER = '[00/___/0000:00:00:00 +0100]'
 
 
 HTTP_METHODS = [
@@ -52,15 +59,24 @@ STATUS = [
 ]
 
 
+def random_log_line(timestamp_str, rng=random):
+    host = ".".join(map(str, (int(rng.random()*255) for _ in range(4))))
+    user = rng.choice(USERNAMES)
+    method = rng.choice(HTTP_METHODS)
+    url = rng.choice(URLS_CANDIDATES)
+    status = rng.choice(STATUS)
+    size = int(rng.random()*80000)
+    return f'{host} - {user} {timestamp_str} "{method} {url}" {status} {size} "-" "Mozilla/5.0 (Windows NT 6.0; rv:34.0) Gecko/20100101 Firefox/34.0" "-"\n'
+
+
 class LogGenerator(object):
     def __init__(self, source_file, dest_file, lps=DEFAULT_LPS):
         self._source_file = source_file
         self._dest_file = dest_file
         self._sleep_duration = 1.0 / lps
         random.seed(time.asctime())
-        self.timestamp = datetime.now()
-        self.timestamp_str = self.timestamp.strftime(
-            '[%d/%b/%Y:%H:%M:%S +0100]')
+        self.timestamp = datetime.now().astimezone()
+        self.timestamp_str = self.timestamp.strftime(TIMESTAMP_FORMAT)
 
     def generate_file(self):
         src_file = open(self._source_file, 'r')
@@ -73,18 +89,10 @@ class LogGenerator(object):
             time.sleep(self._sleep_duration)
 
     def get_random_log_line(self):
-        host = ".".join(map(str, (int(random.random()*255) for _ in range(4))))
-        user = random.choice(USERNAMES)
-        method = random.choice(HTTP_METHODS)
-        url = random.choice(URLS_CANDIDATES)
-        status = random.choice(STATUS)
-        size = int(random.random()*80000)
-
-        if self.timestamp + timedelta(seconds=1) < datetime.now():
-            self.timestamp = datetime.now()
-            self.timestamp_str = self.timestamp.strftime(
-                '[%d/%b/%Y:%H:%M:%S +0100]')
-        return f'{host} - {user} {self.timestamp_str} "{method} {url}" {status} {size} "-" "Mozilla/5.0 (Windows NT 6.0; rv:34.0) Gecko/20100101 Firefox/34.0" "-"\n'
+        if self.timestamp + timedelta(seconds=1) < datetime.now().astimezone():
+            self.timestamp = datetime.now().astimezone()
+            self.timestamp_str = self.timestamp.strftime(TIMESTAMP_FORMAT)
+        return random_log_line(self.timestamp_str)
 
     def generate_random_log(self):
         dest_file = open(self._dest_file, 'a+')
@@ -97,26 +105,95 @@ class LogGenerator(object):
             time.sleep(self._sleep_duration)
 
 
+class BulkLogGenerator(object):
+    '''
+    Appends random lines at rates of hundreds of thousands of lines per
+    second: a pool of lines is rendered once, its timestamps are replaced
+    once per second of the clock and lines are appended in batches, without
+    flush per line nor fsync.
+    '''
+
+    def __init__(self, dest_file, lps=DEFAULT_BULK_LPS, pool_lines=BULK_POOL_LINES, seed=1):
+        rng = random.Random(seed)
+        self._template = ''.join(random_log_line(TIMESTAMP_PLACEHOLDER, rng)
+                                 for _ in range(pool_lines)).encode('utf-8')
+        # byte offsets of the lines of the pool, timestamps keep them
+        self._offsets = [0]
+        for _ in range(pool_lines):
+            self._offsets.append(self._template.index(b'\n', self._offsets[-1]) + 1)
+        self._pool_lines = pool_lines
+        self._lps = lps
+        self._fd = os.open(dest_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._second = None
+        self._pool = None
+        self._position = 0
+        self.line_count = 0
+
+    def close(self):
+        os.close(self._fd)
+
+    def _render(self, now):
+        second = int(now)
+        if second != self._second:
+            self._second = second
+            timestamp_str = time.strftime(TIMESTAMP_FORMAT, time.localtime(second))
+            self._pool = self._template.replace(TIMESTAMP_PLACEHOLDER.encode('utf-8'),
+                                                timestamp_str.encode('utf-8'))
+        return self._pool
+
+    def write_lines(self, count, now=None):
+        # append count lines with one write per pass over the pool
+        pool = self._render(time.time() if now is None else now)
+        offsets = self._offsets
+        while count > 0:
+            end = min(self._pool_lines, self._position + count)
+            os.write(self._fd, pool[offsets[self._position]:offsets[end]])
+            count = count - (end - self._position)
+            self.line_count = self.line_count + end - self._position
+            self._position = end % self._pool_lines
+
+    def run(self, duration=None, lines=None, on_write=None):
+        # append lines at the rate until duration seconds or lines are over,
+        # on_write(now, line_count) is called after each batch
+        start = time.time()
+        first_line = self.line_count
+        now = start
+        while (duration is None or now < start + duration) and \
+                (lines is None or self.line_count - first_line < lines):
+            due = int((now - start) * self._lps) - (self.line_count - first_line)
+            if lines is not None:
+                due = min(due, lines - (self.line_count - first_line))
+            if due > 0:
+                self.write_lines(due, now)
+                if on_write:
+                    on_write(now, self.line_count)
+            time.sleep(max(0, start + (int((now - start) / BULK_WRITE_INTERVAL) + 1) *
+                           BULK_WRITE_INTERVAL - time.time()))
+            now = time.time()
+
+
 def usage():
     print('''
 Write logs from source to destination file with a rate
 -s source file
 -d destination file
 -l lines per second
-''')
+-b bulk random lines at high rates, batched and without fsync, {} lines per second by default
+'''.format(DEFAULT_BULK_LPS))
 
 
 def main():
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'hs:d:l:', [
-                                   'help', 'source=', 'dest=', 'lps='])
+        opts, args = getopt.getopt(sys.argv[1:], 'hs:d:l:b', [
+                                   'help', 'source=', 'dest=', 'lps=', 'bulk'])
     except getopt.GetoptError as err:
         print(err)
         usage()
         sys.exit(2)
     source = None
     destination = None
-    lines_per_second = DEFAULT_LPS
+    lines_per_second = None
+    bulk = False
     for o, a in opts:
         if o == "-v":
             verbose = True
@@ -129,10 +206,19 @@ def main():
             destination = a
         elif o in ("-l", "--lps"):
             lines_per_second = int(a)
+        elif o in ("-b", "--bulk"):
+            bulk = True
         else:
             assert False, "unhandled option"
 
-    lg = LogGenerator(source, destination, lines_per_second)
+    if bulk:
+        lg = BulkLogGenerator(destination, lines_per_second or DEFAULT_BULK_LPS)
+        try:
+            lg.run()
+        except KeyboardInterrupt:
+            lg.close()
+        return
+    lg = LogGenerator(source, destination, lines_per_second or DEFAULT_LPS)
     if source:
         lg.generate_file()
     else:
@@ -1,10 +1,12 @@
 import datetime
+import sys
 import time
-from collections import Counter
 import weakref
 
 import npyscreen
 
+from snapshot_server import SnapshotClient
+
 UI_REFRESH_INTERVAL = 0.5
 
 
@@ -18,7 +20,8 @@ class TitleOneDecimalSlider(npyscreen.TitleSlider):
 
 
 class TrafficBox(npyscreen.BoxTitle):
-    def set_values(self, val_10s, val_2m, val_lifetime):
+    def set_values(self, val_10s, val_2m, val_lifetime,
+                   unique_hosts=(0, 0, 0), unique_paths=(0, 0, 0), sampling=(1, 0)):
         self._10s_value = val_10s
         self._2m_value = val_2m
         self._lifetime_value = val_lifetime
@@ -39,6 +42,14 @@ class TrafficBox(npyscreen.BoxTitle):
         self._slider_2m.value = self._2m_value
         self._slider_lifetime.value = self._lifetime_value
 
+        # distinct counts over 10s / 2m / lifetime
+        self._unique_hosts_text.value = ' / '.join(str(x) for x in unique_hosts)
+        self._unique_paths_text.value = ' / '.join(str(x) for x in unique_paths)
+        # 1 in N records counted during the frame, and the standard error of LPS 10s
+        rate, error = sampling
+        self._sampling_text.value = f'1 in {rate:.1f}, LPS 10s ±{error:.1%}' \
+            if rate > 1 else 'off'
+
     def make_contained_widget(self, contained_widget_arguments=None):
         self._my_widgets = []
         _rely = self.rely+1
@@ -85,6 +96,21 @@ class TrafficBox(npyscreen.BoxTitle):
         )
         self._my_widgets.append(self._slider_lifetime)
         _rely += 1
+        self._unique_hosts_text = npyscreen.TitleFixedText(
+            self.parent, name='Unique Hosts', value='0 / 0 / 0', editable=False,
+            rely=_rely, relx=_relx, max_width=width - 4)
+        self._my_widgets.append(self._unique_hosts_text)
+        _rely += 1
+        self._unique_paths_text = npyscreen.TitleFixedText(
+            self.parent, name='Unique URLs', value='0 / 0 / 0', editable=False,
+            rely=_rely, relx=_relx, max_width=width - 4)
+        self._my_widgets.append(self._unique_paths_text)
+        _rely += 1
+        self._sampling_text = npyscreen.TitleFixedText(
+            self.parent, name='Sampling', value='off', editable=False,
+            rely=_rely, relx=_relx, max_width=width - 4)
+        self._my_widgets.append(self._sampling_text)
+        _rely += 1
 
         self.entry_widget = weakref.proxy(self._my_widgets[0])
 
@@ -94,9 +120,22 @@ class StatusBox(npyscreen.BoxTitle):
     _refresh_time = None
     _next_refresh_time = None
 
-    def set_values(self, timestr, alert_on=None, alert_msg=None, refresh_time=None):
+    def set_values(self, timestr, alert_on=None, alert_msg=None, refresh_time=None,
+                   late_count=None, windows=None, baseline=None):
         # clock
         self._time_text.value = timestr
+        # records dated from closed frames with event time windowing
+        if late_count is not None:
+            self._late_text.value = str(late_count)
+        # LPS over the sliding windows, refreshed between frames
+        if windows:
+            self._windows_text.value = '  '.join(
+                f'{window} {lps:.1f}' for window, lps, _, _ in windows)
+        # LPS and its expected value, with the baseline alert
+        if baseline:
+            self._baseline_text.value = '  '.join(
+                f'{value:.1f} ~ {expected:.1f} ({deviation:+.1f} sd)'
+                for metric, value, expected, deviation in baseline if metric == 'lps')
         # alert
         if not alert_on is None:
             self._alert_on = alert_on
@@ -137,6 +176,55 @@ class StatusBox(npyscreen.BoxTitle):
             self.parent,  name='Refreshing', value=0, out_of=self.REFRESH_SLIDER_MAX, editable=False, rely=_rely, relx=_relx, max_width=width - 4
         )
         self._my_widgets.append(self._refresh_slider)
+        _rely += 1
+        self._late_text = npyscreen.TitleFixedText(
+            self.parent, name='Late Logs', value='0', editable=False, rely=_rely, relx=_relx, max_width=width - 4)
+        self._my_widgets.append(self._late_text)
+        _rely += 1
+        self._windows_text = npyscreen.TitleFixedText(
+            self.parent, name='LPS Windows', value='-', editable=False, rely=_rely, relx=_relx, max_width=width - 4)
+        self._my_widgets.append(self._windows_text)
+        _rely += 1
+        self._baseline_text = npyscreen.TitleFixedText(
+            self.parent, name='LPS Baseline', value='-', editable=False, rely=_rely, relx=_relx, max_width=width - 4)
+        self._my_widgets.append(self._baseline_text)
+        self.entry_widget = weakref.proxy(self._my_widgets[0])
+
+
+class HealthBox(npyscreen.BoxTitle):
+    ROWS = ('Read/Parsed', 'Parse Errors', 'Queue Depth', 'Aggregate', 'Frame Close',
+            'UI Refresh')
+
+    def set_values(self, health, ui_refresh_ms):
+        # counters of the monitor itself, see health.py
+        busy = max(health['busy']) if health['busy'] else 0
+        queue_depth = health['queue_depth']
+        values = (
+            f'{format_size(health["lines_per_second"])} / '
+            f'{format_size(health["records_per_second"])} lines/s',
+            f'{health["parse_errors"]} of {format_size(health["lines"])} lines',
+            ('-' if queue_depth is None else f'{queue_depth} batches') +
+            (f', {format_size(health["dropped"])} dropped' if health['dropped'] else ''),
+            f'{busy:.0%} busy, pid {health["pid"]}',
+            f'{health["frame_close_ms"]:.1f} ms (max {health["frame_close_max_ms"]:.1f})',
+            f'{ui_refresh_ms:.1f} ms',
+        )
+        for text, value in zip(self._texts, values):
+            text.value = value
+
+    def make_contained_widget(self, contained_widget_arguments=None):
+        self._my_widgets = []
+        _rely = self.rely+1
+        _relx = self.relx+2
+        width = self.width
+        self._texts = []
+        for name in self.ROWS:
+            text = npyscreen.TitleFixedText(
+                self.parent, name=name, value='-', editable=False, rely=_rely, relx=_relx,
+                max_width=width - 4)
+            self._my_widgets.append(text)
+            self._texts.append(text)
+            _rely += 1
         self.entry_widget = weakref.proxy(self._my_widgets[0])
 
 
@@ -150,11 +238,38 @@ class BufferPagerBox(npyscreen.BoxTitle):
         return self.entry_widget.buffer(*args, **values)
 
 
+def format_size(size):
+    # 4263 -> "4.3k"
+    for unit in ('', 'k', 'M', 'G'):
+        if size < 999.5:
+            return f'{size:.0f}{unit}' if unit == '' or size >= 10 else f'{size:.1f}{unit}'
+        size = size / 1000
+    return f'{size:.0f}T'
+
+
+def shorten_path(path, width):
+    # the end of a path tells log files apart
+    if len(path) <= width:
+        return path
+    return '...' + path[len(path) - width + 3:]
+
+
+def format_quantiles(row):
+    return '/'.join(format_size(x) for x in row[2:]) if row else '-'
+
+
 class Dashboard(npyscreen.Form):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._stats = kwargs.get('stats', {})
-        self._alert_q = kwargs.get('alert_q', None)
+        # SharedSnapshot, or SnapshotClient of a headless monitor
+        self._snapshot = kwargs.get('stats')
+        # alerts already shown, the snapshot holds the latest ones
+        self._alert_count = 0
+        # version of the frame statistics shown, and content of each box
+        self._frame_version = None
+        self._box_values = dict()
+        # longest refresh of the UI since the last frame, in seconds
+        self._ui_refresh_time = 0.0
 
     def create(self):
         self.keypress_timeout = 10
@@ -164,19 +279,25 @@ class Dashboard(npyscreen.Form):
 
         height, width = self.useable_space()
 
-        height_lps_status_box = 5
+        height_lps_status_box = 8
         rely = 2
         self._lps_box = self.add(TrafficBox, name='Traffic', editable=False,
                                  relx=2,
                                  rely=rely,
-                                 max_width=(width // 2 - 4),
+                                 max_width=(width // 3 - 3),
                                  max_height=height_lps_status_box)
         self._lps_box.set_values(val_10s=0, val_2m=0, val_lifetime=0)
 
         self._status_box = self.add(StatusBox, name="Status", editable=False,
-                                    relx=(width // 2 + 2),
+                                    relx=(width // 3 + 1),
+                                    rely=rely,
+                                    max_width=(width // 3 - 3),
+                                    max_height=height_lps_status_box)
+
+        self._health_box = self.add(HealthBox, name="Monitor Health", editable=False,
+                                    relx=(width * 2 // 3),
                                     rely=rely,
-                                    max_width=(width // 2 - 4),
+                                    max_width=(width // 3 - 3),
                                     max_height=height_lps_status_box)
 
         rely += height_lps_status_box + 2
@@ -186,62 +307,140 @@ class Dashboard(npyscreen.Form):
             relx=2,
             rely=rely,
             max_height=available_height//2,
-            max_width=(width // 2 - 4))
+            max_width=(width // 4 - 3))
+        self._lifetime_section_hit_list = self.add(
+            npyscreen.BoxTitle, name="Popular Sections (lifetime)", editable=True, scroll_exit=True,
+            relx=(width // 4 + 1),
+            rely=rely,
+            max_height=available_height//2,
+            max_width=(width // 4 - 3))
         self._hot_host_list = self.add(
             npyscreen.BoxTitle, name="Top Bandwidth Consumer", editable=True, scroll_exit=True,
-            relx=(width // 2 + 2),
+            relx=(width // 2),
             rely=rely,
             max_height=available_height//2,
-            max_width=(width // 2 - 4))
+            max_width=(width // 4 - 3))
+        self._source_list = self.add(
+            npyscreen.BoxTitle, name="Log Files (LPS 10s)", editable=True, scroll_exit=True,
+            relx=(width * 3 // 4 - 1),
+            rely=rely,
+            max_height=available_height//2,
+            max_width=(width // 4 - 3))
         rely += available_height//2 + 2
         self._alert_list = self.add(
             BufferPagerBox, name="Alerts", editable=False,
             relx=2,
+            rely=rely,
             max_height=available_height//2,
+            max_width=(width // 2 - 4),
             color='WARNING')
+        self._size_list = self.add(
+            npyscreen.BoxTitle, name="Response Size p50/p95/p99 (10s | 2m)",
+            editable=True, scroll_exit=True,
+            relx=(width // 2 + 2),
+            rely=rely,
+            max_height=available_height//2,
+            max_width=(width // 2 - 4))
 
     def afterEditing(self):
         self.parentApp.NEXT_ACTIVE_FORM = None
 
     def while_waiting(self):
-        self._lps_box.set_values(
-            val_10s=self._stats.get('lps_frame', 0),
-            val_2m=self._stats.get('lps_scene', 0),
-            val_lifetime=self._stats.get('lps_lifetime', 0)
-        )
-        self._lps_box.display()
-
-        next_refresh_time = self._stats.get(
-            'next_aggregate_time', datetime.datetime.now())
+        start = time.perf_counter()
+        stats = self._snapshot.snapshot()
+        # the clock and the refresh slider tick on their own
+        next_refresh_time = datetime.datetime.fromtimestamp(
+            stats.get('next_aggregate_time', time.time()))
+        timestr = time.asctime()
+        if getattr(self._snapshot, 'attached', True) is False:
+            timestr = timestr + ' (detached)'
         self._status_box.set_values(
-            timestr=time.asctime(), refresh_time=next_refresh_time)
+            timestr=timestr, refresh_time=next_refresh_time,
+            late_count=stats.get('late_log_count', 0), windows=stats.get('windows'),
+            baseline=stats.get('baseline'))
+        # tick as often as the sliding windows are published, in tenths of seconds
+        refresh_interval = stats.get('refresh_interval')
+        if refresh_interval:
+            self.keypress_timeout = max(1, min(10, int(refresh_interval * 10)))
+
+        # the rest changes once per frame, and only the boxes whose
+        # content changed are drawn again
+        frame_version = stats.get('frame_version', 0)
+        if frame_version != self._frame_version:
+            self._frame_version = frame_version
+            self._update_frame_boxes(stats, timestr, next_refresh_time)
         self._status_box.display()
-
-        section_heatmap = self._stats.get('heat_map_frame', {})
-        top_sections = Counter(section_heatmap).most_common()
-        top_sections_hits_str = [
-            f'{x[0]} {x[1]}' for x in top_sections
-        ]
-        self._section_hit_list.values = top_sections_hits_str
-        self._section_hit_list.display()
-
-        host_heatmap = self._stats.get('host_heat_map', {})
-        top_hosts = Counter(host_heatmap).most_common(50)
-        top_hosts_str = [
-            f'{x[1]:10d} - {x[0]}' for x in top_hosts
-        ]
-        self._hot_host_list.values = top_hosts_str
-        self._hot_host_list.display()
-
-        if self._alert_q and not self._alert_q.empty():
-            alert_item = self._alert_q.get()
-            alert_on = alert_item[0]
-            alert_msg = alert_item[1]
-            self._alert_list.buffer([alert_msg, ], scroll_end=True)
+        self._ui_refresh_time = max(self._ui_refresh_time, time.perf_counter() - start)
+
+    def _update_box(self, box, values):
+        if values != self._box_values.get(box.name):
+            self._box_values[box.name] = values
+            box.values = values
+            box.display()
+
+    def _update_frame_boxes(self, stats, timestr, next_refresh_time):
+        traffic = (stats.get('lps_frame', 0), stats.get('lps_scene', 0),
+                   stats.get('lps_lifetime', 0),
+                   [stats.get(f'unique_hosts_{window}', 0)
+                    for window in ('frame', 'scene', 'lifetime')],
+                   [stats.get(f'unique_paths_{window}', 0)
+                    for window in ('frame', 'scene', 'lifetime')],
+                   (stats.get('sampling_rate', 1), stats.get('sampling_error', 0)))
+        if traffic != self._box_values.get(self._lps_box.name):
+            self._box_values[self._lps_box.name] = traffic
+            self._lps_box.set_values(*traffic)
+            self._lps_box.display()
+
+        # rankings are sorted and truncated by Analyzer
+        self._update_box(self._section_hit_list, [
+            f'{x[0]} {x[1]}' for x in stats.get('top_sections_frame', [])
+        ])
+        self._update_box(self._lifetime_section_hit_list, [
+            f'{x[0]} {x[1]} ±{x[2]}' if x[2] else f'{x[0]} {x[1]}'
+            for x in stats.get('top_sections_lifetime', [])
+        ])
+        # with the error of heavy hitters estimation
+        self._update_box(self._hot_host_list, [
+            f'{x[1]:10d} ±{x[2]} - {x[0]}' if x[2] else f'{x[1]:10d} - {x[0]}'
+            for x in stats.get('top_hosts', [])
+        ])
+
+        if 'health' in stats:
+            self._health_box.set_values(stats['health'], self._ui_refresh_time * 1000)
+            self._health_box.display()
+            self._ui_refresh_time = 0.0
+
+        # log files by rate, with the end of their path when too long
+        path_width = self._source_list.width - 16
+        self._update_box(self._source_list, [
+            f'{x[1]:8.1f} - {shorten_path(x[0], path_width)}'
+            for x in stats.get('top_sources_frame', [])
+        ])
+
+        # sections of the scene, the first row is all sections
+        frame_sizes = {row[0]: row for row in stats.get(
+            'size_quantiles_frame', [])}
+        self._update_box(self._size_list, [
+            f'{row[0]:<20} {format_quantiles(frame_sizes.get(row[0])):>18} | {format_quantiles(row)}'
+            for row in stats.get('size_quantiles_scene', [])
+        ])
+
+        alert_count = stats.get('alert_count', 0)
+        if alert_count < self._alert_count:
+            # the monitor restarted
+            self._alert_count = 0
+        if alert_count > self._alert_count:
+            new_alerts = stats.get('alerts', [])[self._alert_count - alert_count:]
+            self._alert_count = alert_count
+            self._alert_list.buffer([alert_msg for _, alert_msg in new_alerts],
+                                    scroll_end=True)
             self._alert_list.display()
+            alert_on, alert_msg = new_alerts[-1]
+            if 'alerts_firing' in stats:
+                # on while any alert rule is
+                alert_on = stats['alerts_firing'] > 0
             self._status_box.set_values(
-                timestr=time.asctime(), alert_on=alert_on, alert_msg=alert_msg, refresh_time=next_refresh_time)
-            self._status_box.display()
+                timestr=timestr, alert_on=alert_on, alert_msg=alert_msg, refresh_time=next_refresh_time)
 
     def exit_application(self):
         self.parentApp.setNextForm(None)
@@ -250,26 +449,29 @@ class Dashboard(npyscreen.Form):
 
 
 class MonitorUI(npyscreen.NPSAppManaged):
-    def __init__(self, stats_dict={}, alert_q=None, running=None):
+    # running is None when attached to a headless monitor, which keeps
+    # running when the UI exits
+    def __init__(self, snapshot, running=None):
         super().__init__()
-        self._stats_dict = stats_dict
+        self._snapshot = snapshot
         self._running = running
-        self._alert_q = alert_q
 
     def onStart(self):
         self.addForm('MAIN', Dashboard, name='HTTP Log Monitor',
-                     stats=self._stats_dict, alert_q=self._alert_q)
+                     stats=self._snapshot)
 
     def signal_exit(self):
-        self._running.value = 0
+        if self._running is not None:
+            self._running.value = 0
 
     def onCleanExit(self):
         self.signal_exit()
 
 
 if __name__ == '__main__':
-    stats = {
-        'lps_frame': 1.5,
-    }
-    ui = MonitorUI(stats)
+    # attach to a monitor started with --socket
+    if len(sys.argv) != 2:
+        print('usage: user_interface.py monitor.sock')
+        sys.exit(2)
+    ui = MonitorUI(SnapshotClient(sys.argv[1]))
     ui.run()